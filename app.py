@@ -1,25 +1,83 @@
 import os
+import time
 from dotenv import load_dotenv
 from waitress import serve
-from flask import Flask, request, abort, url_for, redirect
-from src import get_exchange_rate_api
+from flask import Flask, Response, g, request, abort, url_for, redirect, stream_with_context
 
 
+# load .env before importing `src`, whose modules read their settings at import time
 load_dotenv()
+from src import export_history, get_cross_rate, get_exchange_rate_payload, get_history, get_snapshot, lookup_batch
+from src import convert_ledger, get_broadcaster, parse_topics, pipeline, Scheduler
+from src import metrics
+from src.export import FORMATS as EXPORT_FORMATS
+from src.ledger import FORMATS as LEDGER_FORMATS
+from src.snapshot import encode_response
+
+
 app = Flask(__name__)
 API_PREFIX = os.getenv('FLASK_API_URL_PREFIX', '/api')
+STORAGE = os.getenv('STORAGE_PATH', 'assets/')
+URL = os.getenv('ICBC_URL', 'https://www.icbc.com.cn/ICBCDynamicSite/Optimize/Quotation/QuotationListIframe.aspx')
+# run the pipeline inside the server process, requests are then always served from storage
+SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', 'false').lower() == 'true'
+# worker of a producer process that shares its snapshots (see src/shared.py), never scrape either
+SHARED_SNAPSHOT = bool(os.getenv('SHARED_SNAPSHOT_PATH'))
+# every open event stream holds a waitress thread: streams only get the threads left once WAITRESS_REST_THREADS are
+# kept for the other endpoints (serve many subscribers with asgi.py instead, its streams hold no thread)
+WAITRESS_THREADS = int(os.getenv('WAITRESS_THREADS', 8))
+WAITRESS_REST_THREADS = int(os.getenv('WAITRESS_REST_THREADS', 4))
+STREAM_THREADS = WAITRESS_THREADS - WAITRESS_REST_THREADS
+if STREAM_THREADS < 1:
+    raise ValueError(f"WAITRESS_THREADS ({WAITRESS_THREADS}) must be greater than WAITRESS_REST_THREADS "
+                     f"({WAITRESS_REST_THREADS}), event streams would have no thread left.")
+scheduler = Scheduler(
+    job=lambda: pipeline(
+        url=URL,
+        storage=STORAGE,
+        clean=os.getenv('SCHEDULER_CLEAN', 'false').lower() == 'true',
+        use_triggers=os.getenv('SCHEDULER_USE_TRIGGERS', 'false').lower() == 'true'
+    ),
+    interval=float(os.getenv('SCHEDULER_INTERVAL', 3600)),
+    offset=float(os.getenv('SCHEDULER_OFFSET', 300)),
+    jitter=float(os.getenv('SCHEDULER_JITTER', 0))
+)
 
 
-@app.route(os.path.join(API_PREFIX, 'exchangerate'))
-def eur_exch_sell_rate():
+# Prometheus scrape endpoint, off by default: it has no token, only enable it where the port is not public
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() == 'true'
+
+
+@app.before_request
+def start_timer():
+    g.start = time.perf_counter()
+
+
+@app.after_request
+def record_request(response: Response) -> Response:
+    # request duration and status per endpoint (streamed exports are timed until their headers are sent)
+    endpoint = request.endpoint or 'unknown'
+    metrics.HTTP_SECONDS.observe(time.perf_counter() - g.get('start', time.perf_counter()), endpoint=endpoint)
+    metrics.HTTP_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    return response
+
+
+def authorized() -> bool:
     # check request headers authorization
     auth = request.headers.get('Authorization', '')
     key = os.getenv('FLASK_API_AUTH_TOKEN')
     if not key:
         app.logger.error('FLASK_API_AUTH_TOKEN is not set.')
-        return redirect(url_for('not_found'))
+        return False
     if auth == '' or auth != key:
         app.logger.error('Invalid Authorization.')
+        return False
+    return True
+
+
+@app.route(os.path.join(API_PREFIX, 'exchangerate'))
+def eur_exch_sell_rate():
+    if not authorized():
         return redirect(url_for('not_found'))
 
     # get query parameters
@@ -29,19 +87,176 @@ def eur_exch_sell_rate():
         return redirect(url_for('not_found'))
 
     now = request.args.get('now', 'false')
-    if now.lower() == 'true':
+    if now.lower() == 'true' and not SCHEDULER_ENABLED and not SHARED_SNAPSHOT:
         now = True
     else:
+        # the embedded scheduler (or the producer) keeps the storage fresh, never scrape on the request path
         now = False
 
     # call api
-    exch_rate = get_exchange_rate_api(
-        url='https://www.icbc.com.cn/ICBCDynamicSite/Optimize/Quotation/QuotationListIframe.aspx',
+    payload, snapshot = get_exchange_rate_payload(
+        url=URL,
         currency=currency,
         now=now,
-        storage='assets/',
+        storage=STORAGE,
+        fields=request.args.get('fields'),
     )
-    return exch_rate
+    response = Response(payload, mimetype='application/json')
+    if snapshot is None:
+        return response
+
+    # answer conditional requests with 304 when the client already has this snapshot
+    response.set_etag(snapshot.etag)
+    response.last_modified = snapshot.last_modified
+    return response.make_conditional(request)
+
+
+@app.route(os.path.join(API_PREFIX, 'exchangerate', 'history'))
+def exch_rate_history():
+    if not authorized():
+        return redirect(url_for('not_found'))
+
+    # get query parameters
+    currency = request.args.get('currency', 'none')
+    if currency == 'none':
+        app.logger.error('No currency specified.')
+        return redirect(url_for('not_found'))
+
+    payload, ok = get_history(
+        storage=STORAGE,
+        currency=currency,
+        start=request.args.get('from'),
+        end=request.args.get('to'),
+        interval=request.args.get('interval', '1d'),
+    )
+    return Response(payload, status=200 if ok else 400, mimetype='application/json')
+
+
+@app.route(os.path.join(API_PREFIX, 'exchangerate', 'batch'), methods=['POST'])
+def exch_rate_batch():
+    if not authorized():
+        return redirect(url_for('not_found'))
+
+    # body: {"queries": [{"currency": "EUR", "timestamp": "2023-04-01 10:00:00"}, ...], "fields": "exch_sell"}
+    body = request.get_json(silent=True) or {}
+    fields = body.get('fields')
+    if isinstance(fields, str):
+        fields = fields.split(',')
+
+    payload, ok = lookup_batch(
+        storage=STORAGE,
+        queries=body.get('queries'),
+        fields=fields,
+    )
+    return Response(payload, status=200 if ok else 400, mimetype='application/json')
+
+
+@app.route(os.path.join(API_PREFIX, 'exchangerate', 'export'))
+def exch_rate_export():
+    if not authorized():
+        return redirect(url_for('not_found'))
+
+    # get query parameters, the whole stored history by default
+    fmt = request.args.get('format', 'csv').lower()
+    try:
+        chunks = export_history(
+            storage=STORAGE,
+            fmt=fmt,
+            currency=request.args.get('currency'),
+            start=request.args.get('from'),
+            end=request.args.get('to'),
+        )
+    except ValueError as e:
+        app.logger.error(str(e))
+        return Response(encode_response({'status': 'error', 'message': str(e)}), status=400,
+                        mimetype='application/json')
+
+    # streamed chunk by chunk (no Content-Length), rows are read from the storage as they are sent
+    content_type, ext = EXPORT_FORMATS[fmt]
+    response = Response(stream_with_context(chunks), content_type=content_type)
+    response.headers['Content-Disposition'] = f'attachment; filename=exchangerate.{ext}'
+    return response
+
+
+@app.route(os.path.join(API_PREFIX, 'exchangerate', 'stream'))
+def exch_rate_stream():
+    # browsers' EventSource cannot send headers, the token may be passed as ?token= instead
+    token = request.args.get('token')
+    if not (token and token == os.getenv('FLASK_API_AUTH_TOKEN')) and not authorized():
+        return redirect(url_for('not_found'))
+
+    try:
+        topics = parse_topics(request.args.get('currency'))
+    except ValueError as e:
+        app.logger.error(str(e))
+        return Response(encode_response({'status': 'error', 'message': str(e)}), status=400,
+                        mimetype='application/json')
+    broadcaster = get_broadcaster(STORAGE)
+    subscription = broadcaster.subscribe(topics, limit=STREAM_THREADS)
+    if subscription is None:
+        return Response(encode_response({'status': 'error', 'message': 'Too many subscribers, retry later.'}),
+                        status=503, headers={'Retry-After': '5'}, mimetype='application/json')
+
+    # the snapshot, then an update with the changed currencies whenever a new snapshot is stored
+    events = broadcaster.events(subscription, last_event_id=request.headers.get('Last-Event-ID'))
+    return Response(stream_with_context(events), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route(os.path.join(API_PREFIX, 'exchangerate', 'convert'), methods=['POST'])
+def exch_rate_convert():
+    if not authorized():
+        return redirect(url_for('not_found'))
+
+    # body: a CSV or NDJSON ledger of (timestamp, currency, amount) rows, answered in the same format
+    default = 'ndjson' if 'json' in (request.content_type or '') else 'csv'
+    fmt = request.args.get('format', default).lower()
+    fields = request.args.get('fields')
+    try:
+        chunks = convert_ledger(
+            storage=STORAGE,
+            stream=request.stream,
+            fmt=fmt,
+            fields=fields.split(',') if fields else None,
+        )
+    except ValueError as e:
+        app.logger.error(str(e))
+        return Response(encode_response({'status': 'error', 'message': str(e)}), status=400,
+                        mimetype='application/json')
+
+    # the ledger is read and converted chunk by chunk while the response is sent
+    return Response(stream_with_context(chunks), content_type=LEDGER_FORMATS[fmt])
+
+
+@app.route(os.path.join(API_PREFIX, 'crossrate'))
+def cross_rate():
+    if not authorized():
+        return redirect(url_for('not_found'))
+
+    # e.g. ?from=EUR&to=USD&amount=100, `from`/`to` also accept comma separated codes, CNY or 'all'
+    now = request.args.get('now', 'false').lower() == 'true' and not SCHEDULER_ENABLED and not SHARED_SNAPSHOT
+    snapshot = get_snapshot(url=URL, now=now, storage=STORAGE)
+    payload, ok = get_cross_rate(
+        snapshot,
+        source=request.args.get('from'),
+        target=request.args.get('to', 'CNY'),
+        amount=request.args.get('amount', '1'),
+    )
+    if not ok:
+        # invalid parameters, or no snapshot to convert with
+        return Response(payload, status=400 if snapshot is not None else 503, mimetype='application/json')
+    # the rates change with the snapshot only
+    response = Response(payload, mimetype='application/json')
+    response.set_etag(snapshot.etag)
+    response.last_modified = snapshot.last_modified
+    return response.make_conditional(request)
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    if not METRICS_ENABLED:
+        return redirect(url_for('not_found'))
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/not_found')
@@ -57,4 +272,6 @@ def page_not_found(error):
 if __name__ == '__main__':
     # Running on http://127.0.0.1:5000
     # app.run(debug=True)
-    serve(app, host='127.0.0.1', port=5000)
+    if SCHEDULER_ENABLED:
+        scheduler.start()
+    serve(app, host='127.0.0.1', port=int(os.getenv('PORT', 5000)), threads=WAITRESS_THREADS)
@@ -0,0 +1,243 @@
+import os
+import time
+import asyncio
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+from dotenv import load_dotenv
+
+
+# load .env before importing `src`, whose modules read their settings at import time
+load_dotenv()
+from src import get_broadcaster, get_snapshot, metrics, parse_topics
+from src.shared import shared_snapshot
+from src.snapshot import ERROR_PAYLOAD, encode_response
+
+
+"""
+ASGI server mode of the hot read endpoints of the API, run with:
+    python asgi.py
+    uvicorn asgi:app --port 5000
+It serves /exchangerate and /exchangerate/stream (under FLASK_API_URL_PREFIX) and /metrics with the same responses
+as app.py. History, batch, export, convert and crossrate are only served by app.py (404 here), and the embedded
+scheduler (SCHEDULER_ENABLED) is not started: keep the storage fresh with `main.py --pipeline --daemon`.
+Upstream fetches and storage loads run in worker threads and are awaited, concurrent requests for the same
+source share one in-flight load, and requests beyond ASGI_MAX_CONCURRENCY are rejected with 503 + Retry-After.
+Event streams (/exchangerate/stream) wait on the event loop, hold no thread and are capped by STREAM_MAX_CLIENTS
+instead, which makes this the server to use for many subscribers.
+"""
+
+
+API_PREFIX = os.getenv('FLASK_API_URL_PREFIX', '/api')
+STORAGE = os.getenv('STORAGE_PATH', 'assets/')
+URL = os.getenv('ICBC_URL', 'https://www.icbc.com.cn/ICBCDynamicSite/Optimize/Quotation/QuotationListIframe.aspx')
+MAX_CONCURRENCY = int(os.getenv('ASGI_MAX_CONCURRENCY', 64))
+# unauthenticated /metrics, off by default like app.py
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() == 'true'
+# worker of a producer process that shares its snapshots (see src/shared.py): no scraping, no storage loads
+SHARED_SNAPSHOT = bool(os.getenv('SHARED_SNAPSHOT_PATH'))
+
+NOT_FOUND = b'The page you access does not exist.'
+Headers = List[Tuple[bytes, bytes]]
+
+# number of requests being served
+_active = 0
+# source key -> in-flight snapshot load shared by all requests waiting for it
+_inflight: Dict[tuple, asyncio.Future] = {}
+
+
+async def app(scope: dict, receive: Callable[[], Awaitable[dict]], send: Callable[[dict], Awaitable[None]]):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    # same endpoint names as the Flask views, for the request metrics
+    if scope['path'] == API_PREFIX.rstrip('/') + '/exchangerate':
+        endpoint = 'eur_exch_sell_rate'
+    elif scope['path'] == API_PREFIX.rstrip('/') + '/exchangerate/stream':
+        endpoint = 'exch_rate_stream'
+    elif scope['path'] == '/metrics' and METRICS_ENABLED:
+        endpoint = 'prometheus_metrics'
+    else:
+        endpoint = 'unknown'
+    start = time.perf_counter()
+    status = 0
+
+    async def send_and_record(message: dict):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        await send(message)
+
+    if endpoint == 'exch_rate_stream':
+        # long-lived, not counted in ASGI_MAX_CONCURRENCY (timed until the stream ends)
+        try:
+            await exchange_rate_stream(scope, receive, send_and_record)
+        finally:
+            metrics.HTTP_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+            metrics.HTTP_REQUESTS.inc(endpoint=endpoint, status=status)
+        return
+
+    global _active
+    if _active >= MAX_CONCURRENCY:
+        # backpressure: reject instead of queueing behind slow upstream fetches
+        await _respond(send_and_record, 503, b'Server is busy, retry later.', [(b'retry-after', b'1')])
+        metrics.HTTP_REQUESTS.inc(endpoint=endpoint, status=status)
+        return
+    _active += 1
+    try:
+        if endpoint == 'eur_exch_sell_rate':
+            await exchange_rate(scope, send_and_record)
+        elif endpoint == 'prometheus_metrics':
+            await _respond(send_and_record, 200, metrics.render().encode('utf-8'),
+                           content_type=b'text/plain; version=0.0.4')
+        else:
+            await _respond(send_and_record, 404, NOT_FOUND)
+    finally:
+        _active -= 1
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+        metrics.HTTP_REQUESTS.inc(endpoint=endpoint, status=status)
+
+
+async def exchange_rate(scope: dict, send: Callable[[dict], Awaitable[None]]):
+    headers = {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope['headers']}
+    key = os.getenv('FLASK_API_AUTH_TOKEN')
+    auth = headers.get('authorization', '')
+    if not key or auth == '' or auth != key:
+        await _respond(send, 404, NOT_FOUND)
+        return
+
+    # get query parameters
+    query = parse_qs(scope.get('query_string', b'').decode('utf-8'))
+    currency = query.get('currency', ['none'])[0]
+    if currency == 'none':
+        await _respond(send, 404, NOT_FOUND)
+        return
+    now = query.get('now', ['false'])[0].lower() == 'true' and not SHARED_SNAPSHOT
+    fields = query.get('fields', [None])[0]
+
+    # reading the shared snapshot is a memory access, not worth a thread
+    snapshot = shared_snapshot.get(STORAGE) if SHARED_SNAPSHOT else None
+    if snapshot is None:
+        snapshot = await _shared(
+            ('live', URL) if now else ('storage', STORAGE),
+            lambda: get_snapshot(url=URL, now=now, storage=STORAGE)
+        )
+    payload = snapshot.payload(currency, fields) if snapshot is not None else None
+    if payload is None:
+        await _respond(send, 200, ERROR_PAYLOAD, content_type=b'application/json')
+        return
+
+    validators = [
+        (b'etag', f'"{snapshot.etag}"'.encode('latin-1')),
+        (b'last-modified', snapshot.last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT').encode('latin-1')),
+    ]
+    if _not_modified(headers, snapshot):
+        await _respond(send, 304, b'', validators)
+        return
+    await _respond(send, 200, payload, validators, content_type=b'application/json')
+
+
+async def exchange_rate_stream(scope: dict, receive: Callable[[], Awaitable[dict]],
+                               send: Callable[[dict], Awaitable[None]]):
+    headers = {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope['headers']}
+    query = parse_qs(scope.get('query_string', b'').decode('utf-8'))
+    # browsers' EventSource cannot send headers, the token may be passed as ?token= instead
+    key = os.getenv('FLASK_API_AUTH_TOKEN')
+    if not key or key not in (query.get('token', [''])[0], headers.get('authorization', '')):
+        await _respond(send, 404, NOT_FOUND)
+        return
+
+    try:
+        topics = parse_topics(query.get('currency', [None])[0])
+    except ValueError as e:
+        await _respond(send, 400, encode_response({'status': 'error', 'message': str(e)}),
+                       content_type=b'application/json')
+        return
+    broadcaster = get_broadcaster(STORAGE)
+    subscription = broadcaster.subscribe(topics)
+    if subscription is None:
+        await _respond(send, 503, encode_response({'status': 'error', 'message': 'Too many subscribers, retry later.'}),
+                       [(b'retry-after', b'5')], content_type=b'application/json')
+        return
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no')],
+    })
+    events = broadcaster.aevents(subscription, last_event_id=headers.get('last-event-id'))
+
+    async def pump():
+        async for chunk in events:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        # dropped for falling behind
+        await send({'type': 'http.response.body', 'body': b''})
+
+    # whichever ends first: the stream, or the client going away while it waits for the next event
+    tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(_disconnected(receive))]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # unsubscribes
+        await events.aclose()
+
+
+async def _disconnected(receive: Callable[[], Awaitable[dict]]):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _shared(key: tuple, loader: Callable):
+    # single-flight: the first request runs the blocking loader in a thread, the others await the same future
+    future = _inflight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(asyncio.to_thread(loader))
+        _inflight[key] = future
+        future.add_done_callback(lambda _: _inflight.pop(key, None))
+    return await asyncio.shield(future)
+
+
+def _not_modified(headers: Dict[str, str], snapshot) -> bool:
+    if_none_match = headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix('W/').strip('"') for tag in if_none_match.split(',')]
+        return '*' in tags or snapshot.etag in tags
+    if_modified_since = headers.get('if-modified-since')
+    if if_modified_since is not None:
+        try:
+            return snapshot.last_modified <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+async def _respond(send: Callable[[dict], Awaitable[None]], status: int, body: bytes,
+                   headers: Optional[Headers] = None, content_type: bytes = b'text/html; charset=utf-8'):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode())] + (headers or []),
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        print('The ASGI mode requires an ASGI server, e.g. `pip install uvicorn`.')
+        exit(1)
+    # Running on http://127.0.0.1:5000
+    uvicorn.run(app, host='127.0.0.1', port=int(os.getenv('PORT', 5000)), log_level='warning')
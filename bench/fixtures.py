@@ -0,0 +1,109 @@
+import os
+import sys
+import csv
+import glob
+import random
+import argparse
+import urllib.request
+from datetime import datetime, timedelta
+from typing import List
+
+# the project root, for `src`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.utils import COLUMNS
+try:
+    from stub_icbc import BASE_PRICES, CURRENCY_NAMES, NO_CASH, make_page
+except ImportError:
+    from bench.stub_icbc import BASE_PRICES, CURRENCY_NAMES, NO_CASH, make_page
+
+
+"""
+Offline fixtures for the benchmarks:
+- quotation pages: the HTML files saved in bench/fixtures/ (record the live page with `--record`),
+  plus pages generated by the stub so that there is always something to parse
+- a synthetic CSV storage: one snapshot file per interval over several years, in the format CSVStorage writes
+- a raw page archive (src/archive.py) of stub pages, for `main.py --reparse`
+Usage (from the project root):
+    python bench/fixtures.py --storage /tmp/bench_storage --years 3 --interval 1
+    python bench/fixtures.py --storage /tmp/bench_storage --archive 5000
+    python bench/fixtures.py --record https://www.icbc.com.cn/ICBCDynamicSite/Optimize/Quotation/QuotationListIframe.aspx
+"""
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def load_pages(generated: int = 3) -> List[str]:
+    # saved pages first, then `generated` stub pages with different prices
+    pages = []
+    for filename in sorted(glob.glob(os.path.join(FIXTURES, '*.html'))):
+        with open(filename, 'r', encoding='utf-8') as f:
+            pages.append(f.read())
+    pages.extend(make_page(datetime(2023, 4, 1, 4, 14, 5) + timedelta(hours=i), seed=i) for i in range(generated))
+    return pages
+
+
+def record(url: str, path: str = FIXTURES) -> str:
+    # save the live quotation page as a fixture
+    with urllib.request.urlopen(url, timeout=30) as response:
+        html = response.read().decode('utf-8')
+    filename = os.path.join(path, f'icbc_{datetime.now():%Y_%m_%d-%H_%M_%S}.html')
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write(html)
+    return filename
+
+
+def make_storage(path: str, years: float = 3, interval: float = 1.0, end: datetime = datetime(2023, 4, 1, 4, 14, 5),
+                 seed: int = 0) -> int:
+    # one snapshot every `interval` hours for `years` years up to `end`, prices follow a random walk;
+    # an existing directory with the same number of files is reused
+    os.makedirs(path, exist_ok=True)
+    count = int(years * 365 * 24 / interval)
+    if len(glob.glob(os.path.join(path, '*.csv'))) == count:
+        return count
+
+    rng = random.Random(seed)
+    prices = dict(BASE_PRICES)
+    ts = end - timedelta(hours=interval * (count - 1))
+    for _ in range(count):
+        rows = []
+        for code, name in CURRENCY_NAMES.items():
+            prices[code] *= rng.uniform(0.999, 1.001)
+            mid = prices[code]
+            # missing cash quotes are empty cells, as saved from the '--' of the website
+            cash_buy, cash_sell = ('', '') if code in NO_CASH else (f'{mid * 0.965:.2f}', f'{mid * 1.005:.2f}')
+            rows.append([code, name, f'{mid * 0.995:.2f}', cash_buy, f'{mid * 1.005:.2f}', cash_sell, f'{ts}'])
+        with open(os.path.join(path, f'{ts:%Y_%m_%d-%H_%M_%S}.csv'), 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(COLUMNS)
+            writer.writerows(rows)
+        ts += timedelta(hours=interval)
+    return count
+
+
+def make_archive(storage: str, count: int, end: datetime = datetime(2023, 4, 1, 4, 14, 5)) -> int:
+    # `count` hourly stub pages archived with the storage, as the pipeline keeps them; returns the pages added
+    from src.archive import archive_html
+
+    os.makedirs(storage, exist_ok=True)
+    added = 0
+    for i in range(count):
+        published = end - timedelta(hours=count - 1 - i)
+        added += archive_html(storage, make_page(published, seed=i), url='stub', fetched=published) is not None
+    return added
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate the benchmark fixtures.')
+    parser.add_argument('--storage', type=str, help='Directory of the synthetic CSV storage to generate.')
+    parser.add_argument('--years', type=float, default=3)
+    parser.add_argument('--interval', type=float, default=1.0, help='Hours between two snapshots (default: 1).')
+    parser.add_argument('--archive', type=int, metavar='PAGES', help='Archive PAGES stub pages with --storage.')
+    parser.add_argument('--record', type=str, metavar='URL', help='Save the quotation page at URL into bench/fixtures/.')
+    args = parser.parse_args()
+    if args.record:
+        print(f'Saved {record(args.record)}')
+    if args.storage and args.archive:
+        print(f'{make_archive(args.storage, args.archive)} pages archived with {args.storage}')
+    elif args.storage:
+        print(f'{make_storage(args.storage, years=args.years, interval=args.interval)} snapshots in {args.storage}')
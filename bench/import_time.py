@@ -0,0 +1,65 @@
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+
+"""
+Import-time benchmark for the one-shot CLI.
+Measures the wall-clock startup of the light query path (`main.py --currency` reading the storage)
+against importing the full pipeline, and fails if the light path imports heavy modules or exceeds its budget.
+
+Usage (from the project root):
+    python bench/import_time.py --budget 150
+"""
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('pandas', 'numpy', 'bs4', 'lxml', 'requests', 'pypushdeer')
+
+# statements executed in a fresh interpreter
+LIGHT = 'import main; from src import read_latest_quote'
+FULL = 'import main; from src import pipeline'
+CHECK = ('import sys, main; from src import read_latest_quote; '
+         f'print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))')
+
+
+def measure(statement: str, repeat: int) -> float:
+    # median wall-clock milliseconds of a fresh interpreter running `statement`
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', statement], cwd=ROOT, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Import-time benchmark of the CLI.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs per measurement.')
+    parser.add_argument('--budget', type=float, default=None, help='Max milliseconds for the light path.')
+    args = parser.parse_args()
+
+    heavy = subprocess.run([sys.executable, '-c', CHECK], cwd=ROOT, check=True,
+                           capture_output=True, text=True).stdout.strip()
+    baseline = measure('pass', args.repeat)
+    light = measure(LIGHT, args.repeat)
+    full = measure(FULL, args.repeat)
+    print(f"interpreter: {baseline:.1f} ms")
+    print(f"light path:  {light:.1f} ms")
+    print(f"full path:   {full:.1f} ms")
+
+    if heavy:
+        print(f"FAIL: the light path imports heavy modules: {heavy}")
+        return 1
+    if args.budget is not None and light > args.budget:
+        print(f"FAIL: the light path takes {light:.1f} ms, budget is {args.budget:.1f} ms")
+        return 1
+    print('OK')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
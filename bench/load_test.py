@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from stub_icbc import start_stub
+except ImportError:
+    from bench.stub_icbc import start_stub
+
+
+"""
+Load test of the API server against a local stub of the ICBC page. Usage (from the project root):
+    python bench/load_test.py --server asgi --requests 2000 --concurrency 50 --now
+    python bench/load_test.py --server wsgi --requests 2000 --concurrency 50 --now
+Spawns the server (app.py or asgi.py) pointed at the stub, fires the requests and reports p50/p99 latency,
+throughput and the status codes (503 = rejected by backpressure).
+"""
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = 'bench'
+
+
+def request(url: str) -> tuple:
+    start = time.perf_counter()
+    req = urllib.request.Request(url, headers={'Authorization': TOKEN})
+    try:
+        with urllib.request.urlopen(req, timeout=60) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        status = 0
+    return status, time.perf_counter() - start
+
+
+def wait_until_up(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if request(url)[0] != 0:
+            return
+        time.sleep(0.2)
+    raise RuntimeError(f'Server did not start: {url}')
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Load test of the exchange rate API.')
+    parser.add_argument('--server', choices=('asgi', 'wsgi'), default='asgi')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--stub-port', type=int, default=8055)
+    parser.add_argument('--stub-delay', type=float, default=0.2, help='Upstream latency of the stub in seconds.')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--currency', type=str, default='EUR')
+    parser.add_argument('--now', action='store_true', help='Query with now=true (upstream fetch path).')
+    args = parser.parse_args()
+
+    stub = start_stub(port=args.stub_port, delay=args.stub_delay)
+    env = dict(
+        os.environ,
+        ICBC_URL=f'http://127.0.0.1:{args.stub_port}/',
+        FLASK_API_AUTH_TOKEN=TOKEN,
+        PORT=str(args.port),
+    )
+    script = 'asgi.py' if args.server == 'asgi' else 'app.py'
+    server = subprocess.Popen([sys.executable, script], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = (f'http://127.0.0.1:{args.port}{os.getenv("FLASK_API_URL_PREFIX", "/api")}/exchangerate'
+           f'?currency={args.currency}&now={"true" if args.now else "false"}')
+    try:
+        wait_until_up(url)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(request, [url] * args.requests))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+        stub.shutdown()
+
+    latencies = [latency * 1000 for status, latency in results if status == 200]
+    statuses = Counter(status for status, _ in results)
+    print(f'server: {args.server}, requests: {args.requests}, concurrency: {args.concurrency}, now: {args.now}')
+    print(f'status codes: {dict(statuses)}')
+    print(f'throughput: {args.requests / elapsed:.1f} req/s')
+    print(f'upstream hits: {stub.RequestHandlerClass.hits}')
+    if latencies:
+        print(f'p50: {statistics.median(latencies):.1f} ms, p99: {percentile(latencies, 0.99):.1f} ms')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import timeit
+import tempfile
+import argparse
+import platform
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+try:
+    from fixtures import load_pages, make_storage
+    from stub_icbc import start_stub
+except ImportError:
+    from bench.fixtures import load_pages, make_storage
+    from bench.stub_icbc import start_stub
+
+
+"""
+Offline micro benchmarks of the hot paths, on the fixtures of bench/fixtures.py and the stub of bench/stub_icbc.py:
+parsing (parse_html, parse_csv), storage scans (get_latest_file/get_outdated_files over 10k+ files, the manifest,
+the shared snapshot of the API workers),
+response serialization (get_exchange_rate_api, payloads) and the Flask endpoint under concurrent requests.
+Save a run with --save and compare a later one against it with --compare. Usage (from the project root):
+    python bench/micro_bench.py --save before.json
+    python bench/micro_bench.py --compare before.json --only parse
+The end-to-end server (waitress/uvicorn behind a socket) is covered by bench/load_test.py.
+"""
+
+
+TOKEN = 'bench'
+Case = Tuple[str, Callable[[], object]]
+
+
+def measure(fn: Callable[[], object], repeat: int = 5) -> Dict[str, float]:
+    # milliseconds per call, the loop count is picked like `python -m timeit` (at least 0.2 s per repeat)
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    times = [elapsed / number * 1000 for elapsed in timer.repeat(repeat=repeat, number=number)]
+    return {'best': min(times), 'median': statistics.median(times), 'calls': number * repeat}
+
+
+def parse_cases(storage: str) -> List[Case]:
+    from src.parse import parse_csv, parse_html, parse_html_bs4
+    from src.utils import get_latest_file
+
+    pages = load_pages()
+    latest = get_latest_file(storage)
+    return [
+        ('parse_html', lambda: [parse_html(page) for page in pages]),
+        ('parse_html_bs4', lambda: [parse_html_bs4(page) for page in pages]),
+        ('parse_csv', lambda: parse_csv(latest)),
+        ('parse_csv as_snapshot', lambda: parse_csv(latest, as_snapshot=True)),
+    ]
+
+
+def storage_cases(storage: str) -> List[Case]:
+    from src.shared import SharedSnapshot
+    from src.storage import CSVStorage
+    from src.utils import get_latest_file, get_outdated_files
+
+    backend = CSVStorage(storage)
+    # what an API worker reads instead of the storage when a producer shares the snapshot
+    path = os.path.join(tempfile.gettempdir(), 'bank_currency_bench.shm')
+    shared = SharedSnapshot(path)
+    shared.publish(backend.latest_snapshot(), storage)
+    return [
+        ('get_latest_file', lambda: get_latest_file(storage)),
+        ('get_outdated_files', lambda: get_outdated_files(storage, days=60)),
+        ('CSVStorage.latest_timestamp', backend.latest_timestamp),
+        ('CSVStorage.get_outdated', lambda: backend.get_outdated(days=60)),
+        ('CSVStorage.latest_snapshot', backend.latest_snapshot),
+        ('SharedSnapshot.get', lambda: shared.get(storage)),
+        # a new process, or a new snapshot: map, copy and decode
+        ('SharedSnapshot.get (cold)', lambda: SharedSnapshot(path).get(storage)),
+    ]
+
+
+def serialize_cases(storage: str) -> List[Case]:
+    from flask import Flask, jsonify
+    from src import cross_rate, get_exchange_rate_api
+    from src.snapshot import Snapshot
+    from src.storage import CSVStorage
+
+    df = CSVStorage(storage).latest()
+    snapshot = Snapshot.from_dataframe(df)
+    app = Flask(__name__)
+
+    def jsonify_all():
+        with app.app_context():
+            return jsonify(get_exchange_rate_api(url='', currency='all', now=False, storage=storage)).data
+
+    return [
+        ('get_exchange_rate_api EUR', lambda: get_exchange_rate_api(url='', currency='EUR', now=False, storage=storage)),
+        ('get_exchange_rate_api all', lambda: get_exchange_rate_api(url='', currency='all', now=False, storage=storage)),
+        ('jsonify all', jsonify_all),
+        # uncached: a new snapshot is built and encoded on every call
+        ('Snapshot payload all (cold)', lambda: Snapshot.from_dataframe(df).payload('all')),
+        ('cross_rate EUR:USD', lambda: cross_rate(snapshot, 'EUR', 'USD', 100)),
+        ('cross_rate all:all', lambda: cross_rate(snapshot, 'all', 'all')),
+        ('CrossRates matrices (cold)', lambda: Snapshot.from_dataframe(df).cross_rates()),
+    ]
+
+
+def endpoint_cases(storage: str, stub_url: str, concurrency: int, requests: int) -> List[Case]:
+    # the Flask app in-process, `requests` calls from `concurrency` threads per run (one test client per thread)
+    os.environ.update(FLASK_API_AUTH_TOKEN=TOKEN, STORAGE_PATH=storage, ICBC_URL=stub_url, SCHEDULER_ENABLED='false')
+    import app as server
+
+    local = threading.local()
+
+    def call(path: str) -> int:
+        if not hasattr(local, 'client'):
+            local.client = server.app.test_client()
+        return local.client.get(path, headers={'Authorization': TOKEN}).status_code
+
+    def burst(path: str) -> Callable[[], object]:
+        def run():
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                statuses = list(executor.map(call, [path] * requests))
+            if any(status != 200 for status in statuses):
+                raise RuntimeError(f'Unexpected status codes for {path}: {set(statuses)}')
+        return run
+
+    prefix = os.getenv('FLASK_API_URL_PREFIX', '/api')
+    return [
+        (f'endpoint storage x{requests} c{concurrency}', burst(f'{prefix}/exchangerate?currency=EUR')),
+        (f'endpoint now x{requests} c{concurrency}', burst(f'{prefix}/exchangerate?currency=EUR&now=true')),
+        (f'endpoint all fields x{requests} c{concurrency}',
+         burst(f'{prefix}/exchangerate?currency=all&fields=exch_sell,cash_sell')),
+    ]
+
+
+def report(results: Dict[str, dict], baseline: Optional[Dict[str, dict]] = None):
+    header = f"{'case':<40} {'best ms':>10} {'median ms':>10} {'calls':>7}"
+    print(header + (f" {'vs base':>8}" if baseline else ''))
+    for name, result in results.items():
+        line = f"{name:<40} {result['best']:>10.3f} {result['median']:>10.3f} {result['calls']:>7}"
+        if baseline and name in baseline:
+            # > 1 is slower than the baseline
+            line += f" {result['median'] / baseline[name]['median']:>7.2f}x"
+        print(line)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Micro benchmarks of the exchange rate bot.')
+    parser.add_argument('--storage', type=str, default=os.path.join(tempfile.gettempdir(), 'bank_currency_bench'),
+                        help='Synthetic CSV storage, generated when missing (default: a folder in the temp dir).')
+    parser.add_argument('--years', type=float, default=3, help='Years of snapshots in the storage (default: 3).')
+    parser.add_argument('--interval', type=float, default=1.0, help='Hours between two snapshots (default: 1).')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint run (default: 200).')
+    parser.add_argument('--stub-port', type=int, default=8056)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', type=str, help='Run the cases whose name contains this string.')
+    parser.add_argument('--save', type=str, metavar='FILE', help='Save the results as JSON.')
+    parser.add_argument('--compare', type=str, metavar='FILE', help='Compare with results saved by --save.')
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    count = make_storage(args.storage, years=args.years, interval=args.interval)
+    print(f'storage: {args.storage} ({count} snapshots), python {platform.python_version()}')
+
+    stub = start_stub(port=args.stub_port)
+    try:
+        cases = (parse_cases(args.storage) + storage_cases(args.storage) + serialize_cases(args.storage) +
+                 endpoint_cases(args.storage, f'http://127.0.0.1:{args.stub_port}/', args.concurrency, args.requests))
+        results = {}
+        for name, fn in cases:
+            if args.only and args.only not in name:
+                continue
+            results[name] = measure(fn, repeat=args.repeat)
+    finally:
+        stub.shutdown()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+    report(results, baseline)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'snapshots': count, 'python': platform.python_version(), 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
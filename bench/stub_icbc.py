@@ -0,0 +1,99 @@
+import time
+import random
+import argparse
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+"""
+Local stand-in for the ICBC quotation page, so that the pipeline and the API can be exercised offline.
+The generated markup follows the structure `parse_html` expects. Usage:
+    python bench/stub_icbc.py --port 8001 --delay 0.2
+    ICBC_URL=http://127.0.0.1:8001/ python app.py
+"""
+
+
+CURRENCY_NAMES = {
+    'GBP': '英镑', 'HKD': '港币', 'USD': '美元', 'CHF': '瑞士法郎', 'SGD': '新加坡元', 'PKR': '巴基斯坦卢比',
+    'SEK': '瑞典克朗', 'DKK': '丹麦克朗', 'NOK': '挪威克朗', 'JPY': '日元', 'CAD': '加拿大元', 'AUD': '澳大利亚元',
+    'MYR': '林吉特', 'EUR': '欧元', 'RUB': '卢布', 'MOP': '澳门元', 'THB': '泰国铢', 'NZD': '新西兰元',
+    'ZAR': '南非兰特', 'KZT': '哈萨克斯坦坚戈', 'KRW': '韩元',
+}
+# rough CNY per 100 units, the generated prices drift around them
+BASE_PRICES = {
+    'GBP': 870.0, 'HKD': 92.0, 'USD': 720.0, 'CHF': 800.0, 'SGD': 535.0, 'PKR': 2.6, 'SEK': 68.0,
+    'DKK': 105.0, 'NOK': 67.0, 'JPY': 4.9, 'CAD': 530.0, 'AUD': 475.0, 'MYR': 155.0, 'EUR': 785.0,
+    'RUB': 8.0, 'MOP': 89.0, 'THB': 20.0, 'NZD': 435.0, 'ZAR': 39.0, 'KZT': 1.5, 'KRW': 0.54,
+}
+# currencies without cash quotes ('--' on the website)
+NO_CASH = ('PKR', 'KZT')
+
+
+def make_page(published: datetime, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    rows = []
+    for code, name in CURRENCY_NAMES.items():
+        mid = BASE_PRICES[code] * rng.uniform(0.97, 1.03)
+        exch_buy, cash_buy, exch_sell, cash_sell = mid * 0.995, mid * 0.965, mid * 1.005, mid * 1.005
+        prices = [f'{exch_buy:.2f}', f'{cash_buy:.2f}', f'{exch_sell:.2f}', f'{cash_sell:.2f}']
+        if code in NO_CASH:
+            prices[1] = prices[3] = '--'
+        cells = ''.join(f'<td>{price}</td>' for price in prices)
+        rows.append(f'<tr><td>{name}({code})</td>{cells}<td>{published:%Y年%m月%d日 %H:%M:%S}</td></tr>\n')
+    header = ''.join(f'<td>{col}</td>' for col in ('币种', '现汇买入价', '现钞买入价', '现汇卖出价', '现钞卖出价', '发布时间'))
+    return (
+        '<html><head><meta charset="utf-8"><title>ICBC</title></head><body><form><div>'
+        '<table><tr><td><table>'
+        '<tr><td>外汇牌价</td></tr><tr><td>单位：人民币/100外币</td></tr>'
+        '<tr>\n<td><table>\n'
+        f'<tr>{header}</tr>\n' + ''.join(rows) +
+        '</table></td></tr>'
+        '</table></td></tr></table>'
+        '</div></form></body></html>'
+    )
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # set by `start_stub`
+    delay: float = 0.0
+    body: bytes = b''
+    hits: int = 0
+
+    def do_GET(self):
+        type(self).hits += 1
+        if self.delay > 0:
+            time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        return
+
+
+def start_stub(port: int = 8001, delay: float = 0.0, published: datetime = None) -> ThreadingHTTPServer:
+    # serve the stub page from a background thread, returns the server (call `.shutdown()` to stop it)
+    handler = type('Handler', (StubHandler,), {
+        'delay': delay,
+        'body': make_page(published or datetime.now().replace(microsecond=0)).encode('utf-8'),
+        'hits': 0,
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stub of the ICBC quotation page.')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--delay', type=float, default=0.0, help='Seconds to wait before answering.')
+    args = parser.parse_args()
+    stub = start_stub(port=args.port, delay=args.delay)
+    print(f'Serving the ICBC stub on http://127.0.0.1:{args.port}/')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stub.shutdown()
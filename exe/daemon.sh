@@ -0,0 +1,6 @@
+#!/bin/zsh
+
+# activate conda environment
+source "$(conda info --base)"/etc/profile.d/conda.sh && conda activate icbc
+
+python main.py --pipeline --daemon --clean --use-triggers --storage assets/
@@ -1,6 +1,9 @@
 import argparse
 import os
-from src import pipeline, get_exchange_rate_bank_sell
+from dotenv import load_dotenv
+
+
+# heavy modules (pandas, bs4, lxml, requests, PushDeer) are imported from `src` only by the modes that need them
 
 
 URL = 'https://www.icbc.com.cn/ICBCDynamicSite/Optimize/Quotation/QuotationListIframe.aspx'
@@ -15,9 +18,55 @@ parser.add_argument('--now', '-n', action='store_true',
 parser.add_argument('--pipeline', '-p', action='store_true',
                     help='Run pipeline to fetch the exchange rate from website and save to storage.')
 parser.add_argument('--storage', '-s', type=str, help='Specify the storage path.')
-parser.add_argument('--clean', action='store_true', help='Clean the storage files than is older than 60 day.')
+parser.add_argument('--clean', action='store_true',
+                    help='Clean the storage according to the retention policy (default: older than 60 days).')
+parser.add_argument('--retention', type=str, metavar='POLICY',
+                    help='Use with --clean. Retention tiers RESOLUTION:AGE, e.g. "1h:7d,1d:730d" '
+                         '(default: RETENTION_POLICY env or "all:60d").')
 parser.add_argument('--use-triggers', action='store_true', help='Enable triggers.')
+parser.add_argument('--daemon', '-d', action='store_true',
+                    help='Keep running and execute the pipeline periodically instead of once.')
+parser.add_argument('--interval', type=float, default=3600,
+                    help='Use with --daemon. Seconds between two pipeline runs (default: 3600).')
+parser.add_argument('--offset', type=float, default=300,
+                    help='Use with --daemon. Seconds after each interval boundary to run at (default: 300).')
+parser.add_argument('--jitter', type=float, default=0,
+                    help='Use with --daemon. Random delay of up to JITTER seconds added to each run (default: 0).')
+# mode 3: migrate a directory of CSV files into a single-file storage
+parser.add_argument('--migrate', '-m', type=str, metavar='CSV_DIR',
+                    help='Ingest the CSV files in CSV_DIR into the SQLite storage given by --storage (*.db).')
+# mode 4: fetch the exchange rate from several banks concurrently
+parser.add_argument('--banks', '-b', type=str, metavar='NAMES',
+                    help='Comma separated sources to fetch concurrently (see src/sources.py), or "all".')
+# mode 5: export the stored history
+parser.add_argument('--export', '-e', type=str, metavar='FILE',
+                    help='Stream the history in --storage to FILE ("-" for stdout), see --format.')
+parser.add_argument('--format', type=str, choices=('csv', 'ndjson', 'arrow'),
+                    help='Use with --export or --ledger. Output format (default: csv or the ledger file extension, '
+                         'arrow requires pyarrow and is for --export only).')
+parser.add_argument('--from', dest='start', type=str, help='Use with --export. Start datetime, e.g. 2023-04-01.')
+parser.add_argument('--to', dest='end', type=str, help='Use with --export. End datetime, e.g. 2023-04-30.')
+parser.add_argument('--currencies', type=str, help='Use with --export. Comma separated currencies (default: all).')
+# mode 6: convert between two currencies with the cross rates
+parser.add_argument('--crossrate', '-x', type=str, metavar='FROM:TO',
+                    help='Cross rates from FROM to TO (default CNY), e.g. EUR:USD; codes can be comma separated or "all". '
+                         'Uses the latest stored snapshot, or the website with --now.')
+parser.add_argument('--amount', type=float, default=1.0, help='Use with --crossrate. Amount of FROM (default: 1).')
+# mode 7: convert a ledger of timestamped amounts at the rates valid at each timestamp
+parser.add_argument('--ledger', '-l', type=str, metavar='FILE',
+                    help='Convert the (timestamp, currency, amount) rows of the CSV/NDJSON FILE ("-" for stdin) '
+                         'to CNY with the history in --storage, see --output and --fields.')
+parser.add_argument('--output', '-o', type=str, default='-',
+                    help='Use with --ledger. File to write the converted ledger to (default: "-", stdout).')
+parser.add_argument('--fields', type=str,
+                    help='Use with --ledger. Comma separated prices to convert with (default: all four).')
+# mode 8: parse the archived raw pages again, e.g. after a parser fix
+parser.add_argument('--reparse', action='store_true',
+                    help='Parse the raw pages archived with --storage again in parallel and save the tables to it, '
+                         'replacing the snapshots with the same time.')
+parser.add_argument('--workers', type=int, help='Use with --reparse. Number of processes (default: CPU count).')
 # common arguments
+parser.add_argument('--profile', action='store_true', help='Print the time spent per stage when the run ends.')
 parser.add_argument('--verbose', '-v', action='store_true', help='Verbose mode.')
 parser.add_argument('--debug', action='store_true', help='print out debug info.')
 
@@ -31,25 +80,163 @@ if __name__ == '__main__':
               f'Project root directory: {os.path.dirname(os.path.abspath(__file__))}')
         exit(1)
 
+    load_dotenv()
     args = parser.parse_args()
-    print(args)
+    if args.daemon and not args.pipeline:
+        parser.error('--daemon runs the pipeline periodically, use it with --pipeline.')
+    if args.export != '-' and not (args.ledger and args.output == '-'):
+        # stdout is the export stream otherwise
+        print(args)
+    if args.profile:
+        import atexit
+        import sys
+        from src import metrics
+        # every mode ends with exit(), print the breakdown on the way out (to stderr, stdout may be an export)
+        atexit.register(lambda: print(metrics.breakdown(), file=sys.stderr))
     if args.currency:
+        storage = args.storage or 'assets/'
+        if not args.now:
+            # fast path: read the latest stored quote without pandas
+            from src import read_latest_quote
+            quote = read_latest_quote(storage=storage, currency=args.currency)
+            if quote is not None:
+                print(f"{args.currency} 现汇卖出价: {quote['exch_sell']}")
+                exit(0)
+        from src import get_exchange_rate_bank_sell
         get_exchange_rate_bank_sell(
             url=URL,
             currency=args.currency,
             now=args.now,
+            storage=storage,
             verbose=args.verbose,
             debug=args.debug
         )
         exit(0)
+    if args.pipeline and args.daemon:
+        from src import pipeline, Scheduler
+        scheduler = Scheduler(
+            job=lambda: pipeline(
+                url=URL,
+                storage=args.storage,
+                verbose=args.verbose,
+                debug=args.debug,
+                clean=args.clean,
+                use_triggers=args.use_triggers,
+                retention=args.retention
+            ),
+            interval=args.interval,
+            offset=args.offset,
+            jitter=args.jitter
+        )
+        try:
+            scheduler.run_forever()
+        except KeyboardInterrupt:
+            scheduler.stop()
+        exit(0)
     if args.pipeline:
+        from src import pipeline
         print(pipeline(
             url=URL,
             storage=args.storage,
             verbose=args.verbose,
             debug=args.debug,
             clean=args.clean,
-            use_triggers=args.use_triggers
+            use_triggers=args.use_triggers,
+            retention=args.retention
         ))
         exit(0)
-    print('No action specified. One must set either --currency or --pipeline flag. Use -h to see help.')
+    if args.migrate:
+        if not args.storage:
+            print('Please specify the target SQLite storage with --storage, e.g. --storage assets/history.db')
+            exit(1)
+        from src import migrate
+        print(f'Migrated {migrate(src=args.migrate, dst=args.storage)} snapshots to {args.storage}.')
+        exit(0)
+    if args.banks:
+        from src import fetch_sources
+        names = None if args.banks.lower() == 'all' else [name.strip().lower() for name in args.banks.split(',')]
+        try:
+            df, latencies = fetch_sources(names)
+        except KeyError as e:
+            print(e.args[0])
+            exit(1)
+        print(df)
+        for name, latency in latencies.items():
+            print(f"{name}: fetch {latency['fetch']:.3f}s, parse {latency['parse']:.3f}s, total {latency['total']:.3f}s")
+        exit(0)
+    if args.export:
+        import sys
+        from src import export_history
+        try:
+            chunks = export_history(
+                storage=args.storage or 'assets/',
+                fmt=args.format or 'csv',
+                currency=args.currencies,
+                start=args.start,
+                end=args.end
+            )
+        except ValueError as e:
+            print(e)
+            exit(1)
+        out = sys.stdout.buffer if args.export == '-' else open(args.export, 'wb')
+        with out:
+            for chunk in chunks:
+                out.write(chunk)
+        exit(0)
+    if args.ledger:
+        import sys
+        from src import convert_ledger
+        fmt = args.format or ('ndjson' if args.ledger.endswith(('.ndjson', '.jsonl')) else 'csv')
+        source = sys.stdin.buffer if args.ledger == '-' else open(args.ledger, 'rb')
+        with source:
+            try:
+                chunks = convert_ledger(
+                    storage=args.storage or 'assets/',
+                    stream=source,
+                    fmt=fmt,
+                    fields=args.fields.split(',') if args.fields else None
+                )
+            except ValueError as e:
+                print(e)
+                exit(1)
+            out = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+            with out:
+                for chunk in chunks:
+                    out.write(chunk)
+        exit(0)
+    if args.reparse:
+        from src import reparse
+        storage = args.storage or 'assets/'
+        try:
+            stats = reparse(
+                storage=storage,
+                workers=args.workers,
+                progress=lambda done, total, saved, seconds: print(
+                    f'{done}/{total} pages, {saved} snapshots saved, {done / seconds:.1f} pages/s')
+            )
+        except ValueError as e:
+            print(e)
+            exit(1)
+        print(f"Reparsed {stats['pages']} pages ({stats['failed']} failed) into {stats['snapshots']} snapshots "
+              f"of {storage} in {stats['seconds']:.1f}s ({stats['pages'] / max(stats['seconds'], 1e-9):.1f} pages/s).")
+        exit(0)
+    if args.crossrate:
+        from src import cross_rate, get_snapshot
+        source, _, target = args.crossrate.partition(':')
+        snapshot = get_snapshot(url=URL, now=args.now, storage=args.storage or 'assets/',
+                                verbose=args.verbose, debug=args.debug)
+        if snapshot is None:
+            print('Failed to get the exchange rate.')
+            exit(1)
+        try:
+            records = cross_rate(snapshot, source, target or 'CNY', args.amount)
+        except ValueError as e:
+            print(e)
+            exit(1)
+        for record in records:
+            rates = ', '.join(f"{name} {'--' if record[name] is None else f'{record[name]:.4f}'}"
+                              for name in ('exch_buy', 'exch_sell', 'cash_buy', 'cash_sell'))
+            print(f"{record['amount']:g} {record['from']} -> {record['to']} ({record['datetime']}): {rates}")
+        exit(0)
+    print('No action specified. One must set either --currency, --pipeline, --migrate, --banks, --export, '
+          '--crossrate, --ledger or --reparse flag. Use -h to see help.')
@@ -1,4 +1,42 @@
-from .index import \
-    pipeline, \
-    get_exchange_rate_bank_sell, \
-    get_exchange_rate_api
+import importlib
+
+
+# public name -> submodule. Submodules are imported on first access, so light entry points
+# (e.g. `main.py --currency` reading the storage) don't pay for pandas, bs4, lxml, requests and PushDeer.
+_EXPORTS = {
+    'pipeline': 'index',
+    'get_exchange_rate_bank_sell': 'index',
+    'get_exchange_rate_api': 'index',
+    'get_exchange_rate_payload': 'index',
+    'get_snapshot': 'index',
+    'open_storage': 'storage',
+    'migrate': 'storage',
+    'get_history': 'history',
+    'lookup_batch': 'history',
+    'export_history': 'export',
+    'convert_ledger': 'ledger',
+    'reparse': 'archive',
+    'get_broadcaster': 'stream',
+    'parse_topics': 'stream',
+    'cross_rate': 'crossrate',
+    'get_cross_rate': 'crossrate',
+    'SOURCES': 'sources',
+    'register_source': 'sources',
+    'fetch_sources': 'sources',
+    'Scheduler': 'scheduler',
+    'read_latest_quote': 'lite',
+}
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{module}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
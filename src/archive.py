@@ -0,0 +1,152 @@
+import os
+import glob
+import gzip
+import time
+import zlib
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+try:
+    from .metrics import timer
+    from .parse import parse_html
+    from .storage import Storage, open_storage
+    from .utils import SQLITE_EXT, get_logger
+except ImportError:
+    from metrics import timer
+    from parse import parse_html
+    from storage import Storage, open_storage
+    from utils import SQLITE_EXT, get_logger
+
+
+"""
+Archive of the raw quotation pages, so that the history can be regenerated when the markup changes or the parser
+is fixed. Every page parsed by the pipeline is gzip-compressed into '<archive>/<sha256[:2]>/<sha256>.html.gz',
+named by the hash of its content, so a page fetched again unchanged is stored once; '<archive>/index.tsv' lists
+the stored pages (sha256, fetch time, url) in fetch order.
+The archive sits next to the storage: '<storage>/raw/' for a CSV folder, '<file>.raw/' for a SQLite file.
+`reparse` parses the whole archive again in a process pool and writes the tables to the storage in bulk,
+replacing the snapshots with the same '发布时间'.
+"""
+
+
+logger = get_logger('Archive', filename='archive.log')
+
+ARCHIVE_ENABLED = os.getenv('ARCHIVE_RAW_HTML', 'true').lower() == 'true'
+INDEX = 'index.tsv'
+EXT = '.html.gz'
+# snapshots written to the storage at a time
+BATCH_SIZE = 500
+
+
+def archive_path(storage: str) -> str:
+    if storage.lower().endswith(SQLITE_EXT):
+        return storage + '.raw'
+    return os.path.join(storage, 'raw')
+
+
+def archive_html(storage: str, html: str, url: str = '', fetched: Optional[datetime] = None) -> Optional[str]:
+    # returns the archived file, None when the same page is already archived
+    content = html.encode('utf-8')
+    digest = hashlib.sha256(content).hexdigest()
+    root = archive_path(storage)
+    filename = _page(root, digest)
+    if os.path.exists(filename):
+        return None
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    # write then rename, a reparse never reads a partial page
+    with open(filename + '.tmp', 'wb') as f:
+        f.write(gzip.compress(content, mtime=0))
+    os.replace(filename + '.tmp', filename)
+    with open(os.path.join(root, INDEX), 'a', encoding='utf-8') as f:
+        f.write(f"{digest}\t{fetched or datetime.now():%Y-%m-%d %H:%M:%S}\t{url}\n")
+    return filename
+
+
+def archived_pages(storage: str) -> List[str]:
+    # archived files in fetch order, followed by the pages missing from the index
+    root = archive_path(storage)
+    digests = []
+    try:
+        with open(os.path.join(root, INDEX), 'r', encoding='utf-8') as f:
+            digests = [line.split('\t', 1)[0].strip() for line in f if line.strip()]
+    except FileNotFoundError:
+        pass
+    indexed = set(digests)
+    digests = list(dict.fromkeys(digests))
+    digests.extend(sorted(
+        name for name in (os.path.basename(path)[:-len(EXT)] for path in glob.glob(os.path.join(root, '*', '*' + EXT)))
+        if name not in indexed
+    ))
+    return [filename for filename in (_page(root, digest) for digest in digests) if os.path.exists(filename)]
+
+
+def reparse(
+        storage: str,
+        workers: Optional[int] = None,
+        batch_size: int = BATCH_SIZE,
+        progress: Optional[Callable[[int, int, int, float], None]] = None
+) -> Dict[str, float]:
+    # parse every archived page again with `workers` processes (default: CPU count) and save the tables;
+    # progress(pages done, pages, snapshots saved, seconds) is called after every batch.
+    # Returns the number of pages, failed pages, saved snapshots and the seconds taken.
+    backend = open_storage(storage)
+    if not backend.exists():
+        raise ValueError(f"Storage path does not exist: {storage}")
+    files = archived_pages(storage)
+    workers = workers or os.cpu_count() or 1
+    logger.info(f"Reparsing {len(files)} archived pages of {storage} with {workers} processes.")
+
+    start = time.perf_counter()
+    done = failed = saved = 0
+    # publish time -> table, a page fetched later replaces an earlier one with the same time
+    batch = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunksize = max(1, min(64, len(files) // (workers * 4)))
+        for df in executor.map(_parse_page, files, chunksize=chunksize):
+            done += 1
+            if df is None:
+                failed += 1
+            else:
+                batch[df['发布时间'].iloc[0]] = df
+            if len(batch) >= batch_size or done == len(files):
+                saved += _save(backend, batch)
+            if progress is not None and (done % batch_size == 0 or done == len(files)):
+                progress(done, len(files), saved, time.perf_counter() - start)
+
+    seconds = time.perf_counter() - start
+    logger.info(f"Reparsed {done} pages ({failed} failed) into {saved} snapshots in {seconds:.1f}s.")
+    return {'pages': done, 'failed': failed, 'snapshots': saved, 'seconds': seconds}
+
+
+def _save(backend: Storage, batch: dict) -> int:
+    # one bulk write per batch, in time order
+    if not batch:
+        return 0
+    with timer('storage_save'):
+        count = backend.save_many([batch[ts] for ts in sorted(batch)])
+    batch.clear()
+    return count
+
+
+def _parse_page(filename: str):
+    # runs in a worker process
+    try:
+        with open(filename, 'rb') as f:
+            html = gzip.decompress(f.read()).decode('utf-8')
+    except (OSError, EOFError, zlib.error, UnicodeDecodeError) as e:
+        logger.error(f"Failed to read the archived page {filename}: {e}")
+        return None
+    try:
+        df = parse_html(html)
+    except Exception as e:
+        # one broken page must not stop the whole run
+        logger.error(f"Uncaught error while parsing the archived page {filename}: {e}")
+        return None
+    if df is None:
+        logger.error(f"Failed to parse the archived page {filename}.")
+    return df
+
+
+def _page(root: str, digest: str) -> str:
+    return os.path.join(root, digest[:2], digest + EXT)
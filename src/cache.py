@@ -0,0 +1,87 @@
+import time
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+try:
+    from .metrics import CACHE_REQUESTS
+    from .utils import get_logger
+except ImportError:
+    from metrics import CACHE_REQUESTS
+    from utils import get_logger
+
+
+logger = get_logger('Cache', filename='cache.log')
+
+
+class SnapshotCache:
+    """
+    Thread-safe TTL cache for parsed exchange rate snapshots.
+
+    Entries are keyed by source, e.g. ('live', url) or ('storage', path). An entry is served until its TTL
+    expires or until the caller passes a different `version` (e.g. the storage directory mtime), whichever
+    comes first. Concurrent misses on the same key are coalesced: only one caller runs the loader, the
+    others wait for it and reuse its result. With `maxsize`, the oldest entries are evicted first.
+    Hits and misses are counted per `name` in the metrics.
+    """
+
+    def __init__(self, ttl: float = 60.0, maxsize: Optional[int] = None, name: str = 'snapshot'):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        # key -> (expire time, version, value)
+        self._entries: Dict[Hashable, Tuple[float, Any, Any]] = {}
+        # key -> lock held by the caller currently loading that key
+        self._locks: Dict[Hashable, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def get(self, key: Hashable, loader: Callable[[], Any], version: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if self._is_fresh(entry, version):
+            CACHE_REQUESTS.inc(cache=self.name, result='hit')
+            return entry[2]
+
+        with self._key_lock(key):
+            # another caller may have refreshed the entry while we were waiting for the lock
+            entry = self._entries.get(key)
+            if self._is_fresh(entry, version):
+                CACHE_REQUESTS.inc(cache=self.name, result='hit')
+                return entry[2]
+            logger.debug(f"Cache miss: {key}")
+            CACHE_REQUESTS.inc(cache=self.name, result='miss')
+            value = loader()
+            self.put(key, value, version=version)
+            return value
+
+    def put(self, key: Hashable, value: Any, version: Any = None):
+        if value is None:
+            return
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl, version, value)
+        if self.maxsize is not None:
+            while len(self._entries) > self.maxsize:
+                self._evict(next(iter(self._entries)))
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def _evict(self, key: Hashable):
+        self._entries.pop(key, None)
+        with self._guard:
+            lock = self._locks.get(key)
+            if lock is not None and not lock.locked():
+                del self._locks[key]
+
+    def _is_fresh(self, entry: Optional[Tuple[float, Any, Any]], version: Any) -> bool:
+        if entry is None:
+            return False
+        expires, entry_version, _ = entry
+        return expires > time.monotonic() and entry_version == version
+
+    def _key_lock(self, key: Hashable) -> threading.Lock:
+        with self._guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
@@ -0,0 +1,114 @@
+import math
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+try:
+    from .snapshot import Snapshot, encode_response
+    from .utils import get_logger, CURRENCY
+except ImportError:
+    from snapshot import Snapshot, encode_response
+    from utils import get_logger, CURRENCY
+
+
+"""
+Cross rates between every pair of quoted currencies, CNY included.
+ICBC quotes each currency in CNY per 100 units: converting FROM into TO sells FROM to the bank at its buy price
+and buys TO at its sell price, so per unit of FROM
+    buy[FROM, TO]  = buy[FROM] / sell[TO]    (units of TO received for 1 FROM)
+    sell[FROM, TO] = sell[FROM] / buy[TO]    (units of TO paid for 1 FROM)
+for the 现汇 (exch) and 现钞 (cash) prices, CNY converts at 1. Missing quotes ('--') are NaN, propagate to every
+rate they are part of and are returned as null.
+The N×N matrices are built once per snapshot and cached on it, see `Snapshot.cross_rates()`.
+"""
+
+
+logger = get_logger('CrossRate', filename='crossrate.log')
+
+CODES = ('CNY',) + CURRENCY
+CODE_INDEX = {code: i for i, code in enumerate(CODES)}
+# matrix name -> (price converted from, price converted to)
+MATRICES = {
+    'exch_buy': ('exch_buy', 'exch_sell'),
+    'exch_sell': ('exch_sell', 'exch_buy'),
+    'cash_buy': ('cash_buy', 'cash_sell'),
+    'cash_sell': ('cash_sell', 'cash_buy'),
+}
+
+
+class CrossRates:
+    def __init__(self, snapshot: Snapshot):
+        self.published = snapshot.published
+        prices = {field: _unit_prices(snapshot, field) for field in ('exch_buy', 'exch_sell', 'cash_buy', 'cash_sell')}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.matrices: Dict[str, np.ndarray] = {
+                name: prices[source][:, None] / prices[target][None, :]
+                for name, (source, target) in MATRICES.items()
+            }
+
+    def convert(self, sources: List[str], targets: List[str], amount: float = 1.0) -> List[dict]:
+        # one record per (source, target) pair, rates multiplied by `amount`
+        rows = [CODE_INDEX[code] for code in sources]
+        cols = [CODE_INDEX[code] for code in targets]
+        blocks = {name: matrix[np.ix_(rows, cols)] * amount for name, matrix in self.matrices.items()}
+        published = self.published.strftime('%Y-%m-%d %H:%M:%S')
+        records = []
+        for i, source in enumerate(sources):
+            for j, target in enumerate(targets):
+                record = {'from': source, 'to': target, 'amount': amount, 'datetime': published}
+                for name, block in blocks.items():
+                    value = float(block[i, j])
+                    record[name] = None if math.isnan(value) else value
+                records.append(record)
+        return records
+
+
+def cross_rate(snapshot: Snapshot, source: str, target: str, amount=1.0) -> List[dict]:
+    # source/target: a code (CNY included), a comma separated list or 'all'; raises ValueError on invalid input
+    sources = _codes(source)
+    targets = _codes(target)
+    try:
+        amount = float(amount)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid amount: {amount}.")
+    if not math.isfinite(amount):
+        raise ValueError(f"Invalid amount: {amount}.")
+    return snapshot.cross_rates().convert(sources, targets, amount)
+
+
+def get_cross_rate(snapshot: Optional[Snapshot], source: str, target: str, amount=1.0) -> Tuple[bytes, bool]:
+    # returns the encoded response and whether the request succeeded
+    if snapshot is None:
+        return _error('Failed to get the exchange rate.'), False
+    try:
+        records = cross_rate(snapshot, source, target, amount)
+    except ValueError as e:
+        return _error(str(e)), False
+    return encode_response({'status': 'success', 'data': records}), True
+
+
+def _unit_prices(snapshot: Snapshot, field: str) -> np.ndarray:
+    # CNY per unit in CODES order, NaN for currencies that are not (or not validly) quoted
+    prices = np.full(len(CODES), np.nan)
+    prices[0] = 1.0
+    for quote in snapshot.quotes:
+        i = CODE_INDEX.get(quote.currency)
+        if i is not None:
+            prices[i] = getattr(quote, field) / 100
+    prices[prices <= 0] = np.nan
+    return prices
+
+
+def _codes(value: Optional[str]) -> List[str]:
+    if not value:
+        raise ValueError('No currency specified.')
+    if value.strip().upper() == 'ALL':
+        return list(CODES)
+    codes = [code.strip().upper() for code in value.split(',')]
+    invalid = [code for code in codes if code not in CODE_INDEX]
+    if invalid:
+        raise ValueError(f"Invalid currency: {', '.join(invalid)}.")
+    return codes
+
+
+def _error(message: str) -> bytes:
+    logger.error(message)
+    return encode_response({'status': 'error', 'message': message})
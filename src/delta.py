@@ -0,0 +1,40 @@
+import hashlib
+import pandas as pd
+from typing import List, Optional
+try:
+    from .utils import FIELDS
+except ImportError:
+    from utils import FIELDS
+
+
+"""
+Change detection between two parsed exchange rate tables.
+1. `table_hash(df)`: content hash of a table, stable across processes (persisted with the storage).
+2. `changed_currencies(previous, df)`: the currencies whose name or prices differ, including added/removed ones.
+'发布时间' is part of the hash but not of the per-currency comparison: a table re-stamped by the bank
+with the same prices is a new snapshot, but no currency changed.
+"""
+
+
+# compared per currency, '发布时间' excluded
+VALUE_COLUMNS = ['币种'] + list(FIELDS.values())
+
+
+def table_hash(df: pd.DataFrame) -> str:
+    # NaN, floats and datetimes are rendered the same way as in the CSV storage
+    content = df.to_csv(header=True, index=False).encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
+
+
+def changed_currencies(previous: Optional[pd.DataFrame], df: pd.DataFrame) -> List[str]:
+    if previous is None or previous.empty:
+        return list(df['代号'])
+    merged = df[['代号'] + VALUE_COLUMNS].merge(
+        previous[['代号'] + VALUE_COLUMNS], on='代号', how='outer', suffixes=('', '_prev'), indicator=True
+    )
+    changed = merged['_merge'] != 'both'
+    for column in VALUE_COLUMNS:
+        new, old = merged[column], merged[column + '_prev']
+        # two missing quotes are equal
+        changed |= (new != old) & ~(new.isna() & old.isna())
+    return list(merged.loc[changed, '代号'])
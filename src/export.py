@@ -0,0 +1,162 @@
+import io
+import csv
+import json
+import math
+from datetime import datetime
+from typing import Iterable, Iterator, Optional
+try:
+    from .history import _parse_datetime
+    from .storage import open_storage
+    from .utils import get_logger, CURRENCY
+except ImportError:
+    from history import _parse_datetime
+    from storage import open_storage
+    from utils import get_logger, CURRENCY
+
+
+"""
+Streaming export of the stored history as CSV, NDJSON or Arrow IPC (stream format, requires `pip install pyarrow`).
+Rows are read lazily from the storage (see `Storage.iter_rows`, which applies the currency and time filters)
+and encoded into chunks of about CHUNK_SIZE bytes, so memory stays constant whatever the size of the history.
+Every format has the API record keys: currency, name, exch_buy, cash_buy, exch_sell, cash_sell, datetime.
+"""
+
+
+logger = get_logger('Export', filename='export.log')
+
+# format -> (content type, file extension)
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrow'),
+}
+KEYS = ('currency', 'name', 'exch_buy', 'cash_buy', 'exch_sell', 'cash_sell', 'datetime')
+CHUNK_SIZE = 64 * 1024
+# rows per Arrow record batch
+BATCH_ROWS = 10000
+
+
+def export_history(
+        storage: str,
+        fmt: str = 'csv',
+        currency: Optional[str] = None,
+        start: Optional[str] = None,
+        end: Optional[str] = None
+) -> Iterator[bytes]:
+    # validates the arguments eagerly (ValueError) and returns the lazy byte stream
+    fmt = fmt.lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Invalid format: {fmt}, expected one of {', '.join(FORMATS)}.")
+    currencies = None
+    if currency and currency.upper() != 'ALL':
+        currencies = [code.strip().upper() for code in currency.split(',')]
+        invalid = [code for code in currencies if code not in CURRENCY]
+        if invalid:
+            raise ValueError(f"Invalid currency: {', '.join(invalid)}.")
+    try:
+        # same range as /exchangerate/history, a date-only `to` includes that whole day
+        start_dt = _parse_datetime(start)
+        end_dt = _parse_datetime(end, end_of_day=True)
+    except ValueError:
+        raise ValueError(f"Invalid time range: from={start}, to={end}.")
+    if fmt == 'arrow':
+        try:
+            import pyarrow
+        except ImportError:
+            raise ValueError('The Arrow export requires pyarrow, e.g. `pip install pyarrow`.')
+
+    rows = open_storage(storage).iter_rows(start_dt, end_dt, currencies)
+    logger.info(f"Exporting {storage} as {fmt}: currency={currency}, from={start}, to={end}.")
+    if fmt == 'csv':
+        return _csv(rows)
+    if fmt == 'ndjson':
+        return _ndjson(rows)
+    return _arrow(rows)
+
+
+def _csv(rows: Iterable[tuple]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(KEYS)
+    for code, name, exch_buy, cash_buy, exch_sell, cash_sell, published in rows:
+        # missing quotes are empty cells, as in the CSV storage
+        writer.writerow((code, name, _cell(exch_buy), _cell(cash_buy), _cell(exch_sell), _cell(cash_sell), published))
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _ndjson(rows: Iterable[tuple]) -> Iterator[bytes]:
+    chunk, size = [], 0
+    for row in rows:
+        # missing quotes are null, NaN is not valid JSON
+        line = json.dumps(dict(zip(KEYS, (_none(value) for value in row))), ensure_ascii=False,
+                          separators=(',', ':')) + '\n'
+        chunk.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(chunk).encode('utf-8')
+            chunk, size = [], 0
+    if chunk:
+        yield ''.join(chunk).encode('utf-8')
+
+
+def _arrow(rows: Iterable[tuple]) -> Iterator[bytes]:
+    import pyarrow as pa
+
+    schema = pa.schema([
+        ('currency', pa.string()), ('name', pa.string()),
+        ('exch_buy', pa.float64()), ('cash_buy', pa.float64()),
+        ('exch_sell', pa.float64()), ('cash_sell', pa.float64()),
+        ('datetime', pa.timestamp('s')),
+    ])
+    sink = _Sink()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for columns in _batches(rows, BATCH_ROWS):
+            columns[-1] = [datetime.fromisoformat(value) for value in columns[-1]]
+            columns[2:6] = [[_none(value) for value in column] for column in columns[2:6]]
+            writer.write_batch(pa.record_batch(columns, schema=schema))
+            yield sink.drain()
+    # end-of-stream marker
+    yield sink.drain()
+
+
+class _Sink(io.RawIOBase):
+    # file-like object collecting what the Arrow writer produced since the last `drain()`
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _batches(rows: Iterable[tuple], size: int) -> Iterator[list]:
+    # column lists of up to `size` rows
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield [list(column) for column in zip(*batch)]
+            batch = []
+    if batch:
+        yield [list(column) for column in zip(*batch)]
+
+
+def _cell(value: float) -> str:
+    return '' if math.isnan(value) else repr(float(value))
+
+
+def _none(value):
+    return None if isinstance(value, float) and math.isnan(value) else value
@@ -1,22 +1,109 @@
+import os
+import hashlib
+import threading
 import requests
-from typing import Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Dict, NamedTuple, Optional, Tuple
 try:
+    from .metrics import UPSTREAM_ERRORS, timer
     from .utils import get_logger
 except ImportError:
+    from metrics import UPSTREAM_ERRORS, timer
     from utils import get_logger
 
 
 logger = get_logger('url_fetch', filename='fetch.log')
 
 
+class FetchResult(NamedTuple):
+    # `text` is None when the request failed or the page is not modified
+    text: Optional[str]
+    changed: bool
+    status: int
+
+
+class Fetcher:
+    """
+    Reusable HTTP client: pooled keep-alive connections, timeouts, bounded retries with backoff,
+    and conditional requests (ETag / Last-Modified / body hash) to detect unchanged pages.
+    """
+
+    def __init__(self,
+                 timeout: Tuple[float, float] = (5.0, 15.0),
+                 retries: int = 3,
+                 backoff: float = 0.5,
+                 pool_size: int = 10):
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=('GET', 'HEAD')
+        )
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+        # url -> {'etag': ..., 'last_modified': ..., 'hash': ...} of the last successful response
+        self._validators: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def fetch(self, url: str, conditional: bool = True) -> FetchResult:
+        validators = self._validators.get(url, {})
+        headers = {}
+        if conditional:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+
+        try:
+            with timer('fetch'):
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            logger.error(f"Failed to load the website: {url} ({e})")
+            UPSTREAM_ERRORS.inc(reason=type(e).__name__)
+            return FetchResult(None, False, 0)
+
+        if response.status_code == 304:
+            logger.info(f"The website is not modified: {url}")
+            return FetchResult(None, False, 304)
+        if response.status_code != 200:
+            logger.error(f"Failed to load the website: {response.status_code}")
+            UPSTREAM_ERRORS.inc(reason=f'http_{response.status_code}')
+            return FetchResult(None, False, response.status_code)
+
+        digest = hashlib.sha256(response.content).hexdigest()
+        changed = digest != validators.get('hash')
+        with self._lock:
+            self._validators[url] = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'hash': digest,
+            }
+        logger.info(f"Successfully loaded the website: {url}" + ('' if changed else ' (unchanged)'))
+        return FetchResult(response.text, changed or not conditional, 200)
+
+    def validators(self, url: str) -> dict:
+        # validators of the last successful response, to be persisted across processes
+        return dict(self._validators.get(url, {}))
+
+    def restore(self, url: str, validators: dict):
+        # seed the validators of a previous process, unless this one already fetched the url
+        with self._lock:
+            self._validators.setdefault(url, dict(validators))
+
+
+fetcher = Fetcher(
+    timeout=(float(os.getenv('FETCH_CONNECT_TIMEOUT', 5)), float(os.getenv('FETCH_READ_TIMEOUT', 15))),
+    retries=int(os.getenv('FETCH_RETRIES', 3)),
+)
+
+
 def fetch_html_content(url: str) -> Optional[str]:
-    response = requests.get(url)
-    if response.status_code == 200:
-        logger.info(f"Successfully loaded the website: {url}")
-        return response.text
-    else:
-        logger.error(f"Failed to load the website: {response.status_code}")
-        return None
+    return fetcher.fetch(url, conditional=False).text
 
 
 if __name__ == '__main__':
@@ -0,0 +1,204 @@
+import os
+import pandas as pd
+from datetime import datetime, time, timedelta
+from typing import List, Optional, Tuple
+try:
+    from .cache import SnapshotCache
+    from .snapshot import CST, encode_response
+    from .storage import open_storage
+    from .utils import get_logger, CURRENCY, FIELDS
+except ImportError:
+    from cache import SnapshotCache
+    from snapshot import CST, encode_response
+    from storage import open_storage
+    from utils import get_logger, CURRENCY, FIELDS
+
+
+logger = get_logger('History', filename='history.log')
+# resampled responses, keyed by (storage, currency, start, end, interval) and invalidated by the storage version
+history_cache = SnapshotCache(ttl=float(os.getenv('HISTORY_CACHE_TTL', 600)), maxsize=256, name='history')
+
+# default window when `from` is not given
+DEFAULT_DAYS = 30
+# max number of lookups in a single batch request
+MAX_BATCH = int(os.getenv('BATCH_MAX_QUERIES', 10000))
+# UTC offset at the end of a timestamp, e.g. '2023-04-01T10:00:00+02:00' or '...Z'
+OFFSET = r'\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?\s*(?:Z|[+-]\d{2}:?\d{2})$'
+
+
+def get_history(
+        storage: str,
+        currency: str = 'EUR',
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        interval: str = '1d'
+) -> Tuple[bytes, bool]:
+    # returns the encoded response and whether the request succeeded
+    currency = currency.upper()
+    if currency not in CURRENCY:
+        return _error(f"Invalid currency: {currency}."), False
+    try:
+        rule = pd.tseries.frequencies.to_offset(interval)
+    except ValueError:
+        return _error(f"Invalid interval: {interval}."), False
+    if rule.n <= 0:
+        return _error(f"Invalid interval: {interval}."), False
+    try:
+        start_dt = _parse_datetime(start)
+        end_dt = _parse_datetime(end, end_of_day=True)
+    except ValueError:
+        return _error(f"Invalid time range: from={start}, to={end}."), False
+
+    backend = open_storage(storage)
+    payload = history_cache.get(
+        (os.path.abspath(storage), currency, start_dt, end_dt, rule.freqstr),
+        lambda: _build_history(backend, currency, start_dt, end_dt, rule),
+        version=backend.version()
+    )
+    if payload is None:
+        return _error('Failed to get the exchange rate history.'), False
+    return payload, True
+
+
+def lookup_batch(storage: str, queries: List[dict], fields: Optional[List[str]] = None) -> Tuple[bytes, bool]:
+    # resolves many {'currency': 'EUR', 'timestamp': '2023-04-01 10:00:00'} lookups to the quote valid at
+    # each timestamp, with a single range load of the storage and one vectorized as-of join
+    if not isinstance(queries, list) or len(queries) == 0:
+        return _error('No queries given.'), False
+    if len(queries) > MAX_BATCH:
+        return _error(f"Too many queries: {len(queries)} > {MAX_BATCH}."), False
+    fields = list(FIELDS) if not fields else [field.strip().lower() for field in fields]
+    invalid = [field for field in fields if field not in FIELDS]
+    if invalid:
+        return _error(f"Invalid fields: {', '.join(invalid)}."), False
+    try:
+        lookups = pd.DataFrame({
+            'currency': [str(query['currency']).upper() for query in queries],
+            'timestamp': parse_timestamps(pd.Series([query['timestamp'] for query in queries])),
+        })
+    except (KeyError, TypeError, ValueError) as e:
+        return _error(f"Invalid queries: {e}"), False
+    invalid = [str(queries[i]['timestamp']) for i in lookups.index[lookups['timestamp'].isna()]]
+    if invalid:
+        return _error(f"Invalid timestamps: {', '.join(invalid[:10])}."), False
+    invalid = sorted(set(lookups['currency']) - set(CURRENCY))
+    if invalid:
+        return _error(f"Invalid currency: {', '.join(invalid)}."), False
+
+    # load the snapshot valid at the earliest timestamp and everything after it up to the latest one
+    backend = open_storage(storage)
+    start = backend.timestamp_at(lookups['timestamp'].min())
+    history = backend.load(start=start or lookups['timestamp'].min(), end=lookups['timestamp'].max())
+    resolved = resolve_asof(history, lookups)
+    logger.info(f"Resolved {len(lookups)} lookups against {len(history)} stored rows.")
+
+    columns = [FIELDS[field] for field in fields]
+    data = [
+        dict(
+            currency=currency,
+            timestamp=ts.strftime('%Y-%m-%d %H:%M:%S'),
+            name=None if pd.isna(published) else name,
+            datetime=None if pd.isna(published) else published.strftime('%Y-%m-%d %H:%M:%S'),
+            **{field: None if pd.isna(published) else value for field, value in zip(fields, values)}
+        )
+        for currency, ts, name, published, *values in
+        resolved[['currency', 'timestamp', '币种', '发布时间'] + columns].itertuples(index=False, name=None)
+    ]
+    return encode_response({
+        'status': 'success',
+        'data': data
+    }), True
+
+
+def parse_timestamps(values: pd.Series) -> pd.Series:
+    # naive China Standard Time, NaT when invalid; naive and offset timestamps are parsed apart,
+    # pandas would read the naive ones as UTC in a mixed column
+    values = values.astype(str).str.strip()
+    aware = values.str.contains(OFFSET, regex=True)
+    ts = pd.to_datetime(values.where(~aware), format='ISO8601', errors='coerce').astype('datetime64[ns]')
+    if aware.any():
+        converted = pd.to_datetime(values[aware], format='ISO8601', errors='coerce', utc=True)
+        ts[aware] = converted.dt.tz_convert(CST).dt.tz_localize(None).astype('datetime64[ns]')
+    return ts
+
+
+def resolve_asof(history: pd.DataFrame, lookups: pd.DataFrame) -> pd.DataFrame:
+    # for every (currency, timestamp) lookup, the latest stored quote published at or before the timestamp;
+    # the result keeps the order of `lookups`
+    left = lookups.reset_index().sort_values('timestamp')
+    left['timestamp'] = left['timestamp'].astype('datetime64[ns]')
+    right = history.sort_values('发布时间').copy()
+    right['发布时间'] = right['发布时间'].astype('datetime64[ns]')
+    # keep the quote time as a regular column, merge_asof consumes the join key
+    right['_on'] = right['发布时间']
+    merged = pd.merge_asof(
+        left, right,
+        left_on='timestamp', right_on='_on',
+        left_by='currency', right_by='代号',
+        direction='backward'
+    )
+    return merged.sort_values('index').set_index('index').drop(columns=['_on'])
+
+
+def resample_history(df: pd.DataFrame, currency: str, interval: str = '1d') -> pd.DataFrame:
+    # open/high/low/close/mean of every price column per interval, e.g. ('现汇卖出价', 'close')
+    df = df[df['代号'] == currency]
+    if df.empty:
+        # nothing stored in the range, an empty load has no DatetimeIndex to resample
+        columns = pd.MultiIndex.from_product([list(FIELDS.values()), ['open', 'high', 'low', 'close', 'mean']])
+        return pd.DataFrame(columns=columns, index=pd.DatetimeIndex([], name='发布时间'))
+    df = df.set_index('发布时间').sort_index()
+    out = df[list(FIELDS.values())].resample(interval).agg(['first', 'max', 'min', 'last', 'mean', 'count'])
+    out = out.rename(columns={'first': 'open', 'max': 'high', 'min': 'low', 'last': 'close'}, level=1)
+    # drop the intervals without any snapshot
+    counts = out.xs('count', axis=1, level=1)
+    return out[counts.max(axis=1) > 0].drop(columns='count', level=1)
+
+
+def _build_history(backend, currency: str, start: Optional[datetime], end: Optional[datetime], rule) -> Optional[bytes]:
+    if start is None:
+        if end is None:
+            timestamps = backend.timestamps()
+            if not timestamps:
+                logger.error(f"No snapshots found in {backend.path}.")
+                return None
+            reference = timestamps[-1]
+        else:
+            reference = end
+        start = reference - timedelta(days=DEFAULT_DAYS)
+
+    # only the snapshots within the requested range are loaded
+    df = backend.load(start=start, end=end)
+    resampled = resample_history(df, currency, interval=rule)
+    logger.info(f"Resampled {len(df)} rows of {currency} into {len(resampled)} intervals of {rule.freqstr}.")
+
+    data = []
+    for ts, row in zip(resampled.index, resampled.to_dict(orient='records')):
+        item = {'datetime': ts.strftime('%Y-%m-%d %H:%M:%S')}
+        for field, column in FIELDS.items():
+            item[field] = {stat: row[(column, stat)] for stat in ('open', 'high', 'low', 'close', 'mean')}
+        data.append(item)
+    return encode_response({
+        'status': 'success',
+        'currency': currency,
+        'interval': rule.freqstr,
+        'data': data
+    })
+
+
+def _parse_datetime(value: Optional[str], end_of_day: bool = False) -> Optional[datetime]:
+    # accepts e.g. '2023-04-01' or '2023-04-01 04:14:05', a date-only end of range includes that whole day
+    if value is None or value == '':
+        return None
+    dt = datetime.fromisoformat(value)
+    if end_of_day and len(value) == 10:
+        dt = datetime.combine(dt.date(), time.max)
+    return dt
+
+
+def _error(message: str) -> bytes:
+    logger.error(message)
+    return encode_response({
+        'status': 'error',
+        'message': message
+    })
@@ -1,22 +1,42 @@
 import os
+import json
 import pandas as pd
-from typing import Optional
+from typing import Callable, Dict, List, Optional, Tuple
 try:
-    from . import trigger
-    from .fetch import fetch_html_content
-    from .parse import parse_html, parse_csv
-    from .utils import get_outdated_files, get_latest_file, get_logger, CURRENCY, \
-        get_modules
+    from .archive import ARCHIVE_ENABLED, archive_html
+    from .cache import SnapshotCache
+    from .delta import changed_currencies, table_hash
+    from .fetch import fetcher
+    from .metrics import timer
+    from .parse import parse_html
+    from .retention import DEFAULT_POLICY, parse_policy, select_expired
+    from .shared import shared_snapshot
+    from .snapshot import Snapshot, ERROR_RESPONSE, ERROR_PAYLOAD
+    from .storage import Storage, open_storage
+    from .utils import get_logger, CURRENCY, get_modules
 except ImportError:
-    import trigger
-    from fetch import fetch_html_content
-    from parse import parse_html, parse_csv
-    from utils import get_outdated_files, get_latest_file, get_logger, CURRENCY, \
-        get_modules
+    from archive import ARCHIVE_ENABLED, archive_html
+    from cache import SnapshotCache
+    from delta import changed_currencies, table_hash
+    from fetch import fetcher
+    from metrics import timer
+    from parse import parse_html
+    from retention import DEFAULT_POLICY, parse_policy, select_expired
+    from shared import shared_snapshot
+    from snapshot import Snapshot, ERROR_RESPONSE, ERROR_PAYLOAD
+    from storage import Storage, open_storage
+    from utils import get_logger, CURRENCY, get_modules
 
 
 logger = get_logger('Index', filename='index.log')
-triggers = get_modules(trigger, prefix='trigger_')
+# loaded on the first pipeline run with triggers enabled, importing them initializes PushDeer
+triggers: Optional[List[Callable]] = None
+# shared snapshot cache, keyed by source: ('live', url) or ('storage', path)
+snapshot_cache = SnapshotCache(ttl=float(os.getenv('SNAPSHOT_CACHE_TTL', 60)))
+# url -> last parsed table, reused when the page has not changed since
+_parsed: Dict[str, pd.DataFrame] = {}
+# (url, storage) -> content hash of the last table handled for that destination
+_hashes: Dict[tuple, str] = {}
 
 
 def pipeline(
@@ -25,31 +45,77 @@ def pipeline(
         verbose: bool = False,
         debug: bool = False,
         clean: bool = False,
-        use_triggers: bool = False
+        use_triggers: bool = False,
+        retention: Optional[str] = None
 ) -> Optional[pd.DataFrame]:
+    backend = open_storage(storage) if storage is not None else None
+    key = _state_key(url, storage)
+    if backend is not None and key not in _hashes:
+        # the validators and table hash of the last run are persisted with the storage,
+        # so that a new process (e.g. cron) detects unchanged content too
+        _restore_state(url, backend, key)
+
     # fetch html content
     if verbose:
         print(f"Fetching html content from: {url}")
-    html_content = fetch_html_content(url=url)
-    if html_content is None:
-        _log('No html content to parse.', verbose=verbose, level='error')
-        return
+    df = None
+    previous = _parsed.get(url)
+    result = fetcher.fetch(url, conditional=bool(fetcher.validators(url)))
+    if result.status in (200, 304) and not result.changed:
+        # not modified (304 or same body hash), skip parsing
+        df = previous if previous is not None or backend is None else backend.latest()
+        if df is not None:
+            _log('Html content is not modified, reusing the last parsed table.', verbose=verbose)
+        else:
+            # nothing to reuse, fetch the page again
+            result = fetcher.fetch(url, conditional=False)
 
-    # parse html content
-    if verbose:
-        print('Parsing html content.')
-    df = parse_html(html_content, debug=debug)
     if df is None:
-        _log('Failed to parse the html content.', verbose=verbose, level='error')
-        return
+        html_content = result.text
+        if html_content is None:
+            _log('No html content to parse.', verbose=verbose, level='error')
+            return
+        if ARCHIVE_ENABLED and backend is not None and backend.exists():
+            # kept before parsing, a page the parser fails on can be parsed again later (main.py --reparse)
+            _archive(storage, html_content, url, verbose=verbose)
+
+        # parse html content
+        if verbose:
+            print('Parsing html content.')
+        df = parse_html(html_content, debug=debug)
+        if df is None:
+            _log('Failed to parse the html content.', verbose=verbose, level='error')
+            return
+    _parsed[url] = df
+    # the freshly parsed table is the newest live snapshot
+    snapshot = Snapshot.from_dataframe(df)
+    snapshot_cache.put(('live', url), snapshot)
+
+    # skip triggers and storage when the table is the one this destination already has
+    digest = table_hash(df)
+    stored = backend is None or backend.latest_timestamp() == df['发布时间'].iloc[0]
+    if digest == _hashes.get(key) and stored:
+        _log('The exchange rate table is not changed, skipping triggers and storage.', verbose=verbose)
+        _save_state(url, backend, key, digest)
+        # e.g. the first run after a reboot emptied /dev/shm
+        _share(snapshot, storage, verbose=verbose)
+        return df
+    if backend is not None:
+        # compare with what this destination has, the in-memory table may come from a live request
+        previous = backend.latest()
+    changed = changed_currencies(previous, df)
+    _log(f"Changed currencies: {', '.join(changed) if changed else 'none'}.", verbose=verbose)
 
     # use triggers
     if verbose:
         print('Activating triggers.')
-    if use_triggers:
-        for fn in triggers:
+    if use_triggers and not changed:
+        _log('No currency changed, skipping triggers.', verbose=verbose)
+    elif use_triggers:
+        for fn in list(_get_triggers()):
             try:
-                st = fn(df)
+                with timer('trigger', name=fn.__name__):
+                    st = fn(df)
             except Exception as e:
                 _log(f"Uncaught error occurred in Trigger <{fn.__name__}>. "
                      f"It will be removed from future scheduled jobs. "
@@ -68,30 +134,35 @@ def pipeline(
     # save to storage
     if verbose:
         print('Saving to storage.')
-    if storage is not None:
+    if backend is not None:
         # check storage path exists
-        if not os.path.exists(storage):
+        if not backend.exists():
             _log(f"Storage path does not exist: {storage}", verbose=verbose, level='error')
             return df
         else:
-            # make filename as datetime from df
-            filename = os.path.join(storage, df['发布时间'].iloc[0].strftime('%Y_%m_%d-%H_%M_%S') + '.csv')
-            # save to storage
-            df.to_csv(filename, header=True, index=False)
-            _log(f"Successfully saved to storage: {storage}", verbose=verbose)
+            # the snapshot is named by the datetime from df
+            with timer('storage_save'):
+                location = backend.save(df)
+            _log(f"Successfully saved to storage: {location}", verbose=verbose)
+            # a new snapshot landed, drop the cached storage snapshot
+            snapshot_cache.invalidate(_storage_key(storage))
+            _share(snapshot, storage, verbose=verbose)
+    _save_state(url, backend, key, digest)
 
-    # clean storage if files are 60 days away from the latest file
+    # clean storage according to the retention policy (default: snapshots 60 days away from the latest one)
     if verbose:
         print('Cleaning storage.')
-    if clean:
-        outdated_files = get_outdated_files(storage, ext='csv', days=60)
-        if len(outdated_files) > 0:
-            for file in outdated_files:
-                try:
-                    os.remove(file)
-                    _log(f"Successfully removed file: {file}", verbose=verbose)
-                except OSError:
-                    _log(f"Failed to remove file: {file}", verbose=verbose, level='error')
+    if clean and backend is not None:
+        try:
+            tiers = parse_policy(retention or DEFAULT_POLICY)
+        except ValueError as e:
+            _log(f"Invalid retention policy, storage is not cleaned: {e}", verbose=verbose, level='error')
+            tiers = []
+        outdated = select_expired(backend, tiers)
+        if len(outdated) > 0:
+            with timer('storage_remove'):
+                removed = backend.remove(outdated)
+            _log(f"Successfully removed {removed}/{len(outdated)} outdated snapshots.", verbose=verbose)
         else:
             _log(f"No outdated files to remove.", verbose=verbose)
 
@@ -100,6 +171,98 @@ def pipeline(
     return df
 
 
+def _state_key(url: str, storage: Optional[str]) -> tuple:
+    # change detection is tracked per destination, a live fetch must not hide a new table from the storage
+    return url, None if storage is None else os.path.abspath(storage)
+
+
+def _restore_state(url: str, backend: Storage, key: tuple):
+    validators = backend.get_meta(f'fetch:{url}')
+    if validators is not None:
+        fetcher.restore(url, json.loads(validators))
+    digest = backend.get_meta(f'table:{url}')
+    if digest is not None:
+        _hashes[key] = digest
+
+
+def _save_state(url: str, backend: Optional[Storage], key: tuple, digest: str):
+    _hashes[key] = digest
+    if backend is None or not backend.exists():
+        return
+    # only write what changed, a CSV meta write bumps the storage version (cache, SSE watcher) like a new snapshot
+    for name, value in ((f'fetch:{url}', json.dumps(fetcher.validators(url))), (f'table:{url}', digest)):
+        if backend.get_meta(name) != value:
+            backend.set_meta(name, value)
+
+
+def _archive(storage: str, html: str, url: str, verbose: bool = False):
+    try:
+        filename = archive_html(storage, html, url=url)
+    except OSError as e:
+        _log(f"Failed to archive the html content: {e}", verbose=verbose, level='error')
+        return
+    if filename is not None:
+        _log(f"Archived the html content: {filename}", verbose=verbose)
+
+
+def _share(snapshot: Snapshot, storage: Optional[str], verbose: bool = False):
+    # publish the stored snapshot to the API workers
+    if not shared_snapshot.enabled or storage is None:
+        return
+    try:
+        if shared_snapshot.publish(snapshot, storage):
+            _log(f"Shared the snapshot with the API workers: {shared_snapshot.path}", verbose=verbose)
+    except (OSError, ValueError) as e:
+        _log(f"Failed to share the snapshot: {e}", verbose=verbose, level='error')
+
+
+def _get_triggers() -> List[Callable]:
+    global triggers
+    if triggers is None:
+        try:
+            from . import trigger
+        except ImportError:
+            import trigger
+        triggers = get_modules(trigger, prefix='trigger_')
+    return triggers
+
+
+def get_snapshot(
+        url: str,
+        now: bool = True,
+        storage: str = 'assets/',
+        verbose: bool = False,
+        debug: bool = False
+) -> Optional[Snapshot]:
+    # run pipeline to get the currency exchange rate
+    # the snapshot published by the producer process, when it shares one for this storage
+    snapshot = shared_snapshot.get(storage) if not now and shared_snapshot.enabled else None
+    if snapshot is None and not now:
+        # get currency exchange rate from storage
+        snapshot = snapshot_cache.get(
+            _storage_key(storage),
+            lambda: _load_from_storage(url=url, storage=storage, verbose=verbose, debug=debug),
+            version=open_storage(storage).version()
+        )
+    elif snapshot is None:
+        if verbose:
+            print('Getting the exchange rate at present.')
+        snapshot = snapshot_cache.get(('live', url), lambda: _to_snapshot(pipeline(url=url, debug=debug)))
+
+    if snapshot is None:
+        logger.error('Failed to get the exchange rate snapshot.')
+    return snapshot
+
+
+def get_stored_snapshot(storage: str) -> Optional[Snapshot]:
+    # the latest snapshot of `storage` (or the one shared for it), None when it is empty: never fetches upstream
+    snapshot = shared_snapshot.get(storage) if shared_snapshot.enabled else None
+    if snapshot is None:
+        backend = open_storage(storage)
+        snapshot = snapshot_cache.get(_storage_key(storage), backend.latest_snapshot, version=backend.version())
+    return snapshot
+
+
 def get_exchange_rate(
         url: str,
         currency: str = 'EUR',
@@ -111,25 +274,11 @@ def get_exchange_rate(
     if verbose:
         print(f"Getting the exchange rate of {currency} from url: {url}")
 
-    # run pipeline to get the currency exchange rate
-    if not now:
-        # get currency exchange rate from storage
-        filename = get_latest_file(storage)
-        if filename is None:
-            logger.error(f'Failed to get the latest file in {storage}. Use pipeline to get the exchange rate.')
-            df = pipeline(url=url, debug=debug)
-        else:
-            if verbose:
-                print('Getting the exchange rate from storage.')
-            df = parse_csv(filename, debug=debug)
-    else:
-        if verbose:
-            print('Getting the exchange rate at present.')
-        df = pipeline(url=url, debug=debug)
-
-    if df is None:
+    snapshot = get_snapshot(url=url, now=now, storage=storage, verbose=verbose, debug=debug)
+    if snapshot is None:
         logger.error('Failed to get the exchange rate DataFrame.')
         return
+    df = snapshot.df
 
     # validate currency
     currency = currency.upper()
@@ -147,44 +296,74 @@ def get_exchange_rate(
     return df
 
 
+def _load_from_storage(url: str, storage: str, verbose: bool = False, debug: bool = False) -> Optional[Snapshot]:
+    snapshot = open_storage(storage).latest_snapshot()
+    if snapshot is None:
+        logger.error(f'Failed to get the latest snapshot in {storage}. Use pipeline to get the exchange rate.')
+        return _to_snapshot(pipeline(url=url, debug=debug))
+    if verbose:
+        print('Getting the exchange rate from storage.')
+    return snapshot
+
+
+def _to_snapshot(df: Optional[pd.DataFrame]) -> Optional[Snapshot]:
+    if df is None or df.empty:
+        return None
+    return Snapshot.from_dataframe(df)
+
+
+def _storage_key(storage: str) -> tuple:
+    return 'storage', os.path.abspath(storage)
+
+
 def get_exchange_rate_bank_sell(*args, **kwargs):
     if 'currency' not in kwargs:
         print("Please specify the currency.")
         return
-    df = get_exchange_rate(*args, **kwargs)
-    print(f"{kwargs['currency']} 现汇卖出价: {df['现汇卖出价'].iloc[0]}")
+    currency = kwargs.pop('currency')
+    snapshot = get_snapshot(*args, **kwargs)
+    # O(1) lookup of the currency in the snapshot
+    quote = snapshot.get(currency) if snapshot is not None else None
+    if quote is None:
+        print(f"Failed to get the exchange rate of {currency}.")
+        return
+    print(f"{currency} 现汇卖出价: {quote.exch_sell}")
     return
 
 
-def get_exchange_rate_api(*args, **kwargs):
-    df = get_exchange_rate(*args, **kwargs)
+def get_exchange_rate_api(
+        url: str,
+        currency: str = 'EUR',
+        now: bool = True,
+        storage: str = 'assets/',
+        verbose: bool = False,
+        debug: bool = False,
+        fields: Optional[str] = None
+) -> dict:
+    snapshot = get_snapshot(url=url, now=now, storage=storage, verbose=verbose, debug=debug)
+    response = snapshot.response(currency, fields) if snapshot is not None else None
+    if response is None:
+        logger.error(f"Failed to get the exchange rate of {currency}.")
+        return ERROR_RESPONSE
+    return response
 
-    if df is None:
-        return {
-            'status': 'error',
-            'message': 'Failed to get the exchange rate.'
-        }
-
-    # create response
-    exch_rate = [
-        {
-            'currency': cur,
-            'name': name,
-            'exch_buy': exch_buy,
-            'exch_sell': exch_sell,
-            'cash_buy': cash_buy,
-            'cash_sell': cash_sell,
-            'datetime': dt.strftime('%Y-%m-%d %H:%M:%S'),
-        }
-        for cur, name, exch_buy, cash_buy, exch_sell, cash_sell, dt in
-        zip(*df.to_dict(orient='list').values())
-    ]
-    response = {
-        'status': 'success',
-        'data': exch_rate
-    }
 
-    return response
+def get_exchange_rate_payload(
+        url: str,
+        currency: str = 'EUR',
+        now: bool = True,
+        storage: str = 'assets/',
+        verbose: bool = False,
+        debug: bool = False,
+        fields: Optional[str] = None
+) -> Tuple[bytes, Optional[Snapshot]]:
+    # pre-encoded JSON response and the snapshot it belongs to (for ETag/Last-Modified)
+    snapshot = get_snapshot(url=url, now=now, storage=storage, verbose=verbose, debug=debug)
+    payload = snapshot.payload(currency, fields) if snapshot is not None else None
+    if payload is None:
+        logger.error(f"Failed to get the exchange rate of {currency}.")
+        return ERROR_PAYLOAD, None
+    return payload, snapshot
 
 
 def _log(msg: str, verbose: bool = False, level: str = 'info'):
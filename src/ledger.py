@@ -0,0 +1,134 @@
+import os
+import pandas as pd
+from typing import BinaryIO, Iterator, List, Optional
+try:
+    from .history import parse_timestamps, resolve_asof
+    from .metrics import timer
+    from .storage import open_storage
+    from .utils import get_logger, FIELDS
+except ImportError:
+    from history import parse_timestamps, resolve_asof
+    from metrics import timer
+    from storage import open_storage
+    from utils import get_logger, FIELDS
+
+
+"""
+As-of conversion of ledgers: CSV or NDJSON rows with `timestamp`, `currency` and `amount` are converted to CNY
+at the quote valid at each timestamp, i.e. the latest stored snapshot published at or before it (`resolve_asof`).
+The input is read and answered CHUNK_ROWS rows at a time, in its own format and order, so memory depends on the
+chunk size and the history range of a chunk, not on the size of the ledger.
+Every output row keeps the input columns and adds `datetime` (publish time of the quote used) and, per field,
+the price (CNY per 100 units) and `<field>_cny` (the converted amount); rows without a quote (unknown currency,
+before the first snapshot, invalid timestamp or amount) get empty values.
+Timestamps are China Standard Time like '发布时间', timestamps with an offset are converted to it.
+"""
+
+
+logger = get_logger('Ledger', filename='ledger.log')
+
+# format -> content type
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+COLUMNS = ('timestamp', 'currency', 'amount')
+# converted amounts are rounded to drop the float noise, e.g. 35.836999999999996 -> 35.837
+DECIMALS = 6
+CHUNK_ROWS = int(os.getenv('LEDGER_CHUNK_ROWS', 50000))
+# smallest step between two stored snapshots (they are named to the second)
+EPSILON = pd.Timedelta(microseconds=1)
+
+
+def convert_ledger(
+        storage: str,
+        stream: BinaryIO,
+        fmt: str = 'csv',
+        fields: Optional[List[str]] = None
+) -> Iterator[bytes]:
+    # validates the arguments and the first chunk eagerly (ValueError) and returns the lazy byte stream
+    fmt = fmt.lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Invalid format: {fmt}, expected one of {', '.join(FORMATS)}.")
+    fields = list(FIELDS) if not fields else [field.strip().lower() for field in fields]
+    invalid = [field for field in fields if field not in FIELDS]
+    if invalid:
+        raise ValueError(f"Invalid fields: {', '.join(invalid)}.")
+
+    try:
+        if fmt == 'csv':
+            chunks = pd.read_csv(stream, chunksize=CHUNK_ROWS, dtype=str, keep_default_na=False, encoding='utf-8')
+        else:
+            chunks = pd.read_json(stream, lines=True, chunksize=CHUNK_ROWS, dtype=False, convert_dates=False,
+                                  keep_default_dates=False, encoding='utf-8')
+        first = next(iter(chunks), None)
+    except (ValueError, pd.errors.ParserError) as e:
+        raise ValueError(f"Invalid ledger: {e}")
+    if first is None:
+        raise ValueError('Empty ledger.')
+    missing = [column for column in COLUMNS if column not in first.columns]
+    if missing:
+        raise ValueError(f"Missing ledger columns: {', '.join(missing)}.")
+
+    logger.info(f"Converting a {fmt} ledger against {storage}: fields={','.join(fields)}.")
+    return _convert(open_storage(storage), first, chunks, fmt, fields)
+
+
+def _convert(backend, first: pd.DataFrame, chunks, fmt: str, fields: List[str]) -> Iterator[bytes]:
+    # history loaded so far, widened when a chunk falls outside, so a time-sorted ledger loads each snapshot
+    # about once and an unsorted one converges to a single load of its whole range
+    window = None
+    rows = 0
+    for i, chunk in enumerate(_chain(first, chunks)):
+        with timer('ledger_resolve'):
+            ts = parse_timestamps(chunk['timestamp'])
+            lookups = pd.DataFrame({'currency': chunk['currency'].astype(str).str.strip().str.upper(), 'timestamp': ts})
+            lookups = lookups[lookups['timestamp'].notna()]
+            out = chunk.copy()
+            out['datetime'] = None
+            for field in fields:
+                out[field] = float('nan')
+                out[f'{field}_cny'] = float('nan')
+            if len(lookups) > 0:
+                window = _window(backend, window, lookups['timestamp'].min(), lookups['timestamp'].max())
+            if len(lookups) > 0 and len(window[3]) > 0:
+                resolved = resolve_asof(window[3], lookups)
+                amount = pd.to_numeric(chunk.loc[resolved.index, 'amount'], errors='coerce')
+                out.loc[resolved.index, 'datetime'] = resolved['发布时间'].dt.strftime('%Y-%m-%d %H:%M:%S')
+                for field in fields:
+                    price = resolved[FIELDS[field]].astype(float)
+                    out.loc[resolved.index, field] = price
+                    out.loc[resolved.index, f'{field}_cny'] = (amount * price / 100).round(DECIMALS)
+        rows += len(chunk)
+        if fmt == 'csv':
+            yield out.to_csv(header=i == 0, index=False, na_rep='').encode('utf-8')
+        else:
+            yield out.to_json(orient='records', lines=True, force_ascii=False).encode('utf-8')
+    logger.info(f"Converted {rows} ledger rows.")
+
+
+def _window(backend, window: Optional[tuple], lo, hi) -> tuple:
+    # (lo, hi, first loaded snapshot time, history) covering lookups in [lo, hi]; an overlapping window is
+    # widened by loading only the snapshots it misses
+    if window is not None and window[0] <= lo and hi <= window[1]:
+        return window
+    if window is None or lo > window[1] or hi < window[0]:
+        first = backend.timestamp_at(lo) or lo
+        return lo, hi, first, backend.load(start=first, end=hi)
+    parts = [window[3]]
+    first = window[2]
+    if lo < window[0]:
+        first = backend.timestamp_at(lo) or lo
+        if first < window[2]:
+            parts.insert(0, backend.load(start=first, end=window[2] - EPSILON))
+        first = min(first, window[2])
+    if hi > window[1]:
+        parts.append(backend.load(start=window[1] + EPSILON, end=hi))
+    # empty frames would turn the columns to object
+    parts = [part for part in parts if len(part) > 0] or [window[3]]
+    return min(lo, window[0]), max(hi, window[1]), first, pd.concat(parts, ignore_index=True)
+
+
+def _chain(first: pd.DataFrame, chunks) -> Iterator[pd.DataFrame]:
+    yield first
+    yield from chunks
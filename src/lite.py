@@ -0,0 +1,95 @@
+import os
+import csv
+import sqlite3
+from contextlib import closing
+from typing import Optional
+try:
+    from .manifest import latest_entry
+    from .metrics import timer
+    from .utils import SQLITE_EXT, get_logger
+except ImportError:
+    from manifest import latest_entry
+    from metrics import timer
+    from utils import SQLITE_EXT, get_logger
+
+
+"""
+Read path for the latest stored quote that only uses the standard library (no pandas),
+for one-shot queries such as `python main.py --currency EUR`.
+"""
+
+
+logger = get_logger('Lite', filename='lite.log')
+
+
+def read_latest_quote(storage: str, currency: str) -> Optional[dict]:
+    # returns the latest quote of `currency` in the same format as the API, or None
+    currency = currency.upper()
+    try:
+        with timer('lite_read'):
+            if storage.lower().endswith(SQLITE_EXT):
+                quote = _read_sqlite(storage, currency)
+            else:
+                quote = _read_csv(storage, currency)
+    except (OSError, sqlite3.Error, csv.Error, ValueError) as e:
+        logger.error(f"Failed to read the latest quote of {currency} from {storage}: {e}")
+        return None
+    if quote is None:
+        logger.error(f"No quote of {currency} found in {storage}.")
+    return quote
+
+
+def _read_csv(storage: str, currency: str) -> Optional[dict]:
+    # the newest snapshot is the last entry of the manifest
+    stem = latest_entry(storage)
+    filename = None if stem is None else os.path.join(storage, stem + '.csv')
+    if filename is None or not os.path.exists(filename):
+        # no manifest yet: filenames are '%Y_%m_%d-%H_%M_%S.csv', zero padded, so the newest one is the largest name
+        files = [name for name in os.listdir(storage) if name.endswith('.csv')]
+        if not files:
+            return None
+        filename = os.path.join(storage, max(files))
+    with open(filename, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            if row['代号'] == currency:
+                return _quote(row['代号'], row['币种'], row['现汇买入价'], row['现钞买入价'],
+                              row['现汇卖出价'], row['现钞卖出价'], row['发布时间'])
+    return None
+
+
+def _read_sqlite(storage: str, currency: str) -> Optional[dict]:
+    if not os.path.exists(storage):
+        return None
+    # snapshots are stored as deltas: the latest row of the currency up to the latest snapshot,
+    # a row carried over from an older snapshot takes the time of the latest one (see storage.SQLiteStorage)
+    with closing(sqlite3.connect(storage)) as conn:
+        row = conn.execute(
+            'SELECT q.code, q.name, q.exch_buy, q.cash_buy, q.exch_sell, q.cash_sell, '
+            'CASE WHEN q.ts = s.ts THEN q.published ELSE s.ts END, q.pos '
+            'FROM quotes q, (SELECT MAX(ts) AS ts FROM snapshots) s '
+            'WHERE q.code = ? AND q.ts <= s.ts ORDER BY q.ts DESC LIMIT 1',
+            (currency,)
+        ).fetchone()
+    # pos < 0 is a tombstone, the currency is not quoted anymore
+    if row is None or row[-1] < 0:
+        return None
+    return _quote(*row[:-1])
+
+
+def _quote(code, name, exch_buy, cash_buy, exch_sell, cash_sell, published) -> dict:
+    return {
+        'currency': code,
+        'name': name,
+        'exch_buy': _to_float(exch_buy),
+        'exch_sell': _to_float(exch_sell),
+        'cash_buy': _to_float(cash_buy),
+        'cash_sell': _to_float(cash_sell),
+        'datetime': str(published),
+    }
+
+
+def _to_float(value) -> float:
+    # empty cells and NULL are missing quotes ('--' on the website)
+    if value is None or value == '':
+        return float('nan')
+    return float(value)
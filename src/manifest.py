@@ -0,0 +1,138 @@
+import os
+import bisect
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+"""
+Sorted index of the snapshot files of a CSV storage, kept in '<storage>/.manifest' (one file stem per line, ascending).
+It is maintained on every save/remove, so the latest snapshot, the count and time ranges are answered
+with a bisect instead of listing the directory and parsing every filename.
+Stems are the zero padded '%Y_%m_%d-%H_%M_%S' names, their lexicographic order is chronological.
+Delete the file to have it rebuilt from the directory (e.g. after copying snapshots in by hand).
+Standard library only, the lite read path uses it.
+"""
+
+
+FILENAME = '.manifest'
+# manifest file -> ((mtime_ns, size) when read, entries)
+_cache: Dict[str, Tuple[tuple, List[str]]] = {}
+_lock = threading.Lock()
+
+
+class Manifest:
+    def __init__(self, path: str, ext: str = '.csv'):
+        self.path = path
+        self.ext = ext
+        self.file = os.path.join(path, FILENAME)
+
+    def entries(self) -> List[str]:
+        # cached until the manifest file changes, rebuilt from a directory scan when missing or stale
+        try:
+            st = os.stat(self.file)
+        except OSError:
+            return self.rebuild()
+        cached = _cache.get(self.file)
+        if cached is not None and cached[0] == (st.st_mtime_ns, st.st_size):
+            entries = cached[1]
+        else:
+            with open(self.file, 'r', encoding='utf-8') as f:
+                entries = [line.strip() for line in f if line.strip()]
+            if any(a >= b for a, b in zip(entries, entries[1:])):
+                entries = sorted(set(entries))
+            _cache[self.file] = ((st.st_mtime_ns, st.st_size), entries)
+        if entries and not os.path.exists(self.filename(entries[-1])):
+            # the latest snapshot was removed behind our back
+            return self.rebuild()
+        return entries
+
+    def rebuild(self) -> List[str]:
+        with _lock:
+            entries = sorted(
+                name[:-len(self.ext)] for name in os.listdir(self.path)
+                if name.endswith(self.ext) and os.path.isfile(os.path.join(self.path, name))
+            )
+            try:
+                self._write(entries)
+            except OSError:
+                # read-only storage, the index is rebuilt on every call
+                pass
+        return entries
+
+    def add(self, stem: str):
+        entries = self.entries()
+        with _lock:
+            i = bisect.bisect_left(entries, stem)
+            if i < len(entries) and entries[i] == stem:
+                return
+            if i == len(entries):
+                # the usual case, a newer snapshot: append a line
+                with open(self.file, 'a', encoding='utf-8') as f:
+                    f.write(stem + '\n')
+                entries.append(stem)
+                self._remember(entries)
+            else:
+                entries.insert(i, stem)
+                self._write(entries)
+
+    def add_many(self, stems: Iterable[str]):
+        # one append or rewrite for a whole batch
+        entries = self.entries()
+        with _lock:
+            new = sorted(set(stems).difference(entries))
+            if not new:
+                return
+            if not entries or new[0] > entries[-1]:
+                with open(self.file, 'a', encoding='utf-8') as f:
+                    f.writelines(stem + '\n' for stem in new)
+                entries.extend(new)
+                self._remember(entries)
+            else:
+                self._write(sorted(entries + new))
+
+    def discard(self, stems: Iterable[str]):
+        stems = set(stems)
+        entries = self.entries()
+        with _lock:
+            self._write([stem for stem in entries if stem not in stems])
+
+    def range(self, start: Optional[str] = None, end: Optional[str] = None) -> List[str]:
+        # stems within [start, end]
+        entries = self.entries()
+        lo = 0 if start is None else bisect.bisect_left(entries, start)
+        hi = len(entries) if end is None else bisect.bisect_right(entries, end)
+        return entries[lo:hi]
+
+    def latest(self) -> Optional[str]:
+        entries = self.entries()
+        return entries[-1] if entries else None
+
+    def filename(self, stem: str) -> str:
+        return os.path.join(self.path, stem + self.ext)
+
+    def __len__(self) -> int:
+        return len(self.entries())
+
+    def _write(self, entries: List[str]):
+        # write then rename, readers never see a partial manifest
+        tmp = self.file + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.writelines(stem + '\n' for stem in entries)
+        os.replace(tmp, self.file)
+        self._remember(entries)
+
+    def _remember(self, entries: List[str]):
+        st = os.stat(self.file)
+        _cache[self.file] = ((st.st_mtime_ns, st.st_size), entries)
+
+
+def latest_entry(path: str) -> Optional[str]:
+    # the last stem of the manifest, read from the end of the file (the lite path does not load the whole index)
+    try:
+        with open(os.path.join(path, FILENAME), 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 128))
+            lines = f.read().decode('utf-8', errors='ignore').split()
+    except OSError:
+        return None
+    return lines[-1] if lines else None
@@ -0,0 +1,167 @@
+import time
+import threading
+import functools
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+
+"""
+In-process metrics: counters and histograms, rendered in the Prometheus text format (`render()`, served on
+/metrics by app.py) or as a per-stage timing table (`breakdown()`, printed by `main.py --profile`).
+Hot-path stages are timed with `timer(stage)` / `@timed(stage)` into the `bank_stage_duration_seconds` histogram.
+Standard library only, so the light entry points can import it.
+"""
+
+
+# seconds, from sub-millisecond serialization up to slow upstream fetches
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(_labels(labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for key, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{_format(key)} {value:g}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per bucket counts (+Inf last), sum, count, max]
+        self.values: Dict[Labels, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0, 0.0]
+            entry[0][bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+            entry[3] = max(entry[3], value)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for key, (counts, total, count, _) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(f'{self.name}_bucket{_format(key + (("le", le),))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format(key)} {total:.6f}')
+            lines.append(f'{self.name}_count{_format(key)} {count}')
+        return lines
+
+
+# name -> metric
+REGISTRY: Dict[str, object] = {}
+_registry_lock = threading.Lock()
+
+
+def counter(name: str, help: str) -> Counter:
+    return _register(name, lambda: Counter(name, help))
+
+
+def histogram(name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    return _register(name, lambda: Histogram(name, help, buckets))
+
+
+def _register(name: str, factory: Callable) -> object:
+    with _registry_lock:
+        metric = REGISTRY.get(name)
+        if metric is None:
+            metric = REGISTRY[name] = factory()
+        return metric
+
+
+STAGE_SECONDS = histogram('bank_stage_duration_seconds', 'Duration of the pipeline and serving stages.')
+UPSTREAM_ERRORS = counter('bank_upstream_errors_total', 'Failed upstream fetches by reason.')
+CACHE_REQUESTS = counter('bank_cache_requests_total', 'Cache lookups by cache and result (hit/miss).')
+HTTP_SECONDS = histogram('bank_http_request_duration_seconds', 'Duration of the API requests.')
+HTTP_REQUESTS = counter('bank_http_requests_total', 'API requests by endpoint and status.')
+NOTIFICATIONS = counter('bank_notifications_total',
+                        'Notifications by dispatcher and outcome (enqueued, dropped, delivered, failed).')
+NOTIFY_RETRIES = counter('bank_notification_retries_total', 'Failed notification deliveries that were retried.')
+NOTIFY_SECONDS = histogram('bank_notification_latency_seconds',
+                           'Time from enqueueing to delivery of a batch of notifications.')
+
+
+@contextmanager
+def timer(stage: str, **labels) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage, **labels)
+
+
+def timed(stage: str) -> Callable:
+    # decorator timing every call of the function as `stage`
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render() -> str:
+    lines = []
+    for metric in list(REGISTRY.values()):
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def breakdown() -> str:
+    # per-stage table: calls, total, mean and max milliseconds, slowest total first
+    rows = []
+    for key, (_, total, count, longest) in list(STAGE_SECONDS.values.items()):
+        labels = dict(key)
+        stage = labels.pop('stage', '')
+        if labels:
+            stage += '[' + ','.join(labels.values()) + ']'
+        rows.append((stage, count, total * 1000, total * 1000 / count, longest * 1000))
+    rows.sort(key=lambda row: row[2], reverse=True)
+    lines = [f"{'stage':<32} {'calls':>7} {'total ms':>10} {'mean ms':>9} {'max ms':>9}"]
+    lines.extend(f"{stage:<32} {count:>7} {total:>10.2f} {mean:>9.3f} {longest:>9.3f}"
+                 for stage, count, total, mean, longest in rows)
+    return '\n'.join(lines)
+
+
+def reset():
+    for metric in REGISTRY.values():
+        metric.values.clear()
+
+
+def _labels(labels: dict) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format(key: Labels) -> str:
+    if not key:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in key)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(key, escaped)) + '}'
@@ -0,0 +1,140 @@
+import time
+import queue
+import threading
+from typing import Any, Callable, List, Optional, Tuple
+try:
+    from .metrics import NOTIFICATIONS, NOTIFY_RETRIES, NOTIFY_SECONDS
+    from .utils import get_logger
+except ImportError:
+    from metrics import NOTIFICATIONS, NOTIFY_RETRIES, NOTIFY_SECONDS
+    from utils import get_logger
+
+
+logger = get_logger('Notify', filename='notify.log')
+
+
+class PushDeerSink:
+    # delivers a message with PushDeer, raises on failure so that the dispatcher retries
+    def __init__(self, pushdeer):
+        self.pushdeer = pushdeer
+
+    def __call__(self, text: str):
+        if self.pushdeer.send_text(text) is False:
+            raise RuntimeError('PushDeer refused the message.')
+
+
+class StubSink:
+    # keeps the delivered messages in memory, for local runs and tests
+    def __init__(self, fail: int = 0):
+        self.messages: List[str] = []
+        # number of deliveries that fail before the sink starts accepting messages
+        self.fail = fail
+
+    def __call__(self, text: str):
+        if self.fail > 0:
+            self.fail -= 1
+            raise RuntimeError('Stub delivery failure.')
+        self.messages.append(text)
+        logger.info(f"Stub sink received: {text}")
+
+
+class Dispatcher:
+    """
+    Background notification queue: `send` only enqueues the message and returns immediately, a worker thread
+    delivers them in batches with retry and exponential backoff. When the bounded buffer is full new messages
+    are dropped instead of blocking the caller. Outcomes and latencies are counted per `name` in the metrics.
+    """
+
+    def __init__(self,
+                 sink: Callable[[str], Any],
+                 maxsize: int = 1000,
+                 batch_size: int = 10,
+                 batch_wait: float = 0.5,
+                 retries: int = 3,
+                 backoff: float = 1.0,
+                 name: str = 'notify'):
+        self.name = name
+        self.sink = sink
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.retries = retries
+        self.backoff = backoff
+        # (enqueue time, message)
+        self._queue: 'queue.Queue[Tuple[float, str]]' = queue.Queue(maxsize=maxsize)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+    def send(self, text: str) -> bool:
+        if self._closed.is_set():
+            NOTIFICATIONS.inc(dispatcher=self.name, outcome='dropped')
+            logger.error(f"Dispatcher is closed, dropped message: {text}")
+            return False
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((time.perf_counter(), text))
+        except queue.Full:
+            NOTIFICATIONS.inc(dispatcher=self.name, outcome='dropped')
+            logger.error(f"Notification buffer is full, dropped message: {text}")
+            return False
+        NOTIFICATIONS.inc(dispatcher=self.name, outcome='enqueued')
+        return True
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        # wait until every enqueued message is delivered or given up
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def close(self, timeout: Optional[float] = 10.0):
+        self.flush(timeout)
+        self._closed.set()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='notify-dispatcher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._closed.is_set():
+            try:
+                batch = [self._queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            # collect more messages for the same batch
+            deadline = time.perf_counter() + self.batch_wait
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.perf_counter())))
+                except queue.Empty:
+                    break
+            try:
+                self._deliver(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _deliver(self, batch: List[Tuple[float, str]]):
+        text = '\n\n'.join(message for _, message in batch)
+        for attempt in range(self.retries + 1):
+            try:
+                self.sink(text)
+            except Exception as e:
+                if attempt == self.retries:
+                    NOTIFICATIONS.inc(len(batch), dispatcher=self.name, outcome='failed')
+                    logger.error(f"Failed to deliver {len(batch)} notifications after {attempt + 1} attempts: {e}")
+                    return
+                NOTIFY_RETRIES.inc(dispatcher=self.name)
+                logger.warning(f"Failed to deliver notifications (attempt {attempt + 1}): {e}")
+                time.sleep(self.backoff * 2 ** attempt)
+                continue
+
+            latency = time.perf_counter() - min(enqueued for enqueued, _ in batch)
+            NOTIFICATIONS.inc(len(batch), dispatcher=self.name, outcome='delivered')
+            NOTIFY_SECONDS.observe(latency, dispatcher=self.name)
+            logger.info(f"Delivered {len(batch)} notifications in {latency:.3f}s.")
+            return
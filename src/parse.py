@@ -1,16 +1,118 @@
-from bs4 import BeautifulSoup as bs
+import math
+import time
 import pandas as pd
-from typing import List, Optional
+from bs4 import BeautifulSoup as bs
+from csv import DictReader
+from datetime import datetime
+from lxml import html as lxml_html
+from typing import List, Optional, Union
 try:
+    from .metrics import timed
+    from .snapshot import Snapshot, Quote, parse_price, parse_published
     from .utils import get_logger
 except ImportError:
+    from metrics import timed
+    from snapshot import Snapshot, Quote, parse_price, parse_published
     from utils import get_logger
 
 
 logger = get_logger('parser', filename='parser.log')
 
 
-def parse_html(html: str, debug: bool = False) -> Optional[pd.DataFrame]:
+# header of the quotation table
+HEADER = ('币种', '现汇买入价', '现钞买入价', '现汇卖出价', '现钞卖出价', '发布时间')
+# seconds to go straight to BeautifulSoup once it parsed a page the fast path could not (the markup changed)
+FAST_PATH_RETRY = 3600.0
+# monotonic time until which the fast path is skipped
+_skip_fast_path_until = 0.0
+
+
+@timed('parse_html')
+def parse_html(html: str, debug: bool = False,
+               as_snapshot: bool = False) -> Optional[Union[pd.DataFrame, Snapshot]]:
+    # fast path: extract the quotation table with XPath, fall back to the BeautifulSoup tree walk
+    global _skip_fast_path_until
+    columns = None
+    fast = time.monotonic() >= _skip_fast_path_until
+    if fast:
+        try:
+            columns = extract_columns(html)
+        except Exception as e:
+            logger.warning(f"Fast html parser failed, falling back to BeautifulSoup: {e}")
+    if columns is None or not columns[0]:
+        df = parse_html_bs4(html, debug=debug)
+        if fast and df is not None and len(df):
+            # the fallback handles this markup and the fast path does not, stop paying for both
+            _skip_fast_path_until = time.monotonic() + FAST_PATH_RETRY
+            logger.warning(f"Fast html parser does not handle the page, using BeautifulSoup "
+                           f"for the next {FAST_PATH_RETRY:g}s.")
+        if df is None or not as_snapshot:
+            return df
+        return Snapshot.from_dataframe(df) if len(df) else None
+
+    out = Snapshot.from_columns(*columns) if as_snapshot else _columns_to_dataframe(columns)
+    if debug:
+        logger.info(f"Successfully parsed the html content: \n{out.to_dataframe() if as_snapshot else out}")
+    else:
+        logger.info(f"Successfully parsed the html content.")
+    return out
+
+
+def parse_html_fast(html: str) -> Optional[pd.DataFrame]:
+    columns = extract_columns(html)
+    if columns is None:
+        return None
+    return _columns_to_dataframe(columns)
+
+
+def extract_columns(html: str) -> Optional[tuple]:
+    # typed columns (codes, names, exch_buy, cash_buy, exch_sell, cash_sell, published) of the quotation table
+    tree = lxml_html.fromstring(html)
+    # the header row is the row whose cells are exactly the expected column names
+    header = None
+    for row in tree.xpath('//tr[td[normalize-space()="币种"] and td[normalize-space()="发布时间"]]'):
+        if tuple(td.text_content().strip() for td in row.xpath('./td')) == HEADER:
+            header = row
+            break
+    if header is None:
+        return None
+
+    # build typed columns in a single pass over the rows following the header
+    codes: List[str] = []
+    names: List[str] = []
+    prices: List[List[float]] = [[], [], [], []]
+    published: List[datetime] = []
+    for row in header.itersiblings('tr'):
+        cells = [td.text_content().strip() for td in row.xpath('./td')]
+        if len(cells) != len(HEADER):
+            return None
+        # e.g. '英镑(GBP)' -> '英镑', 'GBP'
+        name, _, code = cells[0].partition('(')
+        names.append(name)
+        codes.append(code.rstrip(')'))
+        for column, value in zip(prices, cells[1:5]):
+            column.append(math.nan if value == '--' else float(value))
+        # e.g. '2023年04月01日 04:14:05'
+        published.append(datetime.strptime(cells[5], '%Y年%m月%d日 %H:%M:%S'))
+    if not codes:
+        return None
+    return codes, names, prices[0], prices[1], prices[2], prices[3], published
+
+
+def _columns_to_dataframe(columns: tuple) -> pd.DataFrame:
+    codes, names, exch_buy, cash_buy, exch_sell, cash_sell, published = columns
+    return pd.DataFrame({
+        '代号': codes,
+        '币种': names,
+        '现汇买入价': exch_buy,
+        '现钞买入价': cash_buy,
+        '现汇卖出价': exch_sell,
+        '现钞卖出价': cash_sell,
+        '发布时间': pd.to_datetime(published),
+    })
+
+
+def parse_html_bs4(html: str, debug: bool = False) -> Optional[pd.DataFrame]:
     # parse html
     soup = bs(html, 'lxml')
 
@@ -56,7 +158,29 @@ def parse_html(html: str, debug: bool = False) -> Optional[pd.DataFrame]:
     return df
 
 
-def parse_csv(csv: Optional[str], debug: bool = False) -> Optional[pd.DataFrame]:
+@timed('parse_csv')
+def parse_csv(csv: Optional[str], debug: bool = False,
+              as_snapshot: bool = False) -> Optional[Union[pd.DataFrame, Snapshot]]:
+    if as_snapshot:
+        # read the rows straight into a Snapshot, no DataFrame involved
+        try:
+            with open(csv, 'r', encoding='utf-8', newline='') as f:
+                quotes = [
+                    Quote(row['代号'], row['币种'], parse_price(row['现汇买入价']), parse_price(row['现钞买入价']),
+                          parse_price(row['现汇卖出价']), parse_price(row['现钞卖出价']), parse_published(row['发布时间']))
+                    for row in DictReader(f)
+                ]
+        except (KeyError, AttributeError, ValueError) as e:
+            # truncated file: missing columns or cells (None)
+            logger.error(f"Failed to parse the csv file {csv}: {e!r}")
+            return None
+        if not quotes:
+            # header only, like SQLiteStorage without rows
+            logger.error(f"No quotes in the csv file {csv}.")
+            return None
+        logger.debug(f"Successfully parsed the csv content.")
+        return Snapshot(quotes)
+
     # parse csv
     df = pd.read_csv(csv, header=0, index_col=None)
     # parse column '发布时间', e.g. '2023年04月01日 04:14:05' -> '2023-04-01 04:14:05', and convert to datetime
@@ -68,17 +192,16 @@ def parse_csv(csv: Optional[str], debug: bool = False) -> Optional[pd.DataFrame]
     if debug:
         logger.info(f"Successfully parsed the csv content: \n{df}")
     else:
-        logger.info(f"Successfully parsed the csv content.")
+        logger.debug(f"Successfully parsed the csv content.")
     return df
 
 
 if __name__ == '__main__':
-    # with open('.temp/test.html', 'r', encoding='utf-8') as f:
-    #     out = parse_html(f.read())
-    #
-    # print(out.dtypes)
-    # print(out['代号'].unique())
-    # print(out['发布时间'].iloc[0].strftime('%Y_%m_%d-%H_%M_%S'))
-
-    out = parse_csv('../assets/2023_04_01-04_14_05.csv')
-    print(out.dtypes)
+    # parity check of the fast parser against the BeautifulSoup parser on saved pages,
+    # e.g. `python parse.py page.html` (tests/test_parse.py runs it on bench/fixtures/)
+    import sys
+    for path in sys.argv[1:]:
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        pd.testing.assert_frame_equal(parse_html_fast(content), parse_html_bs4(content))
+        print(f"{path}: fast parser matches the BeautifulSoup parser.")
@@ -0,0 +1,90 @@
+import os
+import re
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+try:
+    from .utils import get_logger
+except ImportError:
+    from utils import get_logger
+
+
+"""
+Retention policies for the storage, e.g. RETENTION_POLICY="1h:7d,1d:730d":
+keep one snapshot per hour for the last 7 days, one per day up to 2 years, and delete everything older.
+Every tier is RESOLUTION:AGE, RESOLUTION is a duration or `all` (keep every snapshot), ages count back from
+the latest snapshot. Within a tier the last snapshot of each RESOLUTION bucket is kept.
+Durations are a number followed by s (seconds), m (minutes), h (hours), d (days) or w (weeks).
+Ages are whole units and count like the original 60-day rule: a snapshot is past `60d` once it is 61 days old.
+"""
+
+
+logger = get_logger('Retention', filename='retention.log')
+
+# the previous hardcoded behaviour: keep everything for 60 days
+DEFAULT_POLICY = os.getenv('RETENTION_POLICY', 'all:60d')
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+EPOCH = datetime(1970, 1, 1)
+
+Tier = Tuple[Optional[timedelta], timedelta]
+
+
+def parse_duration(value: str) -> timedelta:
+    number, unit = _split(value)
+    return timedelta(seconds=number * unit)
+
+
+def parse_age(value: str) -> timedelta:
+    # the first expired age: snapshots are past AGE once their age in whole units exceeds it,
+    # e.g. '60d' -> 61 days, the boundary of the original `(latest - ts).days > 60`
+    number, unit = _split(value)
+    if not number.is_integer():
+        raise ValueError(f"Invalid age: {value}, ages are a whole number of units")
+    return timedelta(seconds=(int(number) + 1) * unit)
+
+
+def parse_policy(policy: str) -> List[Tier]:
+    # [(resolution or None for all, first expired age)], sorted by age
+    tiers = []
+    for part in policy.split(','):
+        if ':' not in part:
+            raise ValueError(f"Invalid retention tier: {part!r}, expected RESOLUTION:AGE")
+        resolution, age = part.split(':', 1)
+        tiers.append((None if resolution.strip().lower() == 'all' else parse_duration(resolution), parse_age(age)))
+    return sorted(tiers, key=lambda tier: tier[1])
+
+
+def select_expired(storage, tiers: List[Tier]) -> List[datetime]:
+    # snapshots to delete under the policy; only the range of each tier is read from the storage index,
+    # ranges that were downsampled by a previous run hold one snapshot per bucket and are cheap to check again
+    latest = storage.latest_timestamp()
+    if latest is None or not tiers:
+        return []
+
+    expired = []
+    newer = None
+    for resolution, age in tiers:
+        # tiers cover (latest - age, newer], the first one up to the latest snapshot
+        oldest = latest - age
+        window = [ts for ts in storage.timestamps(start=oldest, end=newer) if ts > oldest]
+        newer = oldest
+        if resolution is None:
+            continue
+        # keep the last snapshot of every bucket
+        kept = {}
+        for ts in window:
+            kept[(ts - EPOCH) // resolution] = ts
+        kept = set(kept.values())
+        expired.extend(ts for ts in window if ts not in kept)
+
+    # older than the last tier
+    expired.extend(storage.timestamps(end=newer))
+    logger.info(f"{len(expired)} snapshots expired under the retention policy.")
+    return sorted(expired)
+
+
+def _split(value: str) -> Tuple[float, int]:
+    # '7d' -> (7.0, seconds per day)
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([smhdw])', value.strip().lower())
+    if match is None:
+        raise ValueError(f"Invalid duration: {value}")
+    return float(match.group(1)), UNITS[match.group(2)]
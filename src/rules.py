@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional
+try:
+    from .utils import get_logger, FIELDS
+except ImportError:
+    from utils import get_logger, FIELDS
+
+
+logger = get_logger('Rules', filename='rules.log')
+
+OPS = {
+    '<': np.less,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '==': np.equal,
+    '!=': np.not_equal,
+}
+
+
+"""
+Watch rules are loaded from a JSON file (a list of objects) or a CSV file with the columns:
+- currency: currency code, e.g. EUR
+- column: price to watch, one of exch_buy/cash_buy/exch_sell/cash_sell or the table column name, e.g. 现汇卖出价
+- op: one of <, <=, >, >=, ==, !=
+- threshold: float
+- cooldown (optional): minimum seconds between two notifications of the same rule, default 3600
+Rules with the same (currency, column, op, threshold) are de-duplicated.
+"""
+
+
+class RuleEngine:
+    def __init__(self, rules: pd.DataFrame, state_file: Optional[str] = None):
+        rules = rules.copy()
+        rules['currency'] = rules['currency'].astype(str).str.upper()
+        rules['column'] = rules['column'].astype(str).replace(FIELDS)
+        rules['op'] = rules['op'].astype(str).str.strip()
+        rules['threshold'] = rules['threshold'].astype(float)
+        if 'cooldown' not in rules:
+            rules['cooldown'] = 3600.0
+        rules['cooldown'] = rules['cooldown'].fillna(3600.0).astype(float)
+
+        invalid = ~rules['op'].isin(list(OPS)) | ~rules['column'].isin(list(FIELDS.values()))
+        if invalid.any():
+            logger.error(f"Ignored {int(invalid.sum())} invalid rules:\n{rules[invalid]}")
+        rules = rules[~invalid].drop_duplicates(subset=['currency', 'column', 'op', 'threshold'])
+
+        rules['key'] = (rules['currency'] + '|' + rules['column'] + '|' + rules['op'] + '|'
+                        + rules['threshold'].astype(str))
+        self.rules = rules.reset_index(drop=True)
+        self.state_file = state_file
+        # rule key -> unix time of the last notification
+        self.last_fired: Dict[str, float] = self._load_state()
+
+    @classmethod
+    def from_file(cls, path: str, state_file: Optional[str] = None) -> 'RuleEngine':
+        if path.lower().endswith('.json'):
+            with open(path, 'r', encoding='utf-8') as f:
+                rules = pd.DataFrame(json.load(f))
+        else:
+            rules = pd.read_csv(path)
+        logger.info(f"Loaded {len(rules)} rules from {path}.")
+        return cls(rules, state_file=state_file)
+
+    def evaluate(self, df: pd.DataFrame, now: Optional[float] = None) -> pd.DataFrame:
+        # returns the rules that fired and are not cooling down, with the current price
+        now = time.time() if now is None else now
+        rules = self.rules
+        if rules.empty:
+            return rules.assign(price=pd.Series(dtype=float))
+
+        # gather the watched price of every rule from the snapshot at once
+        table = df.drop_duplicates(subset='代号').set_index('代号')[list(FIELDS.values())]
+        rows = table.index.get_indexer(rules['currency'])
+        cols = table.columns.get_indexer(rules['column'])
+        prices = np.full(len(rules), np.nan)
+        found = rows >= 0
+        prices[found] = table.to_numpy(dtype=float)[rows[found], cols[found]]
+
+        thresholds = rules['threshold'].to_numpy()
+        ops = rules['op'].to_numpy()
+        fired = np.zeros(len(rules), dtype=bool)
+        for op, fn in OPS.items():
+            mask = ops == op
+            if mask.any():
+                fired[mask] = fn(prices[mask], thresholds[mask])
+        # rules on a missing currency or a '--' quote never fire
+        fired &= ~np.isnan(prices)
+
+        # cooldown
+        last = rules['key'].map(self.last_fired).fillna(-np.inf).to_numpy()
+        fired &= (now - last) >= rules['cooldown'].to_numpy()
+
+        result = rules[fired].assign(price=prices[fired])
+        for key in result['key']:
+            self.last_fired[key] = now
+        if len(result) > 0:
+            self._save_state()
+        return result
+
+    def _load_state(self) -> Dict[str, float]:
+        if self.state_file is None or not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load the rule state from {self.state_file}: {e}")
+            return {}
+
+    def _save_state(self):
+        # persist the cooldowns so that separate pipeline runs (cron) respect them
+        if self.state_file is None:
+            return
+        try:
+            with open(self.state_file, 'w', encoding='utf-8') as f:
+                json.dump(self.last_fired, f)
+        except OSError as e:
+            logger.error(f"Failed to save the rule state to {self.state_file}: {e}")
+
+
+def format_notification(fired: pd.DataFrame) -> str:
+    lines = [
+        f"{currency} {column} is now at {price} ({op} {threshold})."
+        for currency, column, op, threshold, price in
+        fired[['currency', 'column', 'op', 'threshold', 'price']].itertuples(index=False, name=None)
+    ]
+    return 'Currency Watcher\n' + '\n'.join(lines)
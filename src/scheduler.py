@@ -0,0 +1,98 @@
+import time
+import random
+import threading
+from typing import Any, Callable, Optional
+try:
+    from .utils import get_logger
+except ImportError:
+    from utils import get_logger
+
+
+logger = get_logger('Scheduler', filename='scheduler.log')
+
+
+class Scheduler:
+    """
+    Runs `job` periodically in a warm process.
+
+    Runs are aligned to multiples of `interval` shifted by `offset` seconds (interval=3600, offset=300 runs at
+    minute 5 of every hour, like the crontab entry), delayed by a random jitter of up to `jitter` seconds.
+    A run never overlaps a previous one that is still in progress, and runs missed while the process was
+    suspended or busy are caught up with a single run instead of being replayed one by one.
+    """
+
+    def __init__(self,
+                 job: Callable[[], Any],
+                 interval: float = 3600.0,
+                 offset: float = 0.0,
+                 jitter: float = 0.0,
+                 run_on_start: bool = True,
+                 name: str = 'pipeline'):
+        if interval <= 0:
+            raise ValueError(f"Interval must be positive: {interval}")
+        self.job = job
+        self.interval = interval
+        self.offset = offset % interval
+        self.jitter = jitter
+        self.run_on_start = run_on_start
+        self.name = name
+        self.runs = 0
+        self.last_run: Optional[float] = None
+        self._running = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def next_run(self, now: Optional[float] = None) -> float:
+        # next aligned slot strictly after `now`
+        now = time.time() if now is None else now
+        slot = (now - self.offset) // self.interval * self.interval + self.offset
+        return slot + self.interval
+
+    def run_once(self) -> bool:
+        # skip the run if the previous one is still in progress
+        if not self._running.acquire(blocking=False):
+            logger.warning(f"Job <{self.name}> is still running, skipping this run.")
+            return False
+        try:
+            start = time.perf_counter()
+            self.job()
+            logger.info(f"Job <{self.name}> finished in {time.perf_counter() - start:.3f}s.")
+            return True
+        except Exception as e:
+            logger.critical(f"Uncaught error occurred in job <{self.name}>: {e}")
+            return False
+        finally:
+            self.runs += 1
+            self.last_run = time.time()
+            self._running.release()
+
+    def run_forever(self):
+        logger.info(f"Scheduler started: job <{self.name}> every {self.interval}s "
+                    f"(offset {self.offset}s, jitter {self.jitter}s).")
+        if self.run_on_start:
+            self.run_once()
+        due = self.next_run()
+        while not self._stop.is_set():
+            run_at = due + random.uniform(0, self.jitter)
+            if self._stop.wait(max(0.0, run_at - time.time())):
+                break
+            now = time.time()
+            missed = int((now - due) // self.interval)
+            if missed > 0:
+                logger.warning(f"Missed {missed} run(s) of job <{self.name}>, catching up with a single run.")
+            self.run_once()
+            due = self.next_run()
+        logger.info('Scheduler stopped.')
+
+    def start(self) -> threading.Thread:
+        # run the scheduler in a background daemon thread
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name=f'scheduler-{self.name}', daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
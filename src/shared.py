@@ -0,0 +1,194 @@
+import os
+import json
+import mmap
+import time
+import zlib
+import struct
+import threading
+from datetime import datetime
+from typing import Optional, Tuple
+try:
+    import fcntl
+except ImportError:
+    # no writer lock (Windows), run a single producer
+    fcntl = None
+try:
+    from .metrics import counter
+    from .snapshot import Quote, Snapshot
+    from .utils import get_logger, CURRENCY
+except ImportError:
+    from metrics import counter
+    from snapshot import Quote, Snapshot
+    from utils import get_logger, CURRENCY
+
+
+"""
+Latest snapshot shared between processes through a memory-mapped file (SHARED_SNAPSHOT_PATH, e.g. on /dev/shm).
+One producer, the process running the pipeline (`main.py --pipeline [--daemon]`, or `app.py` with the scheduler),
+writes the snapshot and its pre-encoded responses after each run; any number of API worker processes serve them
+without listing the storage, parsing CSV files or scraping the bank themselves.
+The file is guarded by a sequence counter (seqlock): the producer makes it odd while writing and even when done.
+Readers check it on every request without locking (an 8-byte read of the mapping), copy the data out only when it
+changed, and retry when it moved during the copy or the checksum does not match.
+Layout: a 64-byte header (magic, sequence, data length, index length, crc32 of the data), then the data:
+a JSON index (storage, quotes, payload sizes) followed by the concatenated payloads.
+"""
+
+
+logger = get_logger('Shared', filename='shared.log')
+
+MAGIC = b'BANKSNP1'
+HEADER = struct.Struct('<8sQQQI')
+SEQUENCE = struct.Struct('<Q')
+SEQUENCE_OFFSET = 8
+DATA_OFFSET = 64
+# the file grows by steps of this size, readers remap when it did
+PAGE = 64 * 1024
+# attempts to read a consistent copy before giving up (the producer writes in microseconds)
+RETRIES = 1000
+# seconds between two attempts to map a file that does not exist yet
+REOPEN_INTERVAL = 5.0
+
+SHARED_LOADS = counter('bank_shared_snapshot_loads_total', 'Shared snapshots read by the process, by result.')
+
+
+class SharedSnapshot:
+    def __init__(self, path: Optional[str]):
+        # disabled without a path
+        self.path = path
+        self._mm: Optional[mmap.mmap] = None
+        self._reopen_at = 0.0
+        # (sequence, storage, snapshot) last read by this process
+        self._cached: Optional[Tuple[int, Optional[str], Optional[Snapshot]]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def version(self) -> Optional[int]:
+        # sequence counter of the file, None when there is nothing to read
+        mm = self._map()
+        if mm is None:
+            return None
+        return SEQUENCE.unpack_from(mm, SEQUENCE_OFFSET)[0]
+
+    def get(self, storage: str) -> Optional[Snapshot]:
+        # the latest snapshot published from `storage`, None when there is none
+        mm = self._map()
+        if mm is None:
+            return None
+        cached = self._cached
+        if cached is None or cached[0] != SEQUENCE.unpack_from(mm, SEQUENCE_OFFSET)[0]:
+            cached = self._load()
+        if cached is None or cached[1] != os.path.abspath(storage):
+            return None
+        return cached[2]
+
+    def publish(self, snapshot: Snapshot, storage: str) -> bool:
+        # called by the producer; False when the shared snapshot is the same or newer
+        storage = os.path.abspath(storage)
+        index, data = _encode(snapshot, storage)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                # one writer at a time (e.g. the daemon and a manual run), readers never take it
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            size = DATA_OFFSET + len(data)
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, -(-size // PAGE) * PAGE)
+            with mmap.mmap(fd, 0) as mm:
+                magic, sequence, length, index_length, _ = HEADER.unpack_from(mm, 0)
+                if magic == MAGIC and sequence % 2 == 0:
+                    if mm[DATA_OFFSET:DATA_OFFSET + length] == data:
+                        return False
+                    current = json.loads(mm[DATA_OFFSET:DATA_OFFSET + index_length])
+                    if current['storage'] == storage and current['published'] > snapshot.published.isoformat(' '):
+                        logger.warning(f"Not sharing the snapshot of {snapshot.published}, "
+                                       f"the one of {current['published']} is newer.")
+                        return False
+                # odd while writing, a sequence left odd by a crashed writer stays odd
+                writing = sequence + 1 if sequence % 2 == 0 else sequence + 2
+                SEQUENCE.pack_into(mm, SEQUENCE_OFFSET, writing)
+                mm[DATA_OFFSET:size] = data
+                HEADER.pack_into(mm, 0, MAGIC, writing, len(data), len(index), zlib.crc32(data))
+                SEQUENCE.pack_into(mm, SEQUENCE_OFFSET, writing + 1)
+        finally:
+            # also releases the lock
+            os.close(fd)
+        logger.info(f"Shared the snapshot of {snapshot.published} from {storage} ({len(data)} bytes).")
+        return True
+
+    def _map(self) -> Optional[mmap.mmap]:
+        if self._mm is not None or not self.path or time.monotonic() < self._reopen_at:
+            return self._mm
+        try:
+            with open(self.path, 'rb') as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # missing or still empty, the producer has not published yet
+            self._reopen_at = time.monotonic() + REOPEN_INTERVAL
+        return self._mm
+
+    def _load(self) -> Optional[Tuple[int, Optional[str], Optional[Snapshot]]]:
+        # a consistent copy of the data, decoded once per sequence and process
+        with self._lock:
+            for _ in range(RETRIES):
+                mm = self._map()
+                if mm is None:
+                    return None
+                magic, sequence, length, index_length, crc = HEADER.unpack_from(mm, 0)
+                if self._cached is not None and self._cached[0] == sequence:
+                    return self._cached
+                if sequence % 2 == 1:
+                    # being written
+                    time.sleep(0)
+                    continue
+                if magic != MAGIC:
+                    self._cached = (sequence, None, None)
+                    return self._cached
+                if DATA_OFFSET + length > len(mm):
+                    # the file grew, the old mapping is left to the readers still using it
+                    self._mm = None
+                    self._reopen_at = 0.0
+                    continue
+                data = mm[DATA_OFFSET:DATA_OFFSET + length]
+                if SEQUENCE.unpack_from(mm, SEQUENCE_OFFSET)[0] != sequence or zlib.crc32(data) != crc:
+                    SHARED_LOADS.inc(result='retry')
+                    continue
+                self._cached = (sequence,) + _decode(data, index_length)
+                SHARED_LOADS.inc(result='loaded')
+                return self._cached
+        SHARED_LOADS.inc(result='failed')
+        logger.error(f"Failed to read a consistent snapshot from {self.path}.")
+        return None
+
+
+# the process-wide instance, disabled without SHARED_SNAPSHOT_PATH
+shared_snapshot = SharedSnapshot(os.getenv('SHARED_SNAPSHOT_PATH'))
+
+
+def _encode(snapshot: Snapshot, storage: str) -> Tuple[bytes, bytes]:
+    # (index, index + payloads); the responses of 'ALL' and every currency code, as served
+    keys = ['ALL'] + list(CURRENCY)
+    payloads = [snapshot.payload(key) for key in keys]
+    index = json.dumps({
+        'storage': storage,
+        'published': snapshot.published.isoformat(' '),
+        'quotes': [[quote.currency, quote.name, quote.exch_buy, quote.cash_buy, quote.exch_sell, quote.cash_sell,
+                    quote.published.isoformat(' ')] for quote in snapshot.quotes],
+        'payloads': [[key, len(payload)] for key, payload in zip(keys, payloads)],
+    }, ensure_ascii=False).encode('utf-8')
+    return index, b''.join([index] + payloads)
+
+
+def _decode(data: bytes, index_length: int) -> Tuple[str, Snapshot]:
+    index = json.loads(data[:index_length])
+    quotes = [Quote(code, name, exch_buy, cash_buy, exch_sell, cash_sell, datetime.fromisoformat(published))
+              for code, name, exch_buy, cash_buy, exch_sell, cash_sell, published in index['quotes']]
+    payloads = {}
+    offset = index_length
+    for key, length in index['payloads']:
+        payloads[key] = data[offset:offset + length]
+        offset += length
+    return index['storage'], Snapshot(quotes, payloads=payloads)
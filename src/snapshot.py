@@ -0,0 +1,210 @@
+import json
+import math
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+try:
+    from .metrics import timer
+    from .utils import COLUMNS, CURRENCY, CURRENCY_INDEX, FIELDS
+except ImportError:
+    from metrics import timer
+    from utils import COLUMNS, CURRENCY, CURRENCY_INDEX, FIELDS
+
+
+# ICBC publishes '发布时间' in China Standard Time
+CST = timezone(timedelta(hours=8), 'CST')
+# record keys kept by every field projection
+KEYS = ('currency', 'name', 'datetime')
+# max number of memoized multi-currency / projected payloads per snapshot
+MAX_SELECTIONS = 256
+
+
+def encode_response(response: dict) -> bytes:
+    # same encoding as Flask's default JSON provider, so cached payloads match `jsonify` byte for byte
+    with timer('serialize'):
+        return (json.dumps(response, ensure_ascii=True, sort_keys=True, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+ERROR_RESPONSE = {
+    'status': 'error',
+    'message': 'Failed to get the exchange rate.'
+}
+ERROR_PAYLOAD = encode_response(ERROR_RESPONSE)
+
+
+class Quote:
+    # one row of the quotation table, prices are CNY per 100 units and NaN when not quoted ('--')
+    __slots__ = ('currency', 'name', 'exch_buy', 'cash_buy', 'exch_sell', 'cash_sell', 'published')
+
+    def __init__(self, currency: str, name: str, exch_buy: float, cash_buy: float,
+                 exch_sell: float, cash_sell: float, published: datetime):
+        self.currency = currency
+        self.name = name
+        self.exch_buy = exch_buy
+        self.cash_buy = cash_buy
+        self.exch_sell = exch_sell
+        self.cash_sell = cash_sell
+        self.published = published
+
+    def to_dict(self) -> dict:
+        # API record
+        return {
+            'currency': self.currency,
+            'name': self.name,
+            'exch_buy': self.exch_buy,
+            'exch_sell': self.exch_sell,
+            'cash_buy': self.cash_buy,
+            'cash_sell': self.cash_sell,
+            'datetime': self.published.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+
+    def __repr__(self) -> str:
+        return (f"Quote({self.currency}, {self.name}, exch_buy={self.exch_buy}, cash_buy={self.cash_buy}, "
+                f"exch_sell={self.exch_sell}, cash_sell={self.cash_sell}, published={self.published})")
+
+
+class Snapshot:
+    """
+    One parsed exchange rate table as compact `Quote` records with O(1) lookup by currency code,
+    together with its API responses, each encoded on first request and then reused.
+    Use `to_dataframe()` for the analytics paths (triggers, storage, history).
+    """
+
+    def __init__(self, quotes: Iterable[Quote], payloads: Optional[Dict[str, bytes]] = None):
+        # payloads: responses already encoded elsewhere (e.g. read from the shared snapshot), not encoded again
+        self.quotes: Tuple[Quote, ...] = tuple(quotes)
+        # slot i holds the position of the quote of CURRENCY[i] in `quotes`, -1 if not quoted
+        self._index: List[int] = [-1] * len(CURRENCY)
+        for pos, quote in enumerate(self.quotes):
+            i = CURRENCY_INDEX.get(quote.currency)
+            if i is not None and self._index[i] < 0:
+                self._index[i] = pos
+        if not self.quotes:
+            raise ValueError('A snapshot needs at least one quote.')
+        self._df = None
+        self._cross = None
+        self._records: Optional[List[dict]] = None
+
+        # validators for conditional requests
+        self.published: datetime = max(quote.published for quote in self.quotes)
+        self.etag = self.published.strftime('%Y%m%d%H%M%S')
+        self.last_modified = self.published.replace(tzinfo=CST).astimezone(timezone.utc)
+
+        # encoded responses by query, filled by `payload()`: snapshots built by the pipeline or the stream
+        # are never served and skip the encoding
+        self.payloads: Dict[str, bytes] = {} if payloads is None else dict(payloads)
+
+    @classmethod
+    def from_columns(cls, codes: List[str], names: List[str], exch_buy: List[float], cash_buy: List[float],
+                     exch_sell: List[float], cash_sell: List[float], published: List[datetime]) -> 'Snapshot':
+        return cls(Quote(*row) for row in zip(codes, names, exch_buy, cash_buy, exch_sell, cash_sell, published))
+
+    @classmethod
+    def from_dataframe(cls, df) -> 'Snapshot':
+        rows = df[COLUMNS].itertuples(index=False, name=None)
+        snapshot = cls(
+            Quote(code, name, float(exch_buy), float(cash_buy), float(exch_sell), float(cash_sell),
+                  published.to_pydatetime())
+            for code, name, exch_buy, cash_buy, exch_sell, cash_sell, published in rows
+        )
+        snapshot._df = df
+        return snapshot
+
+    @property
+    def records(self) -> List[dict]:
+        # API records, in table order
+        if self._records is None:
+            self._records = [quote.to_dict() for quote in self.quotes]
+        return self._records
+
+    def get(self, currency: str) -> Optional[Quote]:
+        i = CURRENCY_INDEX.get(currency.upper())
+        if i is None or self._index[i] < 0:
+            return None
+        return self.quotes[self._index[i]]
+
+    def to_dataframe(self):
+        if self._df is None:
+            import pandas as pd
+            self._df = pd.DataFrame({
+                '代号': [quote.currency for quote in self.quotes],
+                '币种': [quote.name for quote in self.quotes],
+                '现汇买入价': [quote.exch_buy for quote in self.quotes],
+                '现钞买入价': [quote.cash_buy for quote in self.quotes],
+                '现汇卖出价': [quote.exch_sell for quote in self.quotes],
+                '现钞卖出价': [quote.cash_sell for quote in self.quotes],
+                '发布时间': pd.to_datetime([quote.published for quote in self.quotes]),
+            })
+        return self._df
+
+    @property
+    def df(self):
+        return self.to_dataframe()
+
+    def cross_rates(self):
+        # currency-to-currency matrices (NumPy), built on first use and kept with the snapshot
+        if self._cross is None:
+            try:
+                from .crossrate import CrossRates
+            except ImportError:
+                from crossrate import CrossRates
+            self._cross = CrossRates(self)
+        return self._cross
+
+    def response(self, currency: str, fields: Optional[str] = None) -> Optional[dict]:
+        # currency: a code, 'all' or a comma separated list, e.g. 'EUR,USD,JPY'
+        # fields: optional comma separated projection over exch_buy/exch_sell/cash_buy/cash_sell
+        records = []
+        for code in currency.upper().split(','):
+            code = code.strip()
+            if code == 'ALL':
+                records.extend(self.records)
+                continue
+            i = CURRENCY_INDEX.get(code)
+            if i is None:
+                return None
+            if self._index[i] >= 0:
+                records.append(self.records[self._index[i]])
+
+        if fields:
+            names = [name.strip().lower() for name in fields.split(',')]
+            if any(name not in FIELDS for name in names):
+                return None
+            records = [{key: record[key] for key in KEYS + tuple(names)} for record in records]
+        return self._response(records)
+
+    def payload(self, currency: str, fields: Optional[str] = None) -> Optional[bytes]:
+        key = currency.upper() if not fields else f'{currency.upper()}|{fields.lower()}'
+        payload = self.payloads.get(key)
+        if payload is None:
+            # encoded once and memoized, every single code and 'ALL' plus up to MAX_SELECTIONS other queries
+            response = self.response(currency, fields)
+            if response is None:
+                return None
+            payload = encode_response(response)
+            if len(self.payloads) <= len(CURRENCY) + MAX_SELECTIONS:
+                self.payloads[key] = payload
+        return payload
+
+    def __len__(self) -> int:
+        return len(self.quotes)
+
+    @staticmethod
+    def _response(records: List[dict]) -> dict:
+        return {
+            'status': 'success',
+            'data': records
+        }
+
+
+def parse_price(value: str) -> float:
+    # '--' and empty cells are missing quotes
+    value = value.strip()
+    if value in ('--', '', 'NaN', 'nan'):
+        return math.nan
+    return float(value)
+
+
+def parse_published(value: str) -> datetime:
+    # e.g. '2023年04月01日 04:14:05' or '2023-04-01 04:14:05'
+    value = value.strip().replace('年', '-').replace('月', '-').replace('日', '')
+    return datetime.fromisoformat(value)
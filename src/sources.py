@@ -0,0 +1,102 @@
+import time
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, NamedTuple, Optional, Tuple
+try:
+    from .fetch import fetcher
+    from .parse import parse_html
+    from .utils import COLUMNS, get_logger
+except ImportError:
+    from fetch import fetcher
+    from parse import parse_html
+    from utils import COLUMNS, get_logger
+
+
+logger = get_logger('Sources', filename='sources.log')
+
+
+class Source(NamedTuple):
+    name: str
+    url: str
+    # html -> DataFrame, None if parsing failed
+    parser: Callable[[str], Optional[pd.DataFrame]]
+    # column of the parser output -> column of the common schema
+    columns: Dict[str, str]
+
+
+SOURCES: Dict[str, Source] = {}
+
+
+"""
+Requirements for a source parser:
+1. It must accept the html content as the first and required positional argument.
+2. It must return a pandas.DataFrame with one row per currency, or None if parsing failed.
+3. The output columns must map onto COLUMNS through the `columns` mapping of the registered source;
+   prices are CNY per 100 units of the foreign currency and '发布时间' is a datetime.
+"""
+
+
+def register_source(name: str, url: str, parser: Callable[[str], Optional[pd.DataFrame]],
+                    columns: Optional[Dict[str, str]] = None) -> Source:
+    source = Source(name=name, url=url, parser=parser, columns=columns or {col: col for col in COLUMNS})
+    SOURCES[name] = source
+    return source
+
+
+register_source(
+    name='icbc',
+    url='https://www.icbc.com.cn/ICBCDynamicSite/Optimize/Quotation/QuotationListIframe.aspx',
+    parser=parse_html,
+)
+
+
+def fetch_source(source: Source) -> Tuple[Optional[pd.DataFrame], Dict[str, float]]:
+    # download and parse one source, returns the normalized table and its latency breakdown in seconds;
+    # any failure only drops this source, never the others fetched alongside it
+    start = time.perf_counter()
+    fetched = parsed = None
+    try:
+        html = fetcher.fetch(source.url, conditional=False).text
+        fetched = time.perf_counter()
+        df = source.parser(html) if html is not None else None
+        parsed = time.perf_counter()
+        if df is not None:
+            df = df.rename(columns=source.columns)[COLUMNS]
+            df.insert(0, 'bank', source.name)
+    except Exception as e:
+        logger.error(f"Source <{source.name}> raised {type(e).__name__}: {e}")
+        df = None
+    end = time.perf_counter()
+    fetched = fetched or end
+    parsed = parsed or end
+    latency = {'fetch': fetched - start, 'parse': parsed - fetched, 'total': end - start}
+
+    if df is None:
+        logger.error(f"Failed to get the exchange rate from source <{source.name}>.")
+    return df, latency
+
+
+def fetch_sources(names: Optional[Iterable[str]] = None,
+                  max_workers: Optional[int] = None) -> Tuple[Optional[pd.DataFrame], Dict[str, Dict[str, float]]]:
+    # download and parse all (or the given) sources concurrently
+    if names is None:
+        sources = list(SOURCES.values())
+    else:
+        unknown = [name for name in names if name not in SOURCES]
+        if unknown:
+            raise KeyError(f"Unknown sources: {', '.join(unknown)}. Available: {', '.join(SOURCES)}")
+        sources = [SOURCES[name] for name in names]
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(sources) or 1) as executor:
+        results = list(executor.map(fetch_source, sources))
+
+    frames = []
+    latencies = {}
+    for source, (df, latency) in zip(sources, results):
+        latencies[source.name] = latency
+        logger.info(f"Source <{source.name}>: fetch {latency['fetch']:.3f}s, parse {latency['parse']:.3f}s.")
+        if df is not None:
+            frames.append(df)
+    if not frames:
+        return None, latencies
+    return pd.concat(frames, ignore_index=True), latencies
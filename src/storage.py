@@ -0,0 +1,550 @@
+import os
+import csv
+import json
+import sqlite3
+import pandas as pd
+from abc import ABC, abstractmethod
+from contextlib import closing
+from datetime import datetime, timedelta
+from typing import Collection, Dict, Iterable, Iterator, List, Optional
+try:
+    from .manifest import Manifest
+    from .parse import parse_csv
+    from .snapshot import Snapshot, Quote, parse_price
+    from .utils import COLUMNS, SQLITE_EXT, get_logger, get_storage_version, str_to_datetime
+except ImportError:
+    from manifest import Manifest
+    from parse import parse_csv
+    from snapshot import Snapshot, Quote, parse_price
+    from utils import COLUMNS, SQLITE_EXT, get_logger, get_storage_version, str_to_datetime
+
+
+logger = get_logger('Storage', filename='storage.log')
+
+
+"""
+Storage backends for the parsed exchange rate tables.
+Every snapshot is identified by the '发布时间' of its first row, the same value used to name the CSV files.
+A backend must implement:
+1. `exists()`: whether the storage location is usable.
+2. `save(df)`: store one snapshot, replacing a snapshot with the same timestamp.
+3. `latest()`: the newest snapshot as a DataFrame, or None if the storage is empty.
+4. `load(start, end)`: all rows of the snapshots taken within [start, end], sorted by time.
+5. `timestamps(start, end)`: the snapshot timestamps within [start, end], sorted ascending.
+6. `remove(timestamps)`: delete the given snapshots.
+7. `version()`: a cheap token that changes whenever a snapshot is added or removed.
+8. `get_meta(key)` / `set_meta(key, value)`: small persistent strings kept with the snapshots,
+   e.g. the content hash of the last fetched page, so that separate runs can detect unchanged content.
+A backend may override, for speed, the defaults built on the methods above:
+- `latest_timestamp()` and `count()` scan the timestamps, both backends answer them from their index.
+- `save_many(frames)` stores several snapshots at once (bulk ingestion), `save` in a loop by default.
+- `iter_rows(start, end, currencies)` streams the rows of [start, end] without building a DataFrame (exports).
+"""
+
+
+class Storage(ABC):
+    def __init__(self, path: str):
+        self.path = path
+
+    @abstractmethod
+    def exists(self) -> bool:
+        ...
+
+    @abstractmethod
+    def save(self, df: pd.DataFrame) -> str:
+        ...
+
+    def save_many(self, frames: Iterable[pd.DataFrame]) -> int:
+        count = 0
+        for df in frames:
+            self.save(df)
+            count += 1
+        return count
+
+    @abstractmethod
+    def latest(self) -> Optional[pd.DataFrame]:
+        ...
+
+    def latest_snapshot(self) -> Optional[Snapshot]:
+        # the newest snapshot for serving, backends override it to skip the DataFrame
+        df = self.latest()
+        return None if df is None or df.empty else Snapshot.from_dataframe(df)
+
+    @abstractmethod
+    def load(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> pd.DataFrame:
+        ...
+
+    @abstractmethod
+    def timestamps(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[datetime]:
+        ...
+
+    @abstractmethod
+    def remove(self, timestamps: Iterable[datetime]) -> int:
+        ...
+
+    def timestamp_at(self, ts: datetime) -> Optional[datetime]:
+        # the last snapshot taken at or before `ts`, i.e. the one valid at that time
+        timestamps = self.timestamps(end=ts)
+        return timestamps[-1] if timestamps else None
+
+    def latest_timestamp(self) -> Optional[datetime]:
+        timestamps = self.timestamps()
+        return timestamps[-1] if timestamps else None
+
+    def iter_rows(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                  currencies: Optional[Collection[str]] = None) -> Iterator[tuple]:
+        # (code, name, exch_buy, cash_buy, exch_sell, cash_sell, published) per stored row, by time,
+        # prices are NaN when not quoted and `published` is a '%Y-%m-%d %H:%M:%S' string
+        for ts in self.timestamps(start, end):
+            df = self.load(ts, ts)
+            if currencies is not None:
+                df = df[df['代号'].isin(currencies)]
+            for code, name, exch_buy, cash_buy, exch_sell, cash_sell, published in \
+                    df[COLUMNS].itertuples(index=False, name=None):
+                yield code, name, exch_buy, cash_buy, exch_sell, cash_sell, _format_ts(published)
+
+    def count(self) -> int:
+        return len(self.timestamps())
+
+    @abstractmethod
+    def get_meta(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def set_meta(self, key: str, value: str):
+        ...
+
+    def version(self):
+        return get_storage_version(self.path)
+
+    def get_outdated(self, days: int = 60) -> List[datetime]:
+        # snapshots that are more than `days` days older than the latest one
+        latest = self.latest_timestamp()
+        if latest is None:
+            return []
+        return self.timestamps(end=latest - timedelta(days=days + 1))
+
+
+class CSVStorage(Storage):
+    # one CSV file per snapshot, named '%Y_%m_%d-%H_%M_%S.csv', indexed by a manifest (see manifest.py)
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.manifest = Manifest(path, ext='.csv')
+
+    def exists(self) -> bool:
+        return os.path.isdir(self.path)
+
+    def version(self):
+        # a new snapshot file bumps the folder mtime before it is appended to the manifest, which does not,
+        # the manifest state tells a reader that saw the file but not the entry that the save has finished
+        try:
+            st = os.stat(self.manifest.file)
+        except OSError:
+            return get_storage_version(self.path)
+        return get_storage_version(self.path), st.st_mtime_ns, st.st_size
+
+    def save(self, df: pd.DataFrame) -> str:
+        ts = df['发布时间'].iloc[0]
+        filename = self._filename(ts)
+        df.to_csv(filename, header=True, index=False)
+        self.manifest.add(_stem(ts))
+        return filename
+
+    def save_many(self, frames: Iterable[pd.DataFrame]) -> int:
+        # the manifest is updated once for the whole batch
+        stems = []
+        for df in frames:
+            ts = df['发布时间'].iloc[0]
+            df.to_csv(self._filename(ts), header=True, index=False)
+            stems.append(_stem(ts))
+        self.manifest.add_many(stems)
+        return len(stems)
+
+    def latest(self) -> Optional[pd.DataFrame]:
+        filename = self._latest_file()
+        return None if filename is None else parse_csv(filename)
+
+    def latest_snapshot(self) -> Optional[Snapshot]:
+        filename = self._latest_file()
+        return None if filename is None else parse_csv(filename, as_snapshot=True)
+
+    def load(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> pd.DataFrame:
+        # only the files within the time range are parsed
+        frames = [parse_csv(self._filename(ts)) for ts in self.timestamps(start, end)]
+        if not frames:
+            return pd.DataFrame(columns=COLUMNS)
+        return pd.concat(frames, ignore_index=True)
+
+    def timestamps(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[datetime]:
+        if not self.exists():
+            return []
+        stems = self.manifest.range(None if start is None else _stem(start), None if end is None else _stem(end))
+        return [str_to_datetime(stem) for stem in stems]
+
+    def iter_rows(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                  currencies: Optional[Collection[str]] = None) -> Iterator[tuple]:
+        # one file open at a time, read with the csv module
+        for ts in self.timestamps(start, end):
+            with open(self._filename(ts), 'r', encoding='utf-8', newline='') as f:
+                for row in csv.DictReader(f):
+                    if currencies is None or row['代号'] in currencies:
+                        # pandas writes a column of midnight datetimes as dates
+                        published = row['发布时间'] if len(row['发布时间']) > 10 else row['发布时间'] + ' 00:00:00'
+                        yield (row['代号'], row['币种'], parse_price(row['现汇买入价']), parse_price(row['现钞买入价']),
+                               parse_price(row['现汇卖出价']), parse_price(row['现钞卖出价']), published)
+
+    def latest_timestamp(self) -> Optional[datetime]:
+        if not self.exists():
+            return None
+        stem = self.manifest.latest()
+        return None if stem is None else str_to_datetime(stem)
+
+    def count(self) -> int:
+        return len(self.manifest) if self.exists() else 0
+
+    def remove(self, timestamps: Iterable[datetime]) -> int:
+        removed = []
+        for ts in timestamps:
+            filename = self._filename(ts)
+            try:
+                os.remove(filename)
+                removed.append(_stem(ts))
+            except OSError:
+                logger.error(f"Failed to remove file: {filename}")
+        # one manifest rewrite for the whole batch
+        self.manifest.discard(removed)
+        return len(removed)
+
+    def get_meta(self, key: str) -> Optional[str]:
+        return self._read_meta().get(key)
+
+    def set_meta(self, key: str, value: str):
+        meta = self._read_meta()
+        meta[key] = value
+        # write then rename, readers never see a partial file
+        tmp = self._meta_file() + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._meta_file())
+
+    def _read_meta(self) -> dict:
+        try:
+            with open(self._meta_file(), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _meta_file(self) -> str:
+        return os.path.join(self.path, '.meta.json')
+
+    def _latest_file(self) -> Optional[str]:
+        if not self.exists():
+            return None
+        stem = self.manifest.latest()
+        return None if stem is None else self.manifest.filename(stem)
+
+    def _filename(self, ts: datetime) -> str:
+        return self.manifest.filename(_stem(ts))
+
+
+class SQLiteStorage(Storage):
+    """
+    All snapshots in a single SQLite file, stored as deltas: a snapshot keeps only the rows that changed
+    since the previous one (name, position or prices, or a '发布时间' different from the snapshot time),
+    and a tombstone (pos = -1) for the currencies that disappeared. The full snapshot at T is, per currency,
+    the latest row with ts <= T; rows carried over from an older snapshot take T as their '发布时间'.
+    Files written before delta storage keep every row of every snapshot and are read the same way.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS snapshots (
+            ts TEXT PRIMARY KEY
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS quotes (
+            ts TEXT NOT NULL,
+            code TEXT NOT NULL,
+            pos INTEGER NOT NULL,
+            name TEXT,
+            exch_buy REAL,
+            cash_buy REAL,
+            exch_sell REAL,
+            cash_sell REAL,
+            published TEXT,
+            PRIMARY KEY (ts, code)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS quotes_code_ts ON quotes (code, ts);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        ) WITHOUT ROWID;
+    """
+    ROW = 'q.ts, q.code, q.pos, q.name, q.exch_buy, q.cash_buy, q.exch_sell, q.cash_sell, q.published'
+    # per currency, the latest row stored strictly before a snapshot (tombstones included)
+    STATE = f"""
+        SELECT {ROW} FROM quotes q
+        JOIN (SELECT code, MAX(ts) AS ts FROM quotes WHERE ts < ? GROUP BY code) l
+        ON q.code = l.code AND q.ts = l.ts
+    """
+
+    def exists(self) -> bool:
+        return os.path.isdir(os.path.dirname(os.path.abspath(self.path)))
+
+    def save(self, df: pd.DataFrame) -> str:
+        self.save_many([df])
+        return self.path
+
+    def save_many(self, frames: Iterable[pd.DataFrame]) -> int:
+        # store several snapshots in a single transaction
+        count = 0
+        state, last = None, None
+        with closing(self._connect(create=True)) as conn, conn:
+            for df in frames:
+                ts = _format_ts(df['发布时间'].iloc[0])
+                rows = [
+                    (code, pos, name, _to_null(exch_buy), _to_null(cash_buy), _to_null(exch_sell),
+                     _to_null(cash_sell), _format_ts(published))
+                    for pos, (code, name, exch_buy, cash_buy, exch_sell, cash_sell, published) in
+                    enumerate(df[COLUMNS].itertuples(index=False, name=None))
+                ]
+
+                # the next snapshot was stored as a delta against the state before `ts`, make it self-contained
+                following = conn.execute('SELECT MIN(ts) FROM snapshots WHERE ts > ?', (ts,)).fetchone()[0]
+                if following is not None:
+                    self._pin(conn, following, [row[0] for row in rows])
+                conn.execute('DELETE FROM quotes WHERE ts = ?', (ts,))
+
+                # the previous frame of the batch is the state before `ts` when nothing was stored in between
+                if last is None or last >= ts or conn.execute(
+                        'SELECT 1 FROM snapshots WHERE ts > ? AND ts < ? LIMIT 1', (last, ts)).fetchone():
+                    state = {
+                        code: (code, pos, name, exch_buy, cash_buy, exch_sell, cash_sell)
+                        for _, code, pos, name, exch_buy, cash_buy, exch_sell, cash_sell, _ in
+                        conn.execute(self.STATE, (ts,)) if pos >= 0
+                    }
+
+                conn.execute('INSERT OR IGNORE INTO snapshots (ts) VALUES (?)', (ts,))
+                conn.executemany(
+                    'INSERT INTO quotes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(ts,) + row for row in _delta(state, rows, ts)]
+                )
+                state = {row[0]: row[:7] for row in rows}
+                last = ts
+                count += 1
+        return count
+
+    def latest(self) -> Optional[pd.DataFrame]:
+        if not os.path.exists(self.path):
+            return None
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT MAX(ts) FROM snapshots').fetchone()
+            if row[0] is None:
+                return None
+            return self._frame(self._snapshots(conn, row[0], row[0]))
+
+    def latest_snapshot(self) -> Optional[Snapshot]:
+        if not os.path.exists(self.path):
+            return None
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT MAX(ts) FROM snapshots').fetchone()
+            if row[0] is None:
+                return None
+            rows = list(self._snapshots(conn, row[0], row[0]))
+        if not rows:
+            return None
+        return Snapshot(
+            Quote(code, name, _to_float(exch_buy), _to_float(cash_buy), _to_float(exch_sell), _to_float(cash_sell),
+                  datetime.fromisoformat(published))
+            for code, name, exch_buy, cash_buy, exch_sell, cash_sell, published in rows
+        )
+
+    def load(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> pd.DataFrame:
+        if not os.path.exists(self.path):
+            return pd.DataFrame(columns=COLUMNS)
+        timestamps = self.timestamps(start, end)
+        if not timestamps:
+            return pd.DataFrame(columns=COLUMNS)
+        with closing(self._connect()) as conn:
+            return self._frame(self._snapshots(conn, _format_ts(timestamps[0]), _format_ts(timestamps[-1])))
+
+    def timestamps(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[datetime]:
+        if not os.path.exists(self.path):
+            return []
+        where, params = _range(start, end)
+        with closing(self._connect()) as conn:
+            rows = conn.execute('SELECT ts FROM snapshots' + where + ' ORDER BY ts', params).fetchall()
+        return [datetime.fromisoformat(ts) for ts, in rows]
+
+    def timestamp_at(self, ts: datetime) -> Optional[datetime]:
+        if not os.path.exists(self.path):
+            return None
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT MAX(ts) FROM snapshots WHERE ts <= ?', (_format_ts(ts),)).fetchone()
+        return None if row[0] is None else datetime.fromisoformat(row[0])
+
+    def iter_rows(self, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                  currencies: Optional[Collection[str]] = None) -> Iterator[tuple]:
+        # the time range and the currencies are pushed down to the queries, rows are rebuilt while streaming
+        if not os.path.exists(self.path):
+            return
+        where, params = _range(start, end)
+        with closing(self._connect()) as conn:
+            lo, hi = conn.execute('SELECT MIN(ts), MAX(ts) FROM snapshots' + where, params).fetchone()
+            if lo is None:
+                return
+            for code, name, exch_buy, cash_buy, exch_sell, cash_sell, published in \
+                    self._snapshots(conn, lo, hi, currencies):
+                yield code, name, _to_float(exch_buy), _to_float(cash_buy), _to_float(exch_sell), \
+                    _to_float(cash_sell), published
+
+    def latest_timestamp(self) -> Optional[datetime]:
+        if not os.path.exists(self.path):
+            return None
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT MAX(ts) FROM snapshots').fetchone()
+        return None if row[0] is None else datetime.fromisoformat(row[0])
+
+    def count(self) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        with closing(self._connect()) as conn:
+            return conn.execute('SELECT COUNT(*) FROM snapshots').fetchone()[0]
+
+    def remove(self, timestamps: Iterable[datetime]) -> int:
+        keys = sorted(_format_ts(ts) for ts in timestamps)
+        if not keys:
+            return 0
+        with closing(self._connect()) as conn, conn:
+            # the first kept snapshot after each removed one may rely on its rows, make it self-contained first
+            removed = set(keys)
+            kept = [ts for ts, in conn.execute('SELECT ts FROM snapshots WHERE ts > ? ORDER BY ts', (keys[0],))
+                    if ts not in removed]
+            following = {next((ts for ts in kept if ts > key), None) for key in keys} - {None}
+            for ts in sorted(following):
+                self._pin(conn, ts)
+            conn.executemany('DELETE FROM quotes WHERE ts = ?', [(key,) for key in keys])
+            conn.executemany('DELETE FROM snapshots WHERE ts = ?', [(key,) for key in keys])
+        return len(keys)
+
+    def get_meta(self, key: str) -> Optional[str]:
+        if not os.path.exists(self.path):
+            return None
+        with closing(self._connect()) as conn:
+            try:
+                row = conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+            except sqlite3.OperationalError:
+                # file created before the meta table existed
+                return None
+        return None if row is None else row[0]
+
+    def set_meta(self, key: str, value: str):
+        with closing(self._connect(create=True)) as conn, conn:
+            conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def _connect(self, create: bool = False) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path)
+        if create:
+            conn.executescript(self.SCHEMA)
+        return conn
+
+    def _pin(self, conn: sqlite3.Connection, ts: str, codes: Iterable[str] = ()):
+        # store the carried over rows of snapshot `ts` explicitly, so it no longer depends on older snapshots,
+        # and tombstones for `codes` it does not have (about to be stored by an older snapshot)
+        conn.execute(
+            'INSERT OR IGNORE INTO quotes '
+            'SELECT ?, code, pos, name, exch_buy, cash_buy, exch_sell, cash_sell, CASE WHEN pos >= 0 THEN ? END '
+            f'FROM ({self.STATE})',
+            (ts, ts, ts)
+        )
+        conn.executemany('INSERT OR IGNORE INTO quotes (ts, code, pos) VALUES (?, ?, -1)',
+                         [(ts, code) for code in codes])
+
+    def _snapshots(self, conn: sqlite3.Connection, start: str, end: str,
+                   codes: Optional[Collection[str]] = None) -> Iterator[tuple]:
+        # rebuilds the full snapshots within [start, end] (both stored timestamps) from the state before
+        # `start` and the deltas in between, yields table rows in the order of the parsers.
+        # Currencies are independent of each other, `codes` restricts the rebuild to them.
+        codes = () if codes is None else tuple(codes)
+        only = f"q.code IN ({', '.join('?' * len(codes))})" if codes else None
+        state = {row[1]: row for row in conn.execute(self.STATE + (f' WHERE {only}' if only else ''), (start,) + codes)}
+        deltas = conn.execute(
+            f'SELECT {self.ROW} FROM quotes q WHERE q.ts >= ? AND q.ts <= ?' + (f' AND {only}' if only else '') +
+            ' ORDER BY q.ts',
+            (start, end) + codes
+        )
+        delta = next(deltas, None)
+        for ts, in conn.execute('SELECT ts FROM snapshots WHERE ts >= ? AND ts <= ? ORDER BY ts', (start, end)):
+            while delta is not None and delta[0] <= ts:
+                state[delta[1]] = delta
+                delta = next(deltas, None)
+            for row_ts, code, pos, name, exch_buy, cash_buy, exch_sell, cash_sell, published in \
+                    sorted((row for row in state.values() if row[2] >= 0), key=lambda row: row[2]):
+                yield code, name, exch_buy, cash_buy, exch_sell, cash_sell, published if row_ts == ts else ts
+
+    @staticmethod
+    def _frame(rows: Iterable[tuple]) -> pd.DataFrame:
+        df = pd.DataFrame.from_records(list(rows), columns=COLUMNS)
+        for column in COLUMNS[2:6]:
+            df[column] = df[column].astype(float)
+        df['发布时间'] = pd.to_datetime(df['发布时间'])
+        return df
+
+
+def open_storage(path: str) -> Storage:
+    if path.lower().endswith(SQLITE_EXT):
+        return SQLiteStorage(path)
+    return CSVStorage(path)
+
+
+def migrate(src: str, dst: str, batch_size: int = 500) -> int:
+    # ingest a directory of CSV snapshots into a SQLite storage
+    source = CSVStorage(src)
+    target = open_storage(dst)
+    if not isinstance(target, SQLiteStorage):
+        raise ValueError(f"Migration target must be a SQLite file ({', '.join(SQLITE_EXT)}): {dst}")
+
+    timestamps = source.timestamps()
+    count = 0
+    for i in range(0, len(timestamps), batch_size):
+        count += target.save_many(parse_csv(source._filename(ts)) for ts in timestamps[i:i + batch_size])
+        logger.info(f"Migrated {count}/{len(timestamps)} snapshots from {src} to {dst}.")
+    return count
+
+
+def _delta(state: Dict[str, tuple], rows: List[tuple], ts: str) -> Iterator[tuple]:
+    # rows of the snapshot at `ts` that differ from `state` (the full snapshot before it), plus tombstones
+    for row in rows:
+        if state.get(row[0]) != row[:7] or row[7] != ts:
+            yield row
+    codes = {row[0] for row in rows}
+    for code in state:
+        if code not in codes:
+            yield code, -1, None, None, None, None, None, None
+
+
+def _stem(ts) -> str:
+    # CSV snapshot filename without extension
+    return pd.Timestamp(ts).strftime('%Y_%m_%d-%H_%M_%S')
+
+
+def _to_null(value: float) -> Optional[float]:
+    # SQLite has no NaN, missing quotes are NULL
+    return None if pd.isna(value) else float(value)
+
+
+def _to_float(value: Optional[float]) -> float:
+    # NULL is a missing quote
+    return float('nan') if value is None else value
+
+
+def _format_ts(ts) -> str:
+    return pd.Timestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _range(start: Optional[datetime], end: Optional[datetime]) -> tuple:
+    clauses, params = [], []
+    if start is not None:
+        clauses.append('ts >= ?')
+        params.append(_format_ts(start))
+    if end is not None:
+        clauses.append('ts <= ?')
+        params.append(_format_ts(end))
+    return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), tuple(params)
@@ -0,0 +1,290 @@
+import os
+import json
+import math
+import queue
+import asyncio
+import threading
+from typing import AsyncIterator, Callable, Dict, FrozenSet, Iterator, List, Optional
+try:
+    from .index import get_stored_snapshot
+    from .metrics import counter
+    from .shared import shared_snapshot
+    from .snapshot import Snapshot
+    from .storage import open_storage
+    from .utils import get_logger, CURRENCY
+except ImportError:
+    from index import get_stored_snapshot
+    from metrics import counter
+    from shared import shared_snapshot
+    from snapshot import Snapshot
+    from storage import open_storage
+    from utils import get_logger, CURRENCY
+
+
+"""
+Server-sent events of new snapshots: subscribers get the current table once (`event: snapshot`), then a compact
+`event: update` with the records of the currencies that changed, whenever a new snapshot lands in the storage.
+A watcher thread checks the storage version every STREAM_POLL_INTERVAL seconds (a stat call), so snapshots saved by
+another process (cron, `main.py --pipeline --daemon`) are pushed too.
+Fan-out: each record is encoded once per snapshot and events are assembled once per distinct currency filter,
+every subscriber then only receives bytes. Each subscriber has a bounded buffer of STREAM_BUFFER events,
+a consumer that falls behind is dropped (its stream ends, EventSource clients reconnect and get a fresh snapshot).
+`events()` blocks a thread per subscriber (WSGI servers, capped by the caller), `aevents()` waits on the event loop
+(asgi.py) and holds no thread.
+"""
+
+
+logger = get_logger('Stream', filename='stream.log')
+
+BUFFER = int(os.getenv('STREAM_BUFFER', 16))
+MAX_CLIENTS = int(os.getenv('STREAM_MAX_CLIENTS', 100))
+POLL_INTERVAL = float(os.getenv('STREAM_POLL_INTERVAL', 1.0))
+# seconds between two keep-alive comments, they also detect the clients that went away
+HEARTBEAT = float(os.getenv('STREAM_HEARTBEAT', 15.0))
+
+STREAM_EVENTS = counter('bank_stream_events_total', 'Server-sent events published by type.')
+STREAM_DROPS = counter('bank_stream_dropped_total', 'Stream subscribers dropped for falling behind.')
+
+# sentinel put in the buffer of a dropped subscriber
+_DROPPED = object()
+
+
+class Subscription:
+    def __init__(self, topics: Optional[FrozenSet[str]]):
+        # None subscribes to every currency
+        self.topics = topics
+        self.buffer: queue.Queue = queue.Queue(maxsize=BUFFER)
+        self.dropped = False
+        # (snapshot, encoded records) current when subscribing, later snapshots come through the buffer
+        self.initial = (None, {})
+        # called from the publishing thread after each push, wakes up an `aevents()` consumer
+        self.waker: Optional[Callable[[], None]] = None
+
+    def push(self, event: bytes) -> bool:
+        # False when the buffer is full: the subscriber is marked dropped and gets the sentinel instead
+        try:
+            self.buffer.put_nowait(event)
+            return True
+        except queue.Full:
+            self.dropped = True
+            # make room for the sentinel, the subscriber is leaving anyway
+            try:
+                self.buffer.get_nowait()
+            except queue.Empty:
+                pass
+            self.buffer.put_nowait(_DROPPED)
+            return False
+        finally:
+            waker = self.waker
+            if waker is not None:
+                try:
+                    waker()
+                except RuntimeError:
+                    # the event loop of the consumer is closed
+                    pass
+
+
+class Broadcaster:
+    """
+    Fan-out of snapshot events to the subscribers of one storage.
+    The watcher thread is started with the first subscription.
+    """
+
+    def __init__(self, storage: str, poll_interval: float = POLL_INTERVAL):
+        self.storage = storage
+        self.poll_interval = poll_interval
+        self.snapshot: Optional[Snapshot] = None
+        # currency -> encoded record of `snapshot`, for the initial events
+        self.records: Dict[str, bytes] = {}
+        self.subscribers: List[Subscription] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def subscribe(self, topics: Optional[FrozenSet[str]] = None, limit: Optional[int] = None) -> Optional[Subscription]:
+        # None when the server already has MAX_CLIENTS subscribers, or `limit` if lower
+        limit = MAX_CLIENTS if limit is None else min(limit, MAX_CLIENTS)
+        self._start()
+        with self._lock:
+            if len(self.subscribers) >= limit:
+                return None
+            subscription = Subscription(topics)
+            subscription.initial = (self.snapshot, self.records)
+            self.subscribers.append(subscription)
+        logger.info(f"New subscriber to {','.join(sorted(topics)) if topics else 'all'}, "
+                    f"{len(self.subscribers)} in total.")
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            if subscription in self.subscribers:
+                self.subscribers.remove(subscription)
+
+    def events(self, subscription: Subscription, last_event_id: Optional[str] = None) -> Iterator[bytes]:
+        # the SSE byte stream of a subscriber, until it is dropped or the client goes away
+        try:
+            initial = _initial(subscription, last_event_id)
+            if initial is not None:
+                yield initial
+            while True:
+                try:
+                    event = subscription.buffer.get(timeout=HEARTBEAT)
+                except queue.Empty:
+                    yield b': keep-alive\n\n'
+                    continue
+                if event is _DROPPED:
+                    return
+                yield event
+        finally:
+            self.unsubscribe(subscription)
+
+    async def aevents(self, subscription: Subscription, last_event_id: Optional[str] = None) -> AsyncIterator[bytes]:
+        # same stream as `events()`, waiting on the running event loop instead of a thread
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        subscription.waker = lambda: loop.call_soon_threadsafe(ready.set)
+        try:
+            initial = _initial(subscription, last_event_id)
+            if initial is not None:
+                yield initial
+            while True:
+                try:
+                    event = subscription.buffer.get_nowait()
+                except queue.Empty:
+                    ready.clear()
+                    # a push between the failed get and the clear would be missed otherwise
+                    if not subscription.buffer.empty():
+                        continue
+                    try:
+                        await asyncio.wait_for(ready.wait(), HEARTBEAT)
+                    except asyncio.TimeoutError:
+                        yield b': keep-alive\n\n'
+                    continue
+                if event is _DROPPED:
+                    return
+                yield event
+        finally:
+            subscription.waker = None
+            self.unsubscribe(subscription)
+
+    def publish(self, snapshot: Snapshot):
+        # diff against the last published snapshot and push the update to every interested subscriber,
+        # the first snapshot is pushed whole to those who subscribed before it existed
+        # currency -> encoded record, once per snapshot
+        records = {quote.currency: _encode(quote) for quote in snapshot.quotes}
+        with self._lock:
+            # swapped with the subscriber list copied, so a new subscriber gets either this snapshot as its
+            # initial one or the event below, never both
+            previous = self.snapshot
+            self.snapshot, self.records = snapshot, records
+            subscribers = list(self.subscribers)
+        name = 'snapshot' if previous is None else 'update'
+        changed = snapshot.quotes if previous is None else _changed(previous, snapshot)
+        if not changed:
+            return
+        STREAM_EVENTS.inc(type=name)
+        fragments = {quote.currency: records[quote.currency] for quote in changed}
+        # filter -> encoded event, once per distinct filter
+        events: Dict[Optional[FrozenSet[str]], Optional[bytes]] = {}
+        for subscription in subscribers:
+            if subscription.dropped:
+                continue
+            topics = subscription.topics
+            if topics not in events:
+                selected = [fragment for code, fragment in fragments.items() if topics is None or code in topics]
+                events[topics] = _event(name, snapshot, selected) if selected else None
+            if events[topics] is not None and not subscription.push(events[topics]):
+                STREAM_DROPS.inc()
+                logger.warning('Dropped a slow stream subscriber.')
+        logger.info(f"Published {len(changed)} changed currencies to {len(subscribers)} subscribers.")
+
+    def stop(self):
+        self._stop.set()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._watch, name='stream-watcher', daemon=True)
+            self._thread.start()
+
+    def _watch(self):
+        backend = open_storage(self.storage)
+        version = None
+        while True:
+            try:
+                # a worker of a producer process is told by the shared snapshot
+                current = backend.version(), shared_snapshot.version()
+                if current != version:
+                    version = current
+                    # shares the snapshot cache of the API, a storage change is parsed once;
+                    # an empty storage has nothing to publish yet, the watcher never scrapes
+                    snapshot = get_stored_snapshot(self.storage)
+                    if snapshot is not None and snapshot is not self.snapshot:
+                        self.publish(snapshot)
+            except Exception as e:
+                logger.error(f"Failed to check the storage for new snapshots: {e}")
+            if self._stop.wait(self.poll_interval):
+                return
+
+
+_broadcasters: Dict[str, Broadcaster] = {}
+_broadcasters_lock = threading.Lock()
+
+
+def get_broadcaster(storage: str) -> Broadcaster:
+    # one broadcaster (and watcher thread) per storage
+    key = os.path.abspath(storage)
+    with _broadcasters_lock:
+        if key not in _broadcasters:
+            _broadcasters[key] = Broadcaster(storage)
+        return _broadcasters[key]
+
+
+def parse_topics(currency: Optional[str]) -> Optional[FrozenSet[str]]:
+    # 'EUR,USD' -> frozenset, None for all; raises ValueError on unknown codes
+    if not currency or currency.strip().upper() == 'ALL':
+        return None
+    topics = frozenset(code.strip().upper() for code in currency.split(','))
+    invalid = sorted(topics - set(CURRENCY))
+    if invalid:
+        raise ValueError(f"Invalid currency: {', '.join(invalid)}.")
+    return topics
+
+
+def _initial(subscription: Subscription, last_event_id: Optional[str]) -> Optional[bytes]:
+    # the snapshot event of a new subscriber, None when there is no snapshot yet or the client already has it
+    snapshot, records = subscription.initial
+    if snapshot is None or last_event_id == snapshot.etag:
+        return None
+    topics = subscription.topics
+    return _event('snapshot', snapshot, [record for code, record in records.items() if topics is None or code in topics])
+
+
+def _changed(previous: Snapshot, snapshot: Snapshot) -> list:
+    # quotes of `snapshot` whose prices differ from `previous` (NaN equals NaN), or that are new
+    changed = []
+    for quote in snapshot.quotes:
+        old = previous.get(quote.currency)
+        if old is None or any(not _same(getattr(old, field), getattr(quote, field))
+                              for field in ('exch_buy', 'cash_buy', 'exch_sell', 'cash_sell')):
+            changed.append(quote)
+    return changed
+
+
+def _same(a: float, b: float) -> bool:
+    return a == b or (math.isnan(a) and math.isnan(b))
+
+
+def _encode(quote) -> bytes:
+    # missing quotes are null, NaN is not valid JSON for EventSource clients
+    record = {key: None if isinstance(value, float) and math.isnan(value) else value
+              for key, value in quote.to_dict().items()}
+    return json.dumps(record, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def _event(name: str, snapshot: Snapshot, records: List[bytes]) -> bytes:
+    # the event id is the snapshot etag, sent back by reconnecting clients as Last-Event-ID
+    data = b'{"data":[' + b','.join(records) + b'],"datetime":"' + \
+        snapshot.published.strftime('%Y-%m-%d %H:%M:%S').encode() + b'"}'
+    return b'id: ' + snapshot.etag.encode() + b'\nevent: ' + name.encode() + b'\ndata: ' + data + b'\n\n'
@@ -1,10 +1,16 @@
 import os
+import atexit
 import pandas as pd
 from dotenv import load_dotenv
 from pypushdeer import PushDeer
+from typing import Optional
 try:
+    from .notify import Dispatcher, PushDeerSink, StubSink
+    from .rules import RuleEngine, format_notification
     from .utils import get_logger
 except ImportError:
+    from notify import Dispatcher, PushDeerSink, StubSink
+    from rules import RuleEngine, format_notification
     from utils import get_logger
 
 
@@ -18,6 +24,19 @@ if push_key is None:
     pushdeer = None
 else:
     pushdeer = PushDeer(pushkey=push_key)
+# NOTIFY_SINK=stub keeps the notifications in memory (and the log) instead of sending them, for local runs
+sink_name = os.getenv('NOTIFY_SINK', 'pushdeer').lower()
+if sink_name == 'stub':
+    sink = StubSink()
+else:
+    sink = None if pushdeer is None else PushDeerSink(pushdeer)
+# notifications are delivered in the background, so triggers never wait for PushDeer
+if sink is None:
+    dispatcher = None
+else:
+    dispatcher = Dispatcher(sink=sink, name=sink_name)
+    # deliver the pending notifications before a one-shot pipeline run exits
+    atexit.register(dispatcher.close)
 
 
 """
@@ -26,7 +45,7 @@ Requirements for the trigger functions:
 2. The function must accept a pandas.DataFrame object as the first and required positional argument.
 3. The function must return a boolean value indicating whether the trigger is successfully executed.
 4. Use `try` and `except` to catch any exceptions.
-5. Use pushdeer to send notifications.
+5. Use `dispatcher.send` to send notifications (never call pushdeer directly, it blocks the pipeline).
 """
 
 
@@ -54,9 +73,9 @@ def trigger_when_price_is_lower_than(
             logger.debug(f"EUR exchange sell price: {price}")
 
         if price < threshold:
-            if pushdeer is not None:
-                pushdeer.send_text(f"Currency Watcher\nEUR exchange sell price is now at {price} "
-                                   f"(threshold: {threshold}).")
+            if dispatcher is not None:
+                dispatcher.send(f"Currency Watcher\nEUR exchange sell price is now at {price} "
+                                f"(threshold: {threshold}).")
             logger.info(f"EUR exchange sell price ({price}) is below threshold ({threshold}).")
     except Exception as e:
         logger.error(f"Failed to run <trigger_when_price_is_lower_than>: {e}")
@@ -65,6 +84,44 @@ def trigger_when_price_is_lower_than(
     return True
 
 
+_rule_engine: Optional[RuleEngine] = None
+
+
+def trigger_watch_rules(
+        df: pd.DataFrame,
+        debug: bool = False
+) -> bool:
+    """
+    Trigger for every watch rule in the file WATCHER_RULES_FILE that matches the snapshot.
+    """
+    global _rule_engine
+    rules_file = os.getenv('WATCHER_RULES_FILE')
+    if not rules_file:
+        return True
+
+    try:
+        if _rule_engine is None:
+            _rule_engine = RuleEngine.from_file(
+                rules_file,
+                state_file=os.getenv('WATCHER_RULES_STATE') or rules_file + '.state.json'
+            )
+        fired = _rule_engine.evaluate(df)
+
+        if debug:
+            logger.debug(f"Fired rules:\n{fired}")
+
+        if len(fired) > 0:
+            # one notification for all rules fired by this snapshot
+            if dispatcher is not None:
+                dispatcher.send(format_notification(fired))
+            logger.info(f"{len(fired)} watch rules fired.")
+    except Exception as e:
+        logger.error(f"Failed to run <trigger_watch_rules>: {e}")
+        return False
+    logger.info(f"Successfully run Trigger: <trigger_watch_rules>.")
+    return True
+
+
 if __name__ == '__main__':
     # test the trigger functions
     from parse import parse_csv
@@ -1,6 +1,10 @@
 import os
+import queue
 import types
+import atexit
 import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from datetime import datetime
 from typing import Optional, List, Callable
 
@@ -10,18 +14,105 @@ CURRENCY = (
     'DKK', 'NOK', 'JPY', 'CAD', 'AUD', 'MYR', 'EUR',
     'RUB', 'MOP', 'THB', 'NZD', 'ZAR', 'KZT', 'KRW'
 )
+# header of the quotation tables, in the order of the website and of the CSV files
+COLUMNS = ['代号', '币种', '现汇买入价', '现钞买入价', '现汇卖出价', '现钞卖出价', '发布时间']
+# file extensions of a SQLite storage, any other STORAGE_PATH is a CSV folder
+SQLITE_EXT = ('.db', '.sqlite', '.sqlite3')
+# currency code -> position in CURRENCY
+CURRENCY_INDEX = {code: i for i, code in enumerate(CURRENCY)}
+# API field name -> table column of the prices
+FIELDS = {
+    'exch_buy': '现汇买入价',
+    'cash_buy': '现钞买入价',
+    'exch_sell': '现汇卖出价',
+    'cash_sell': '现钞卖出价',
+}
+
+
+# one background thread writes every log file, loggers only put their records on this queue
+_log_queue = queue.SimpleQueue()
+_log_listener: Optional[QueueListener] = None
+# set in forked children, see `_after_fork`
+_log_direct: Optional[logging.Handler] = None
+_log_lock = threading.Lock()
+
+
+class _LogDispatcher(logging.Handler):
+    # runs in the listener thread: routes each record to the (rotating) file of its logger, or to the console
+    def __init__(self):
+        super().__init__()
+        self.handlers = {}
+
+    def emit(self, record: logging.LogRecord):
+        filename = getattr(record, 'logfile', None)
+        handler = self.handlers.get(filename)
+        if handler is None:
+            if filename is None:
+                handler = logging.StreamHandler()
+            else:
+                handler = RotatingFileHandler(filename, encoding='utf-8',
+                                              maxBytes=int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+                                              backupCount=int(os.getenv('LOG_BACKUP_COUNT', 5)))
+            # records arrive formatted by the QueueHandler
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.handlers[filename] = handler
+        handler.handle(record)
+
+
+class _LogQueueHandler(QueueHandler):
+    def __init__(self, filename: Optional[str]):
+        super().__init__(_log_queue)
+        self.filename = filename
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)
+        record.logfile = self.filename
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if _log_direct is not None:
+            _log_direct.handle(record)
+        else:
+            super().enqueue(record)
+
+
+def _start_log_listener():
+    global _log_listener
+    _log_listener = QueueListener(_log_queue, _LogDispatcher())
+    _log_listener.start()
+
+
+def _stop_log_listener():
+    # flush the pending records on exit
+    if _log_listener is not None:
+        _log_listener.stop()
+        for handler in _log_listener.handlers[0].handlers.values():
+            handler.close()
+
+
+def _after_fork():
+    # forked children (e.g. process pool workers) leave with os._exit, a listener thread would not be flushed:
+    # they write their records synchronously, what the parent had queued stays with the parent
+    global _log_lock, _log_direct
+    _log_lock = threading.Lock()
+    _log_direct = _LogDispatcher()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
 
 
 def get_logger(name: str,
                logfmt: str = '[%(asctime)s][%(name)s][%(filename)s][%(levelname)s]: %(message)s',
                datefmt: str = '%Y-%m-%d %H:%M:%S',
-               level: str = 'DEBUG',
+               level: Optional[str] = None,
                filename: Optional[str] = None):
-    # Create a custom logger
+    # Create a custom logger, calling it again with the same name returns the same logger without adding handlers
     logger = logging.getLogger(name)
 
-    # Set the logging level and format for this logger
-    logger.setLevel(getattr(logging, level, 'DEBUG'))
+    # Set the logging level (default: LOG_LEVEL env or DEBUG)
+    level = (level or os.getenv('LOG_LEVEL', 'DEBUG')).upper()
+    logger.setLevel(getattr(logging, level, logging.DEBUG))
 
     # check filename
     if filename is not None:
@@ -33,16 +124,19 @@ def get_logger(name: str,
             filename = None
             print('The logs folder does not exist. The log will be output to the console.')
 
-    # create handler
-    if filename is not None:
-        # Create a file handler to output log messages to a file
-        handler = logging.FileHandler(filename)
-        handler.setFormatter(logging.Formatter(logfmt, datefmt))
-    else:
-        # output log messages to console
-        handler = logging.StreamHandler()
+    with _log_lock:
+        if _log_listener is None and _log_direct is None:
+            _start_log_listener()
+            atexit.register(_stop_log_listener)
+        for handler in list(logger.handlers):
+            if isinstance(handler, _LogQueueHandler):
+                if handler.filename == filename:
+                    return logger
+                logger.removeHandler(handler)
+        # the file (or console) is written by the listener thread, callers never wait for disk I/O
+        handler = _LogQueueHandler(filename)
         handler.setFormatter(logging.Formatter(logfmt, datefmt))
-    logger.addHandler(handler)
+        logger.addHandler(handler)
     return logger
 
 
@@ -80,25 +174,24 @@ def get_latest_file(path: str, ext: str = 'csv') -> Optional[str]:
         logger.error(f"No latest file found in {path}, because no {ext} files found.")
         return None
     else:
-        # get the latest file
-        files.sort(reverse=True, key=lambda x: str_to_datetime(os.path.basename(x).split('.')[0]))
-        logger.info(f"Found latest file: {files[0]}")
-        return os.path.join(path, files[0])
+        # get the latest file, each filename is parsed once
+        latest = max(files, key=lambda x: str_to_datetime(os.path.basename(x).split('.')[0]))
+        logger.debug(f"Found latest file: {latest}")
+        return os.path.join(path, latest)
 
 
 def get_outdated_files(path: str, ext: str = 'csv', days: int = 60) -> List[str]:
+    # storage backends keep an index for this, see `Storage.get_outdated` and retention.py
     files = find_files(path=path, ext=ext)
     if len(files) == 0:
         logger.error(f"No outdated files found in {path}, because no {ext} files found.")
         return []
     else:
-        # get the latest file
-        files.sort(reverse=True, key=lambda x: str_to_datetime(os.path.basename(x).split('.')[0]))
-        latest_file = files[0]
-        # get the datetime of the latest file
-        latest_file_datetime = str_to_datetime(os.path.basename(latest_file).split('.')[0])
+        # parse every filename once, the latest datetime is their max
+        dates = {file: str_to_datetime(os.path.basename(file).split('.')[0]) for file in files}
+        latest_file_datetime = max(dates.values())
         # get the outdated files
-        outdated_files = [os.path.join(path, file) for file in files if (latest_file_datetime - str_to_datetime(os.path.basename(file).split('.')[0])).days > days]
+        outdated_files = [os.path.join(path, file) for file, date in dates.items() if (latest_file_datetime - date).days > days]
         if len(outdated_files) == 0:
             logger.info(f"No outdated files found in {path}.")
         else:
@@ -106,6 +199,14 @@ def get_outdated_files(path: str, ext: str = 'csv', days: int = 60) -> List[str]
         return outdated_files
 
 
+def get_storage_version(path: str) -> Optional[int]:
+    # the directory mtime changes whenever a file is added to or removed from the storage
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
 def get_modules(module: types.ModuleType, prefix: Optional[str] = None) -> List[Callable]:
     modules = []
     for name in dir(module):
@@ -0,0 +1,36 @@
+import importlib
+import pytest
+import pandas as pd
+from datetime import datetime
+from src.storage import CSVStorage, SQLiteStorage
+from src.utils import COLUMNS
+
+
+def make_table(ts: datetime, eur: float = 780.0, usd: float = 690.0) -> pd.DataFrame:
+    # a parsed exchange rate table with two currencies, published at `ts`
+    return pd.DataFrame([
+        ['EUR', '欧元', eur, eur - 6, eur + 3, eur + 3, pd.Timestamp(ts)],
+        ['USD', '美元', usd, usd - 5, usd + 3, usd + 3, pd.Timestamp(ts)],
+    ], columns=COLUMNS)
+
+
+@pytest.fixture
+def storage(tmp_path) -> str:
+    # a SQLite history with a snapshot every 6 hours on 2023-04-29 and 2023-04-30
+    path = str(tmp_path / 'history.db')
+    SQLiteStorage(path).save_many(
+        make_table(datetime(2023, 4, day, hour), eur=780.0 + day + hour / 10) for day in (29, 30) for hour in (0, 6, 12, 18)
+    )
+    return path
+
+
+@pytest.fixture
+def app_module(monkeypatch, tmp_path):
+    monkeypatch.setenv('FLASK_API_AUTH_TOKEN', 'secret')
+    monkeypatch.setenv('STORAGE_PATH', str(tmp_path))
+    # a stored snapshot, so that a new stream starts with it instead of waiting for a keep-alive
+    CSVStorage(str(tmp_path)).save(make_table(datetime(2023, 4, 1, 4, 14, 5)))
+    monkeypatch.setenv('WAITRESS_THREADS', '3')
+    monkeypatch.setenv('WAITRESS_REST_THREADS', '2')
+    import app
+    yield importlib.reload(app)
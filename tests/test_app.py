@@ -0,0 +1,56 @@
+import importlib
+import pytest
+
+
+def test_stream_limit_leaves_threads_to_other_endpoints(app_module):
+    assert app_module.STREAM_THREADS == 1
+    client = app_module.app.test_client()
+    first = client.get('/api/exchangerate/stream?token=secret', buffered=False)
+    assert first.status_code == 200
+    second = client.get('/api/exchangerate/stream?token=secret')
+    assert second.status_code == 503
+    first.close()
+
+
+def test_no_thread_left_for_streams(app_module, monkeypatch):
+    monkeypatch.setenv('WAITRESS_REST_THREADS', '3')
+    with pytest.raises(ValueError):
+        importlib.reload(app_module)
+
+
+def test_exchange_rate_conditional_requests(app_module):
+    client = app_module.app.test_client()
+    headers = {'Authorization': 'secret'}
+    response = client.get('/api/exchangerate?currency=EUR', headers=headers)
+    assert response.status_code == 200
+    assert [record['currency'] for record in response.get_json()['data']] == ['EUR']
+    etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+    assert etag == '"20230401041405"'
+    assert last_modified == 'Fri, 31 Mar 2023 20:14:05 GMT'
+
+    # the client already has this snapshot
+    response = client.get('/api/exchangerate?currency=EUR', headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    response = client.get('/api/exchangerate?currency=EUR', headers={**headers, 'If-Modified-Since': last_modified})
+    assert response.status_code == 304
+    # an older copy gets the body
+    response = client.get('/api/exchangerate?currency=EUR', headers={**headers, 'If-None-Match': '"20230101000000"'})
+    assert response.status_code == 200
+
+
+def test_exchange_rate_requires_the_token(app_module):
+    client = app_module.app.test_client()
+    response = client.get('/api/exchangerate?currency=EUR', headers={'Authorization': 'wrong'})
+    assert response.status_code == 302
+
+
+def test_metrics_are_off_by_default(app_module, monkeypatch):
+    client = app_module.app.test_client()
+    assert client.get('/metrics', follow_redirects=True).status_code == 404
+    monkeypatch.setenv('METRICS_ENABLED', 'true')
+    client = importlib.reload(app_module).app.test_client()
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert '# TYPE bank_http_requests_total counter' in response.get_data(as_text=True)
@@ -0,0 +1,100 @@
+import gzip
+import os
+import subprocess
+import sys
+import pandas as pd
+from datetime import datetime
+from bench.stub_icbc import make_page
+from src.archive import INDEX, archive_html, archive_path, archived_pages, reparse
+from src.parse import parse_html
+from src.storage import SQLiteStorage
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PUBLISHED = [datetime(2023, 4, 1, hour, 14, 5) for hour in range(3)]
+
+
+def _index(storage: str) -> list:
+    with open(os.path.join(archive_path(storage), INDEX), encoding='utf-8') as f:
+        return [line.rstrip('\n').split('\t') for line in f]
+
+
+def _index_row(filename: str) -> list:
+    return [os.path.basename(filename)[:-len('.html.gz')], '2023-04-01 00:00:00', 'stub']
+
+
+def test_archive_path(tmp_path):
+    assert archive_path(str(tmp_path / 'history.db')) == str(tmp_path / 'history.db.raw')
+    assert archive_path(str(tmp_path)) == os.path.join(str(tmp_path), 'raw')
+
+
+def test_pages_are_archived_once(tmp_path):
+    storage = str(tmp_path)
+    page = make_page(PUBLISHED[0])
+    first = archive_html(storage, page, url='stub', fetched=datetime(2023, 4, 1, 4, 20))
+    assert first is not None and first.startswith(archive_path(storage))
+    with open(first, 'rb') as f:
+        assert gzip.decompress(f.read()).decode('utf-8') == page
+    # the same content fetched again is neither stored nor indexed again
+    assert archive_html(storage, page, url='stub', fetched=datetime(2023, 4, 1, 4, 30)) is None
+    second = archive_html(storage, make_page(PUBLISHED[1]), url='stub')
+    assert second not in (None, first)
+    assert [row[1:] for row in _index(storage)][0] == ['2023-04-01 04:20:00', 'stub']
+    assert len(_index(storage)) == 2
+    assert archived_pages(storage) == [first, second]
+
+
+def test_pages_missing_from_the_index_are_listed_last(tmp_path):
+    storage = str(tmp_path)
+    pages = [archive_html(storage, make_page(ts), url='stub') for ts in PUBLISHED]
+    # e.g. the index was truncated by hand
+    with open(os.path.join(archive_path(storage), INDEX), 'w', encoding='utf-8') as f:
+        f.write('\t'.join(_index_row(pages[2])) + '\n')
+    listed = archived_pages(storage)
+    assert listed[0] == pages[2] and sorted(listed[1:]) == sorted(pages[:2])
+
+
+def test_reparse(tmp_path):
+    storage = str(tmp_path / 'history.db')
+    for i, ts in enumerate(PUBLISHED):
+        archive_html(storage, make_page(ts, seed=i), url='stub')
+    # fetched again later with other prices but the same '发布时间': the later page wins
+    archive_html(storage, make_page(PUBLISHED[1], seed=10), url='stub')
+    # a page the parser fails on, and a file that is not gzip
+    archive_html(storage, '<html><body>维护中</body></html>', url='stub')
+    broken = archive_html(storage, make_page(datetime(2023, 4, 1, 5, 14, 5)), url='stub')
+    with open(broken, 'wb') as f:
+        f.write(b'not gzip')
+
+    progress = []
+    stats = reparse(storage, workers=2, batch_size=2, progress=lambda *args: progress.append(args[:3]))
+    assert (stats['pages'], stats['failed'], stats['snapshots']) == (6, 2, 4)
+    # T1 is saved twice, once per batch it came in
+    assert progress == [(2, 6, 2), (4, 6, 4), (6, 6, 4)]
+
+    backend = SQLiteStorage(storage)
+    assert backend.timestamps() == PUBLISHED
+    expected = [parse_html(make_page(PUBLISHED[0], seed=0)), parse_html(make_page(PUBLISHED[1], seed=10)),
+                parse_html(make_page(PUBLISHED[2], seed=2))]
+    pd.testing.assert_frame_equal(backend.load(), pd.concat(expected, ignore_index=True))
+
+    # reparsing again replaces the snapshots, it does not duplicate them
+    assert reparse(storage, workers=1)['snapshots'] == 3
+    assert backend.count() == 3
+
+
+def test_reparse_command(tmp_path):
+    storage = str(tmp_path / 'history.db')
+    for ts in PUBLISHED:
+        archive_html(storage, make_page(ts), url='stub')
+    result = subprocess.run([sys.executable, 'main.py', '--reparse', '--storage', storage, '--workers', '1'],
+                            cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert 'Reparsed 3 pages (0 failed) into 3 snapshots' in result.stdout
+    assert SQLiteStorage(storage).timestamps() == PUBLISHED
+
+    missing = str(tmp_path / 'missing' / 'history.db')
+    result = subprocess.run([sys.executable, 'main.py', '--reparse', '--storage', missing],
+                            cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 1
+    assert 'Storage path does not exist' in result.stdout
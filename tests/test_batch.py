@@ -0,0 +1,36 @@
+import csv
+import io
+import json
+from src.history import lookup_batch
+from src.ledger import convert_ledger
+
+
+def _lookup(storage, *timestamps):
+    payload, ok = lookup_batch(storage, [{'currency': 'EUR', 'timestamp': ts} for ts in timestamps], ['exch_buy'])
+    return json.loads(payload), ok
+
+
+def test_naive_timestamps_are_china_time(storage):
+    response, ok = _lookup(storage, '2023-04-29 14:00:00', '2023-04-30T06:00:00')
+    assert ok
+    assert [item['datetime'] for item in response['data']] == ['2023-04-29 12:00:00', '2023-04-30 06:00:00']
+
+
+def test_offset_timestamps_are_converted(storage):
+    # 08:00 at UTC+2 is 14:00 in China, the 12:00 snapshot is valid then
+    response, ok = _lookup(storage, '2023-04-29T08:00:00+02:00', '2023-04-29T10:00:00Z')
+    assert ok
+    assert [item['datetime'] for item in response['data']] == ['2023-04-29 12:00:00', '2023-04-29 18:00:00']
+    assert response['data'][0]['exch_buy'] == 810.2
+
+
+def test_invalid_timestamps(storage):
+    response, ok = _lookup(storage, '2023-04-29 14:00:00', 'yesterday')
+    assert not ok
+    assert 'yesterday' in response['message']
+
+
+def test_ledger_uses_the_same_timestamps(storage):
+    ledger = io.BytesIO(b'currency,timestamp,amount\nEUR,2023-04-29T08:00:00+02:00,100\nEUR,2023-04-29 14:00:00,100\n')
+    rows = list(csv.DictReader(io.StringIO(b''.join(convert_ledger(storage, ledger, fields=['exch_buy'])).decode())))
+    assert [row['datetime'] for row in rows] == ['2023-04-29 12:00:00', '2023-04-29 12:00:00']
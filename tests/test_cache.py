@@ -0,0 +1,59 @@
+import threading
+import time
+from src.cache import SnapshotCache
+
+
+def test_ttl_and_version():
+    cache = SnapshotCache(ttl=0.05)
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return len(loads)
+
+    assert cache.get('key', loader, version=1) == 1
+    assert cache.get('key', loader, version=1) == 1
+    # a new storage version reloads before the TTL expires
+    assert cache.get('key', loader, version=2) == 2
+    time.sleep(0.06)
+    assert cache.get('key', loader, version=2) == 3
+
+
+def test_none_is_not_cached():
+    cache = SnapshotCache(ttl=60)
+    assert cache.get('key', lambda: None) is None
+    assert cache.get('key', lambda: 'loaded') == 'loaded'
+
+
+def test_concurrent_misses_share_one_load():
+    cache = SnapshotCache(ttl=60)
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_loader():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'snapshot'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('key', slow_loader))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    assert started.wait(5)
+    # give the other callers time to queue behind the loading one
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == ['snapshot'] * 8
+    assert len(calls) == 1
+
+
+def test_maxsize_evicts_the_oldest():
+    cache = SnapshotCache(ttl=60, maxsize=2)
+    for key in 'abc':
+        cache.get(key, lambda: key.upper())
+    assert cache.get('a', lambda: 'reloaded') == 'reloaded'
+    assert cache.get('c', lambda: 'reloaded') == 'C'
@@ -0,0 +1,91 @@
+import math
+import pytest
+from datetime import datetime
+from src.crossrate import CODES, cross_rate
+from src.snapshot import Quote, Snapshot
+
+
+PUBLISHED = datetime(2023, 4, 1, 4, 14, 5)
+
+
+@pytest.fixture
+def snapshot() -> Snapshot:
+    # KZT has no cash quotes ('--' on the website)
+    return Snapshot([
+        Quote('EUR', '欧元', 780.0, 756.0, 786.0, 786.0, PUBLISHED),
+        Quote('USD', '美元', 720.0, 698.0, 725.0, 725.0, PUBLISHED),
+        Quote('KZT', '哈萨克斯坦坚戈', 1.5, math.nan, 1.6, math.nan, PUBLISHED),
+    ])
+
+
+def test_matches_the_scalar_formula(snapshot):
+    eur_usd = cross_rate(snapshot, 'EUR', 'USD', 100)[0]
+    assert eur_usd['from'] == 'EUR' and eur_usd['to'] == 'USD' and eur_usd['amount'] == 100
+    assert eur_usd['datetime'] == '2023-04-01 04:14:05'
+    # sell EUR at its buy price, buy USD at its sell price
+    assert math.isclose(eur_usd['exch_buy'], 100 * 780.0 / 725.0)
+    assert math.isclose(eur_usd['exch_sell'], 100 * 786.0 / 720.0)
+    assert math.isclose(eur_usd['cash_buy'], 100 * 756.0 / 725.0)
+    assert math.isclose(eur_usd['cash_sell'], 100 * 786.0 / 698.0)
+    # CNY converts at 1
+    assert math.isclose(cross_rate(snapshot, 'CNY', 'EUR')[0]['exch_buy'], 100 / 786.0)
+    assert cross_rate(snapshot, 'CNY', 'CNY')[0]['exch_buy'] == 1.0
+
+
+def test_missing_quotes_are_null(snapshot):
+    kzt_usd = cross_rate(snapshot, 'KZT', 'USD')[0]
+    assert kzt_usd['cash_buy'] is None and kzt_usd['cash_sell'] is None
+    assert math.isclose(kzt_usd['exch_buy'], 1.5 / 725.0)
+    # GBP is not in the snapshot
+    assert cross_rate(snapshot, 'EUR', 'GBP')[0]['exch_buy'] is None
+    assert all(value is None for key, value in cross_rate(snapshot, 'GBP', 'EUR')[0].items() if '_' in key)
+
+
+def test_lists_and_all(snapshot):
+    records = cross_rate(snapshot, 'eur, kzt,CNY', 'USD,CNY')
+    assert [(record['from'], record['to']) for record in records] == [
+        ('EUR', 'USD'), ('EUR', 'CNY'), ('KZT', 'USD'), ('KZT', 'CNY'), ('CNY', 'USD'), ('CNY', 'CNY')
+    ]
+    assert len(cross_rate(snapshot, 'all', 'ALL')) == len(CODES) ** 2
+
+
+@pytest.mark.parametrize('source, target, amount', [
+    ('EUR', 'XXX', 1), ('', 'USD', 1), ('EUR', 'USD', 'ten'), ('EUR', 'USD', 'nan'), ('EUR', 'USD', 'inf'),
+])
+def test_invalid_input(snapshot, source, target, amount):
+    with pytest.raises(ValueError):
+        cross_rate(snapshot, source, target, amount)
+
+
+@pytest.mark.parametrize('query', ['from=XXX&to=USD', 'from=EUR&to=USD&amount=ten', 'to=USD'])
+def test_endpoint_rejects_invalid_parameters(app_module, query):
+    response = app_module.app.test_client().get(f'/api/crossrate?{query}', headers={'Authorization': 'secret'})
+    assert response.status_code == 400
+    assert response.get_json()['status'] == 'error'
+
+
+def test_endpoint_all(app_module):
+    response = app_module.app.test_client().get('/api/crossrate?from=all&amount=100',
+                                                 headers={'Authorization': 'secret'})
+    assert response.status_code == 200
+    records = response.get_json()['data']
+    # `to` defaults to CNY
+    assert [record['from'] for record in records] == list(CODES)
+    assert {record['to'] for record in records} == {'CNY'}
+    eur = next(record for record in records if record['from'] == 'EUR')
+    assert math.isclose(eur['exch_buy'], 780.0) and eur['datetime'] == '2023-04-01 04:14:05'
+
+
+def test_endpoint_conditional_requests(app_module):
+    client = app_module.app.test_client()
+    headers = {'Authorization': 'secret'}
+    response = client.get('/api/crossrate?from=EUR&to=USD', headers=headers)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert etag == '"20230401041405"'
+    # the rates only change with the snapshot
+    response = client.get('/api/crossrate?from=EUR&to=USD', headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == 304
+    response = client.get('/api/crossrate?from=EUR&to=USD',
+                          headers={**headers, 'If-Modified-Since': 'Fri, 31 Mar 2023 20:14:05 GMT'})
+    assert response.status_code == 304
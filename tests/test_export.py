@@ -0,0 +1,85 @@
+import csv
+import io
+import json
+import pytest
+from datetime import datetime
+from src import export
+from src.export import KEYS, export_history
+from src.storage import CSVStorage, SQLiteStorage, Storage
+from tests.conftest import make_table
+
+
+def _read(chunks) -> str:
+    return b''.join(chunks).decode('utf-8')
+
+
+@pytest.fixture
+def csv_storage(tmp_path, storage) -> str:
+    # the same history as `storage` in a CSV folder, plus a snapshot without the EUR cash quotes
+    path = tmp_path / 'csv'
+    path.mkdir()
+    backend = CSVStorage(str(path))
+    backend.save_many(SQLiteStorage(storage).load(ts, ts) for ts in SQLiteStorage(storage).timestamps())
+    df = make_table(datetime(2023, 5, 1))
+    df.loc[0, ['现钞买入价', '现钞卖出价']] = float('nan')
+    backend.save(df)
+    return str(path)
+
+
+def test_iter_rows_is_the_same_for_every_backend(storage, csv_storage):
+    sqlite = SQLiteStorage(storage)
+    csv_backend = CSVStorage(csv_storage)
+    start, end = datetime(2023, 4, 29, 6), datetime(2023, 4, 30, 6)
+    rows = list(sqlite.iter_rows(start, end))
+    assert len(rows) == 5 * 2
+    assert rows[0] == ('EUR', '欧元', 809.6, 803.6, 812.6, 812.6, '2023-04-29 06:00:00')
+    assert rows[-1][::6] == ('USD', '2023-04-30 06:00:00')
+    assert list(csv_backend.iter_rows(start, end)) == rows
+    # the default implementation, through `load`
+    assert list(Storage.iter_rows(sqlite, start, end)) == rows
+    assert list(sqlite.iter_rows(start, end, currencies=['USD'])) == [row for row in rows if row[0] == 'USD']
+
+
+def test_date_only_range_includes_the_last_day(storage):
+    text = _read(export_history(storage, start='2023-04-30', end='2023-04-30'))
+    records = list(csv.DictReader(io.StringIO(text)))
+    assert len(records) == 4 * 2
+    assert records[0]['datetime'] == '2023-04-30 00:00:00'
+    assert records[-1]['datetime'] == '2023-04-30 18:00:00'
+    # a datetime is an exact bound
+    text = _read(export_history(storage, start='2023-04-30', end='2023-04-30 12:00:00'))
+    assert [record['datetime'] for record in csv.DictReader(io.StringIO(text))][-1] == '2023-04-30 12:00:00'
+
+
+def test_csv_export(csv_storage):
+    lines = _read(export_history(csv_storage, currency='eur', start='2023-05-01')).splitlines()
+    assert lines[0] == ','.join(KEYS)
+    # missing quotes are empty cells
+    assert lines[1:] == ['EUR,欧元,780.0,,783.0,,2023-05-01 00:00:00']
+
+
+def test_ndjson_export(csv_storage):
+    lines = _read(export_history(csv_storage, fmt='NDJSON', start='2023-05-01')).splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {'currency': 'EUR', 'name': '欧元', 'exch_buy': 780.0, 'cash_buy': None, 'exch_sell': 783.0,
+         'cash_sell': None, 'datetime': '2023-05-01 00:00:00'},
+        {'currency': 'USD', 'name': '美元', 'exch_buy': 690.0, 'cash_buy': 685.0, 'exch_sell': 693.0,
+         'cash_sell': 693.0, 'datetime': '2023-05-01 00:00:00'},
+    ]
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'ndjson'])
+def test_export_is_chunked(storage, monkeypatch, fmt):
+    whole = _read(export_history(storage, fmt=fmt))
+    monkeypatch.setattr(export, 'CHUNK_SIZE', 100)
+    chunks = list(export_history(storage, fmt=fmt))
+    assert len(chunks) > 5
+    assert _read(chunks) == whole
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'fmt': 'xml'}, {'currency': 'EUR,XXX'}, {'start': 'yesterday'}, {'end': '2023-13-01'},
+])
+def test_invalid_export(storage, kwargs):
+    with pytest.raises(ValueError):
+        export_history(storage, **kwargs)
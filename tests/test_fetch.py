@@ -0,0 +1,83 @@
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from src.fetch import Fetcher
+
+
+class Upstream(BaseHTTPRequestHandler):
+    # serves a fixed page with an ETag, answers 503 to the first `failures` requests
+    page = '<html>汇率</html>'.encode('utf-8')
+    etag = '"v1"'
+    failures = 0
+    requests = []
+
+    def do_GET(self):
+        type(self).requests.append(dict(self.headers))
+        if type(self).failures > 0:
+            type(self).failures -= 1
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(self.page)))
+        self.end_headers()
+        self.wfile.write(self.page)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    Upstream.failures = 0
+    Upstream.requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Upstream)
+    threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/'
+    server.shutdown()
+    server.server_close()
+
+
+def test_conditional_fetch(upstream):
+    fetcher = Fetcher(retries=0)
+    first = fetcher.fetch(upstream)
+    assert first == (Upstream.page.decode('utf-8'), True, 200)
+    # the validators of the first response are sent back, the page is not transferred again
+    second = fetcher.fetch(upstream)
+    assert second == (None, False, 304)
+    assert Upstream.requests[-1]['If-None-Match'] == '"v1"'
+    # an unconditional fetch always returns the page
+    assert fetcher.fetch(upstream, conditional=False).text == Upstream.page.decode('utf-8')
+
+
+def test_restored_validators(upstream):
+    fetcher = Fetcher(retries=0)
+    fetcher.restore(upstream, {'etag': '"v1"', 'hash': None})
+    assert fetcher.fetch(upstream).status == 304
+
+
+def test_retries_on_server_errors(upstream):
+    Upstream.failures = 2
+    fetcher = Fetcher(retries=2, backoff=0.0)
+    assert fetcher.fetch(upstream).status == 200
+    assert len(Upstream.requests) == 3
+
+
+def test_gives_up_after_retries(upstream):
+    Upstream.failures = 5
+    fetcher = Fetcher(retries=1, backoff=0.0)
+    result = fetcher.fetch(upstream)
+    assert result.text is None and result.status == 0
+    assert len(Upstream.requests) == 2
+
+
+def test_connection_error():
+    fetcher = Fetcher(timeout=(0.5, 0.5), retries=0)
+    assert fetcher.fetch('http://127.0.0.1:9/') == (None, False, 0)
@@ -0,0 +1,28 @@
+import json
+from src.history import get_history
+
+
+def _data(payload: bytes) -> list:
+    return json.loads(payload)['data']
+
+
+def test_daily_history(storage):
+    payload, ok = get_history(storage, 'EUR', start='2023-04-29', end='2023-04-30', interval='1D')
+    assert ok
+    data = _data(payload)
+    assert [item['datetime'] for item in data] == ['2023-04-29 00:00:00', '2023-04-30 00:00:00']
+    # a date-only `to` includes the whole day
+    assert data[1]['exch_buy']['close'] == 811.8
+
+
+def test_empty_range(storage):
+    payload, ok = get_history(storage, 'EUR', start='2030-01-01', interval='1D')
+    assert ok
+    assert _data(payload) == []
+
+
+def test_invalid_interval(storage):
+    for interval in ('0D', '-1D', 'fortnight'):
+        payload, ok = get_history(storage, 'EUR', interval=interval)
+        assert not ok
+        assert json.loads(payload)['status'] == 'error'
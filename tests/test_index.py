@@ -0,0 +1,20 @@
+from datetime import datetime
+from bench.stub_icbc import start_stub
+from src import index
+from src.storage import open_storage
+
+
+def test_unchanged_run_keeps_the_storage_version(tmp_path):
+    stub = start_stub(port=0, published=datetime(2023, 4, 1, 4, 14, 5))
+    url = f'http://127.0.0.1:{stub.server_address[1]}/'
+    storage = str(tmp_path)
+    try:
+        assert index.pipeline(url, storage=storage) is not None
+        assert open_storage(storage).get_meta(f'table:{url}') is not None
+        version = open_storage(storage).version()
+        # same page: nothing is saved, and the persisted state is not rewritten either
+        assert index.pipeline(url, storage=storage) is not None
+        assert open_storage(storage).version() == version
+    finally:
+        stub.shutdown()
+        stub.server_close()
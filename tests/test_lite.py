@@ -0,0 +1,52 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+from datetime import datetime
+from src.storage import CSVStorage, SQLiteStorage
+from tests.conftest import make_table
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run(code: str) -> dict:
+    # in a fresh interpreter, so that the modules imported by the tests don't count
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def test_package_import_is_light():
+    result = _run('import json, sys, src; '
+                  'print(json.dumps({"pandas": "pandas" in sys.modules, "index": "src.index" in sys.modules}))')
+    assert result == {'pandas': False, 'index': False}
+
+
+def test_exports_are_imported_on_access():
+    import src
+    assert callable(src.get_history)
+    assert 'get_history' in dir(src)
+    with pytest.raises(AttributeError):
+        src.no_such_function
+
+
+@pytest.mark.parametrize('name', ['csv', 'history.db'])
+def test_latest_quote_without_pandas(tmp_path, name):
+    path = str(tmp_path / name)
+    storage = CSVStorage(path) if name == 'csv' else SQLiteStorage(path)
+    if name == 'csv':
+        os.makedirs(path)
+    storage.save(make_table(datetime(2023, 4, 1, 4, 14, 5), eur=780.0))
+    storage.save(make_table(datetime(2023, 4, 1, 5, 14, 5), eur=781.0))
+    result = _run('import json, sys; from src import read_latest_quote; '
+                  f'quote = read_latest_quote(storage={path!r}, currency="eur"); '
+                  'print(json.dumps({"pandas": "pandas" in sys.modules, "quote": quote}))')
+    assert result['pandas'] is False
+    assert result['quote'] == storage.latest_snapshot().get('EUR').to_dict()
+
+
+def test_missing_storage(tmp_path):
+    from src.lite import read_latest_quote
+    assert read_latest_quote(str(tmp_path / 'missing.db'), 'EUR') is None
+    assert read_latest_quote(str(tmp_path / 'missing'), 'EUR') is None
@@ -0,0 +1,54 @@
+import re
+from src import metrics
+from src.metrics import Counter, Histogram
+
+
+# a sample line of the Prometheus text format: name{label="value",...} value
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_][a-zA-Z0-9_]*="([^"\\\n]|\\.)*",?)*\})? \S+$')
+
+
+def test_counter_exposition():
+    counter = Counter('test_requests_total', 'Requests.')
+    counter.inc(endpoint='rate', status=200)
+    counter.inc(2, endpoint='rate', status=200)
+    counter.inc(endpoint='say "hi"\n\\')
+    assert counter.get(endpoint='rate', status=200) == 3
+    assert counter.render() == [
+        '# HELP test_requests_total Requests.',
+        '# TYPE test_requests_total counter',
+        'test_requests_total{endpoint="rate",status="200"} 3',
+        'test_requests_total{endpoint="say \\"hi\\"\\n\\\\"} 1',
+    ]
+
+
+def test_histogram_exposition():
+    histogram = Histogram('test_seconds', 'Durations.', buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, stage='fetch')
+    assert histogram.render() == [
+        '# HELP test_seconds Durations.',
+        '# TYPE test_seconds histogram',
+        # cumulative counts, a bound includes the values equal to it
+        'test_seconds_bucket{stage="fetch",le="0.1"} 2',
+        'test_seconds_bucket{stage="fetch",le="1"} 3',
+        'test_seconds_bucket{stage="fetch",le="+Inf"} 4',
+        'test_seconds_sum{stage="fetch"} 3.650000',
+        'test_seconds_count{stage="fetch"} 4',
+    ]
+
+
+def test_render_is_valid_exposition():
+    with metrics.timer('test_stage', name='a'):
+        pass
+    metrics.UPSTREAM_ERRORS.inc(reason='timeout')
+    lines = metrics.render().splitlines()
+    assert 'bank_stage_duration_seconds_count{name="a",stage="test_stage"} 1' in lines
+    # every metric is declared once, before its samples
+    declared = [line.split()[2] for line in lines if line.startswith('# TYPE')]
+    assert len(declared) == len(set(declared)) == len(metrics.REGISTRY)
+    for line in lines:
+        assert line.startswith('# HELP ') or line.startswith('# TYPE ') or SAMPLE.match(line), line
+
+
+def test_registry_returns_the_same_metric():
+    assert metrics.counter('bank_upstream_errors_total', 'unused') is metrics.UPSTREAM_ERRORS
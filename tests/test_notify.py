@@ -0,0 +1,79 @@
+import itertools
+import threading
+from src import metrics
+from src.notify import Dispatcher, StubSink
+
+
+_names = itertools.count()
+
+
+def _dispatcher(sink, **kwargs) -> Dispatcher:
+    # no batching wait and millisecond backoff, the tests only check the delivery logic;
+    # a new name per dispatcher keeps the counters of the tests apart
+    return Dispatcher(sink=sink, batch_wait=0.0, backoff=0.001, name=f'test-{next(_names)}', **kwargs)
+
+
+def _count(dispatcher: Dispatcher, outcome: str) -> float:
+    return metrics.NOTIFICATIONS.get(dispatcher=dispatcher.name, outcome=outcome)
+
+
+def test_retry_until_delivered():
+    sink = StubSink(fail=2)
+    dispatcher = _dispatcher(sink, retries=3)
+    assert dispatcher.send('EUR is below 750')
+    assert dispatcher.flush(timeout=5)
+    assert sink.messages == ['EUR is below 750']
+    assert metrics.NOTIFY_RETRIES.get(dispatcher=dispatcher.name) == 2
+    assert _count(dispatcher, 'delivered') == 1
+    dispatcher.close()
+
+
+def test_give_up_after_retries():
+    sink = StubSink(fail=5)
+    dispatcher = _dispatcher(sink, retries=2)
+    dispatcher.send('EUR is below 750')
+    assert dispatcher.flush(timeout=5)
+    assert sink.messages == []
+    assert metrics.NOTIFY_RETRIES.get(dispatcher=dispatcher.name) == 2
+    assert _count(dispatcher, 'failed') == 1
+    dispatcher.close()
+
+
+def test_drop_when_buffer_is_full():
+    entered, release = threading.Event(), threading.Event()
+    sink = StubSink()
+
+    def blocking_sink(text: str):
+        entered.set()
+        release.wait(5)
+        sink(text)
+
+    dispatcher = _dispatcher(blocking_sink, maxsize=1, batch_size=1)
+    assert dispatcher.send('first')
+    # the worker holds the first message, the second fills the buffer
+    assert entered.wait(5)
+    assert dispatcher.send('second')
+    assert not dispatcher.send('third')
+    release.set()
+    assert dispatcher.flush(timeout=5)
+    assert sink.messages == ['first', 'second']
+    assert _count(dispatcher, 'dropped') == 1
+    assert _count(dispatcher, 'enqueued') == 2
+    dispatcher.close()
+
+
+def test_closed_dispatcher_drops():
+    dispatcher = _dispatcher(StubSink())
+    dispatcher.close()
+    assert not dispatcher.send('late')
+    assert _count(dispatcher, 'dropped') == 1
+
+
+def test_counters_are_exposed():
+    dispatcher = _dispatcher(StubSink())
+    dispatcher.send('EUR is below 750')
+    assert dispatcher.flush(timeout=5)
+    exposition = metrics.render()
+    assert f'bank_notifications_total{{dispatcher="{dispatcher.name}",outcome="delivered"}} 1' in exposition
+    assert f'bank_notification_latency_seconds_count{{dispatcher="{dispatcher.name}"}} 1' in exposition
+    dispatcher.close()
@@ -0,0 +1,41 @@
+import pytest
+from datetime import datetime, timedelta
+from src.retention import parse_policy, select_expired
+from src.storage import SQLiteStorage
+from tests.conftest import make_table
+
+
+LATEST = datetime(2023, 4, 30, 12)
+
+
+def _storage(tmp_path, ages) -> SQLiteStorage:
+    storage = SQLiteStorage(str(tmp_path / 'history.db'))
+    storage.save_many(make_table(LATEST - age) for age in ages)
+    return storage
+
+
+def test_default_policy_matches_the_60_day_rule(tmp_path):
+    # the original --clean removed snapshots whose age in whole days was over 60
+    ages = [timedelta(0), timedelta(days=60), timedelta(days=60, seconds=1), timedelta(days=61, seconds=-1),
+            timedelta(days=61), timedelta(days=90)]
+    storage = _storage(tmp_path, ages)
+    expired = select_expired(storage, parse_policy('all:60d'))
+    assert expired == sorted(LATEST - age for age in ages if (LATEST - (LATEST - age)).days > 60)
+    assert expired == storage.get_outdated(60)
+    assert expired == [LATEST - timedelta(days=90), LATEST - timedelta(days=61)]
+
+
+def test_tiers_keep_the_last_snapshot_per_bucket(tmp_path):
+    ages = [timedelta(hours=h) for h in range(0, 24 * 4, 6)]
+    storage = _storage(tmp_path, ages)
+    # every snapshot under 2 days old, then one per day under 3 days old, nothing older
+    expired = select_expired(storage, parse_policy('all:1d,1d:2d'))
+    kept = sorted(set(storage.timestamps()) - set(expired))
+    assert kept == sorted(LATEST - timedelta(hours=h) for h in [66, 48, *range(0, 48, 6)])
+    assert expired == sorted(LATEST - timedelta(hours=h) for h in (90, 84, 78, 72, 60, 54))
+
+
+@pytest.mark.parametrize('policy', ['60d', 'all:60', '1x:7d', 'all:1.5d', '1h:0.5w'])
+def test_invalid_policy(policy):
+    with pytest.raises(ValueError):
+        parse_policy(policy)
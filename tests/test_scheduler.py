@@ -0,0 +1,64 @@
+import threading
+import time
+from src.scheduler import Scheduler
+
+
+def test_next_run_is_aligned():
+    scheduler = Scheduler(job=lambda: None, interval=3600, offset=300)
+    # 10:02 -> 10:05, 10:05 -> 11:05
+    assert scheduler.next_run(now=10 * 3600 + 120) == 10 * 3600 + 300
+    assert scheduler.next_run(now=10 * 3600 + 300) == 11 * 3600 + 300
+
+
+def test_runs_never_overlap():
+    release = threading.Event()
+    scheduler = Scheduler(job=lambda: release.wait(5), interval=60)
+    worker = threading.Thread(target=scheduler.run_once)
+    worker.start()
+    time.sleep(0.05)
+    assert scheduler.run_once() is False
+    release.set()
+    worker.join(5)
+    # the skipped run is not counted
+    assert scheduler.runs == 1
+
+
+def test_failing_job_does_not_stop_the_scheduler():
+    def job():
+        raise RuntimeError('upstream down')
+
+    scheduler = Scheduler(job=job, interval=60)
+    assert scheduler.run_once() is False
+    assert scheduler.last_run is not None
+
+
+def test_run_forever_until_stopped():
+    runs = []
+    scheduler = Scheduler(job=lambda: runs.append(time.time()), interval=0.05)
+    scheduler.start()
+    time.sleep(0.3)
+    scheduler.stop(timeout=1)
+    assert not scheduler._thread.is_alive()
+    # the run on start and one per interval
+    assert 4 <= len(runs) <= 8
+    count = len(runs)
+    time.sleep(0.1)
+    assert len(runs) == count
+
+
+def test_missed_runs_are_caught_up_once():
+    runs = []
+
+    def slow_job():
+        runs.append(time.time())
+        if len(runs) == 2:
+            # longer than several intervals
+            time.sleep(0.25)
+
+    scheduler = Scheduler(job=slow_job, interval=0.05, run_on_start=False)
+    scheduler.start()
+    time.sleep(0.5)
+    scheduler.stop(timeout=1)
+    # no burst of runs right after the slow one
+    gaps = [b - a for a, b in zip(runs[1:], runs[2:])]
+    assert all(gap > 0.02 for gap in gaps[1:])
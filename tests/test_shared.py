@@ -0,0 +1,118 @@
+import time
+import pytest
+from datetime import datetime
+from multiprocessing import Process
+from src import index, shared
+from src.shared import SHARED_LOADS, SharedSnapshot
+from src.snapshot import Quote, Snapshot, encode_response
+from src.storage import CSVStorage
+from src.utils import CURRENCY
+from tests.conftest import make_table
+
+
+def table(hour: int) -> Snapshot:
+    published = datetime(2023, 4, 1, hour, 14, 5)
+    return Snapshot([Quote(code, code, 700.0 + hour, float('nan'), 710.0 + hour, 720.0, published)
+                     for code in CURRENCY])
+
+
+def read(path: str, seconds: float):
+    # reader process: every copy it gets must be consistent
+    reader = SharedSnapshot(path)
+    seen = None
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        snapshot = reader.get('.')
+        if snapshot is None or snapshot is seen:
+            continue
+        seen = snapshot
+        # the payloads were encoded by the writer, a torn copy would not match the quotes
+        assert snapshot.payloads['ALL'] == encode_response(snapshot.response('all'))
+        assert snapshot.get('EUR').exch_buy == 700.0 + snapshot.published.hour
+
+
+@pytest.fixture
+def path(tmp_path) -> str:
+    return str(tmp_path / 'snapshot.shm')
+
+
+def test_write_then_get(path):
+    writer = SharedSnapshot(path)
+    assert writer.publish(table(4), '.')
+    # the same snapshot again is a no-op
+    assert not writer.publish(table(4), '.')
+    snapshot = SharedSnapshot(path).get('.')
+    assert snapshot.published == datetime(2023, 4, 1, 4, 14, 5)
+    # the decoded quotes, and the responses served as encoded by the producer
+    assert encode_response(snapshot.response('all')) == encode_response(table(4).response('all'))
+    assert snapshot.payloads['ALL'] == table(4).payload('all')
+    assert snapshot.payload('EUR') == table(4).payload('EUR')
+    # another storage has nothing shared
+    assert SharedSnapshot(path).get('/elsewhere') is None
+
+
+def test_older_snapshot_is_not_shared(path):
+    writer = SharedSnapshot(path)
+    assert writer.publish(table(5), '.')
+    assert not writer.publish(table(4), '.')
+    assert SharedSnapshot(path).get('.').published.hour == 5
+
+
+def test_unchanged_version_returns_the_cached_copy(path):
+    writer = SharedSnapshot(path)
+    writer.publish(table(4), '.')
+    reader = SharedSnapshot(path)
+    first = reader.get('.')
+    loaded = SHARED_LOADS.get(result='loaded')
+    assert reader.get('.') is first
+    assert SHARED_LOADS.get(result='loaded') == loaded
+    # a new sequence is copied out once
+    version = reader.version()
+    writer.publish(table(5), '.')
+    assert reader.version() == version + 2
+    assert reader.get('.').published.hour == 5
+    assert SHARED_LOADS.get(result='loaded') == loaded + 1
+
+
+def test_corrupted_data_is_rejected(path, monkeypatch):
+    monkeypatch.setattr(shared, 'RETRIES', 10)
+    SharedSnapshot(path).publish(table(4), '.')
+    with open(path, 'r+b') as f:
+        f.seek(shared.DATA_OFFSET + 20)
+        byte = f.read(1)
+        f.seek(shared.DATA_OFFSET + 20)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    failed = SHARED_LOADS.get(result='failed')
+    assert SharedSnapshot(path).get('.') is None
+    assert SHARED_LOADS.get(result='failed') == failed + 1
+
+
+def test_missing_file_falls_back_to_the_storage(path, tmp_path, monkeypatch):
+    reader = SharedSnapshot(path)
+    assert reader.enabled and reader.get('.') is None and reader.version() is None
+    storage = tmp_path / 'csv'
+    storage.mkdir()
+    CSVStorage(str(storage)).save(make_table(datetime(2023, 4, 1, 4, 14, 5)))
+    monkeypatch.setattr(index, 'shared_snapshot', reader)
+    snapshot = index.get_snapshot(url='', now=False, storage=str(storage))
+    assert snapshot.published == datetime(2023, 4, 1, 4, 14, 5)
+    assert index.get_stored_snapshot(str(storage)) is snapshot
+
+
+def test_readers_never_get_a_torn_copy(path):
+    # seqlock: a writer alternates snapshots while reader processes check every copy they get
+    writer = SharedSnapshot(path)
+    tables = [table(hour) for hour in range(24)]
+    writer.publish(tables[0], '.')
+    readers = [Process(target=read, args=(path, 1.0)) for _ in range(2)]
+    for process in readers:
+        process.start()
+    writes = 0
+    deadline = time.monotonic() + 1.0
+    while time.monotonic() < deadline:
+        # always newer: wrap around by publishing for another storage in between
+        writes += writer.publish(tables[writes % 24], '.' if writes % 24 else '/')
+    for process in readers:
+        process.join()
+        assert process.exitcode == 0
+    assert writes > 24
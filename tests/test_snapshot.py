@@ -0,0 +1,52 @@
+import json
+import math
+import pytest
+from datetime import datetime
+from src.snapshot import Quote, Snapshot, encode_response
+from src.storage import CSVStorage
+from tests.conftest import make_table
+
+
+PUBLISHED = datetime(2023, 4, 1, 4, 14, 5)
+
+
+def test_lookup_and_validators():
+    snapshot = Snapshot.from_dataframe(make_table(PUBLISHED))
+    assert snapshot.get('eur').exch_buy == 780.0
+    assert snapshot.get('JPY') is None
+    assert snapshot.etag == '20230401041405'
+    assert snapshot.last_modified.isoformat() == '2023-03-31T20:14:05+00:00'
+
+
+def test_payloads_are_encoded_on_first_request():
+    snapshot = Snapshot.from_dataframe(make_table(PUBLISHED))
+    assert snapshot.payloads == {}
+    payload = snapshot.payload('eur')
+    assert payload == encode_response(snapshot.response('EUR'))
+    assert snapshot.payload('EUR') is payload
+    assert [record['currency'] for record in json.loads(snapshot.payload('all'))['data']] == ['EUR', 'USD']
+    # projections and unknown codes
+    assert json.loads(snapshot.payload('EUR,USD', 'exch_sell'))['data'][1] == {
+        'currency': 'USD', 'name': '美元', 'datetime': '2023-04-01 04:14:05', 'exch_sell': 693.0}
+    assert snapshot.payload('XXX') is None
+    assert snapshot.payload('EUR', 'price') is None
+
+
+def test_given_payloads_are_served_as_is():
+    snapshot = Snapshot([Quote('EUR', '欧元', 780.0, math.nan, 783.0, 783.0, PUBLISHED)], payloads={'EUR': b'cached'})
+    assert snapshot.payload('EUR') == b'cached'
+
+
+def test_empty_snapshot():
+    with pytest.raises(ValueError):
+        Snapshot([])
+
+
+@pytest.mark.parametrize('content', [
+    '代号,币种,现汇买入价,现钞买入价,现汇卖出价,现钞卖出价,发布时间\n',
+    '代号,币种,现汇买入价,现钞买入价,现汇卖出价,现钞卖出价,发布时间\nEUR,欧元,780.0,774.0\n',
+    '',
+])
+def test_broken_csv_has_no_latest_snapshot(tmp_path, content):
+    (tmp_path / '2023_04_01-04_14_05.csv').write_text(content, encoding='utf-8')
+    assert CSVStorage(str(tmp_path)).latest_snapshot() is None
@@ -0,0 +1,32 @@
+import pytest
+from datetime import datetime
+from bench.stub_icbc import make_page
+from src import sources
+from src.fetch import FetchResult
+from src.parse import parse_html
+
+
+def _broken_parser(html: str):
+    raise ValueError('unexpected markup')
+
+
+@pytest.fixture
+def banks(monkeypatch):
+    # two sources served the same stub page, one of them with a parser that raises
+    monkeypatch.setattr(sources, 'SOURCES', {})
+    sources.register_source('good', 'http://good.invalid/', parse_html)
+    sources.register_source('broken', 'http://broken.invalid/', _broken_parser)
+    page = make_page(datetime(2023, 4, 1, 4, 14, 5))
+    monkeypatch.setattr(sources.fetcher, 'fetch', lambda url, conditional=True: FetchResult(page, True, 200))
+
+
+def test_failing_parser_only_drops_its_source(banks):
+    df, latencies = sources.fetch_sources()
+    assert set(df['bank']) == {'good'}
+    assert set(latencies) == {'good', 'broken'}
+    assert latencies['broken']['total'] >= 0
+
+
+def test_unknown_source(banks):
+    with pytest.raises(KeyError):
+        sources.fetch_sources(['good', 'unknown'])
@@ -0,0 +1,228 @@
+import sqlite3
+import pytest
+import pandas as pd
+from contextlib import closing
+from datetime import datetime
+from bench.stub_icbc import start_stub
+from src import index
+from src.delta import changed_currencies, table_hash
+from src.snapshot import Snapshot
+from src.storage import CSVStorage, SQLiteStorage, Storage
+from src.utils import COLUMNS
+from tests.conftest import make_table
+
+
+class PartialStorage(Storage):
+    # a backend that forgot most of the interface
+    def exists(self) -> bool:
+        return True
+
+
+def test_incomplete_backend_fails_on_construction():
+    with pytest.raises(TypeError):
+        PartialStorage('unused')
+    with pytest.raises(TypeError):
+        Storage('unused')
+
+
+@pytest.mark.parametrize('name', ['csv', 'history.db'])
+def test_backends_are_complete(tmp_path, name):
+    path = tmp_path / name
+    if name == 'csv':
+        path.mkdir()
+    storage = CSVStorage(str(path)) if name == 'csv' else SQLiteStorage(str(path))
+    assert storage.latest_timestamp() is None
+    assert storage.timestamps() == []
+
+
+def frame(ts: datetime, rows: dict) -> pd.DataFrame:
+    # a table published at `ts` with {code: exch_buy} rows (NaN cash quotes for KRW), in the given order
+    names = {'EUR': '欧元', 'USD': '美元', 'GBP': '英镑', 'KRW': '韩元'}
+    return pd.DataFrame([
+        [code, names[code], price, float('nan') if code == 'KRW' else price - 6, price + 3,
+         float('nan') if code == 'KRW' else price + 3, pd.Timestamp(ts)]
+        for code, price in rows.items()
+    ], columns=COLUMNS)
+
+
+def snapshot_at(storage: SQLiteStorage, ts: datetime) -> pd.DataFrame:
+    return storage.load(start=ts, end=ts)
+
+
+def assert_history(storage: SQLiteStorage, tables: list):
+    # every stored snapshot reads back as the full table that was saved, whatever is stored as deltas
+    tables = sorted(tables, key=lambda df: df['发布时间'].iloc[0])
+    assert storage.timestamps() == [df['发布时间'].iloc[0].to_pydatetime() for df in tables]
+    for df in tables:
+        stored = snapshot_at(storage, df['发布时间'].iloc[0])
+        pd.testing.assert_frame_equal(stored, df)
+        assert table_hash(stored) == table_hash(df)
+        assert changed_currencies(df, stored) == []
+    pd.testing.assert_frame_equal(storage.load(), pd.concat(tables, ignore_index=True))
+
+
+def stored_rows(storage: SQLiteStorage, ts: datetime) -> dict:
+    # code -> pos of the rows actually stored for the snapshot at `ts`
+    with closing(sqlite3.connect(storage.path)) as conn:
+        return dict(conn.execute('SELECT code, pos FROM quotes WHERE ts = ?', (str(ts),)))
+
+
+T = [datetime(2023, 4, 1, hour) for hour in range(6)]
+
+
+@pytest.fixture
+def sqlite(tmp_path) -> SQLiteStorage:
+    return SQLiteStorage(str(tmp_path / 'deltas.db'))
+
+
+def test_sqlite_stores_deltas(sqlite):
+    tables = [
+        frame(T[0], {'EUR': 780.0, 'USD': 690.0, 'KRW': 0.5}),
+        frame(T[1], {'EUR': 781.0, 'USD': 690.0, 'KRW': 0.5}),
+        frame(T[2], {'EUR': 781.0, 'USD': 690.0, 'KRW': 0.5}),
+    ]
+    sqlite.save_many(tables)
+    assert stored_rows(sqlite, T[0]) == {'EUR': 0, 'USD': 1, 'KRW': 2}
+    # only the changed currency, then nothing at all
+    assert stored_rows(sqlite, T[1]) == {'EUR': 0}
+    assert stored_rows(sqlite, T[2]) == {}
+    assert_history(sqlite, tables)
+
+
+def test_sqlite_tombstones(sqlite):
+    tables = [
+        frame(T[0], {'EUR': 780.0, 'USD': 690.0}),
+        frame(T[1], {'EUR': 780.0}),
+        frame(T[2], {'EUR': 780.0, 'USD': 690.0}),
+    ]
+    for df in tables:
+        sqlite.save(df)
+    # USD disappears (tombstone) and comes back
+    assert stored_rows(sqlite, T[1]) == {'USD': -1}
+    assert stored_rows(sqlite, T[2]) == {'USD': 1}
+    assert_history(sqlite, tables)
+
+
+def test_sqlite_out_of_order_saves(sqlite, tmp_path):
+    tables = [
+        frame(T[0], {'EUR': 780.0, 'USD': 690.0}),
+        frame(T[1], {'EUR': 781.0, 'USD': 690.0}),
+        frame(T[2], {'EUR': 781.0, 'USD': 691.0}),
+        frame(T[3], {'EUR': 782.0, 'USD': 691.0}),
+    ]
+    sqlite.save_many([tables[3], tables[1], tables[0], tables[2]])
+    assert_history(sqlite, tables)
+
+    # the same snapshots saved one by one, in order, are stored as the same full tables
+    ordered = SQLiteStorage(str(tmp_path / 'ordered.db'))
+    ordered.save_many(tables)
+    pd.testing.assert_frame_equal(sqlite.load(), ordered.load())
+
+
+def test_sqlite_older_snapshot_pins_the_next_one(sqlite):
+    later = [
+        frame(T[2], {'EUR': 781.0, 'USD': 690.0}),
+        frame(T[3], {'EUR': 781.0}),
+        frame(T[4], {'EUR': 782.0}),
+    ]
+    sqlite.save_many(later)
+    assert stored_rows(sqlite, T[3]) == {'USD': -1}
+    # stored between T[2] and T[3], with a currency neither of them has: T[3] must not inherit GBP or the
+    # new EUR price, so its carried over rows are stored explicitly and GBP gets a tombstone
+    older = frame(T[1], {'EUR': 770.0, 'USD': 680.0, 'GBP': 900.0})
+    sqlite.save(older)
+    assert stored_rows(sqlite, T[2]) == {'EUR': 0, 'USD': 1, 'GBP': -1}
+    assert_history(sqlite, [older] + later)
+
+    # replacing a stored snapshot keeps the following ones intact too
+    replaced = frame(T[2], {'GBP': 901.0, 'EUR': 781.0})
+    sqlite.save(replaced)
+    assert_history(sqlite, [older, replaced] + later[1:])
+
+
+def test_sqlite_pin(sqlite):
+    tables = [
+        frame(T[0], {'EUR': 780.0, 'USD': 690.0}),
+        frame(T[1], {'EUR': 781.0, 'USD': 690.0}),
+    ]
+    sqlite.save_many(tables)
+    with closing(sqlite._connect()) as conn, conn:
+        sqlite._pin(conn, str(T[1]), ['GBP'])
+    # the carried over row is stored with the snapshot time, and GBP as a tombstone
+    assert stored_rows(sqlite, T[1]) == {'EUR': 0, 'USD': 1, 'GBP': -1}
+    assert_history(sqlite, tables)
+    # once pinned, T[1] no longer depends on T[0]
+    sqlite.remove([T[0]])
+    assert_history(sqlite, tables[1:])
+
+
+def test_sqlite_remove_middle_snapshots(sqlite):
+    tables = [
+        frame(T[0], {'EUR': 780.0, 'USD': 690.0, 'KRW': 0.5}),
+        frame(T[1], {'EUR': 781.0, 'USD': 690.0, 'KRW': 0.5}),
+        frame(T[2], {'EUR': 781.0, 'KRW': 0.5}),
+        frame(T[3], {'EUR': 781.0, 'USD': 692.0, 'KRW': 0.6}),
+        frame(T[4], {'EUR': 782.0, 'USD': 692.0, 'KRW': 0.6}),
+        frame(T[5], {'EUR': 782.0, 'USD': 692.0, 'KRW': 0.6}),
+    ]
+    sqlite.save_many(tables)
+    assert sqlite.remove([T[1]]) == 1
+    assert_history(sqlite, [tables[i] for i in (0, 2, 3, 4, 5)])
+    # several at once, including the first one
+    assert sqlite.remove([T[0], T[3], T[4]]) == 3
+    assert_history(sqlite, [tables[2], tables[5]])
+
+
+def test_sqlite_rebuilds_ranges_from_the_previous_state(sqlite):
+    tables = [
+        frame(T[0], {'EUR': 780.0, 'USD': 690.0, 'KRW': 0.5}),
+        frame(T[1], {'EUR': 781.0, 'USD': 690.0, 'KRW': 0.5}),
+        frame(T[2], {'EUR': 781.0, 'KRW': 0.5}),
+        frame(T[3], {'EUR': 782.0, 'USD': 692.0, 'KRW': 0.5}),
+    ]
+    sqlite.save_many(tables)
+    # a range starting after the rows it relies on
+    pd.testing.assert_frame_equal(sqlite.load(start=T[2], end=T[3]), pd.concat(tables[2:], ignore_index=True))
+    rows = list(sqlite.iter_rows(start=T[1], end=T[2], currencies=['KRW', 'USD']))
+    expected = [
+        ('USD', '美元', 690.0, 684.0, 693.0, 693.0, str(T[1])),
+        ('KRW', '韩元', 0.5, None, 3.5, None, str(T[1])),
+        ('KRW', '韩元', 0.5, None, 3.5, None, str(T[2])),
+    ]
+    assert len(rows) == len(expected)
+    for row, want in zip(rows, expected):
+        assert row[:2] == want[:2] and row[-1] == want[-1]
+        assert [None if pd.isna(v) else v for v in row[2:6]] == list(want[2:6])
+    assert sqlite.latest_snapshot().payload('all') == Snapshot.from_dataframe(tables[3]).payload('all')
+
+
+def test_pipeline_saves_again_when_the_storage_lost_the_table(tmp_path):
+    stub = start_stub(port=0, published=datetime(2023, 4, 1, 4, 14, 5))
+    url = f'http://127.0.0.1:{stub.server_address[1]}/'
+    path = str(tmp_path / 'pipeline.db')
+    try:
+        df = index.pipeline(url, storage=path)
+        storage = SQLiteStorage(path)
+        assert storage.timestamps() == [datetime(2023, 4, 1, 4, 14, 5)]
+        storage.remove(storage.timestamps())
+        assert storage.latest() is None
+        # same page and table hash, but the storage no longer has it
+        index.pipeline(url, storage=path)
+        pd.testing.assert_frame_equal(storage.latest(), df)
+    finally:
+        stub.shutdown()
+        stub.server_close()
+
+
+def test_csv_version_changes_when_the_manifest_catches_up(tmp_path):
+    storage = CSVStorage(str(tmp_path))
+    storage.save(make_table(datetime(2023, 4, 1)))
+    # a reader between the new snapshot file and its manifest entry still sees the previous snapshot,
+    # the version it got must not be the one of the finished save
+    df = make_table(datetime(2023, 4, 2))
+    df.to_csv(storage._filename(datetime(2023, 4, 2)), header=True, index=False)
+    version = storage.version()
+    assert storage.latest_timestamp() == datetime(2023, 4, 1)
+    storage.save(df)
+    assert storage.version() != version
+    assert storage.latest_timestamp() == datetime(2023, 4, 2)
@@ -0,0 +1,36 @@
+import queue
+import pytest
+from datetime import datetime
+from src import index, metrics
+from src.storage import CSVStorage
+from src.stream import Broadcaster
+from tests.conftest import make_table
+
+
+def test_watcher_never_scrapes(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(index, 'pipeline', lambda *args, **kwargs: calls.append(kwargs))
+    errors = sum(metrics.UPSTREAM_ERRORS.values.values())
+    broadcaster = Broadcaster(str(tmp_path), poll_interval=0.01)
+    subscription = broadcaster.subscribe()
+    try:
+        # an empty storage: nothing to publish, and nothing fetched instead
+        assert subscription.initial == (None, {})
+        assert broadcaster.snapshot is None
+        with pytest.raises(queue.Empty):
+            subscription.buffer.get(timeout=0.1)
+
+        # the first stored snapshot is pushed whole, a new one as an update of what changed
+        storage = CSVStorage(str(tmp_path))
+        storage.save(make_table(datetime(2023, 4, 1, 4, 14, 5)))
+        event = subscription.buffer.get(timeout=2)
+        assert event.startswith(b'id: 20230401041405\nevent: snapshot\n')
+        storage.save(make_table(datetime(2023, 4, 1, 5, 14, 5), usd=691.0))
+        event = subscription.buffer.get(timeout=2)
+        assert event.startswith(b'id: 20230401051405\nevent: update\n')
+        assert b'"currency":"USD"' in event and b'"currency":"EUR"' not in event
+    finally:
+        broadcaster.stop()
+        broadcaster.unsubscribe(subscription)
+    assert calls == []
+    assert sum(metrics.UPSTREAM_ERRORS.values.values()) == errors
@@ -0,0 +1,23 @@
+import json
+from datetime import datetime
+from src import trigger
+from tests.conftest import make_table
+
+
+def test_rule_cooldown_persists_with_blank_state_setting(tmp_path, monkeypatch):
+    # `WATCHER_RULES_STATE=` as in .env.example falls back to <rules file>.state.json
+    rules_file = tmp_path / 'rules.json'
+    rules_file.write_text(json.dumps([{'currency': 'EUR', 'column': 'exch_sell', 'op': '<', 'threshold': 800}]))
+    monkeypatch.setenv('WATCHER_RULES_FILE', str(rules_file))
+    monkeypatch.setenv('WATCHER_RULES_STATE', '')
+    monkeypatch.setattr(trigger, 'dispatcher', None)
+    monkeypatch.setattr(trigger, '_rule_engine', None)
+
+    assert trigger.trigger_watch_rules(make_table(datetime(2023, 4, 1), eur=780.0))
+    state = json.loads((tmp_path / 'rules.json.state.json').read_text())
+    assert len(state) == 1
+
+    # a separate run (cron) loads the cooldown and does not fire again
+    monkeypatch.setattr(trigger, '_rule_engine', None)
+    assert trigger.trigger_watch_rules(make_table(datetime(2023, 4, 1, 1), eur=780.0))
+    assert trigger._rule_engine.last_fired == state